@@ -1,10 +1,14 @@
+import atexit
 import logging
+import os
 import sys
 from pathlib import Path
 from flask import Flask, send_from_directory
 from flask_cors import CORS
 from backend.config import Config
 from backend.routes.api import api_bp
+from backend.services.executor import get_generation_executor
+from backend.services.job_queue import start_job_workers, stop_job_workers
 
 
 def setup_logging():
@@ -59,12 +63,25 @@ def create_app():
         r"/api/*": {
             "origins": Config.CORS_ORIGINS,
             "methods": ["GET", "POST", "OPTIONS"],
-            "allow_headers": ["Content-Type"],
+            "allow_headers": ["Content-Type", "Last-Event-ID", "X-Client-Id", "Idempotency-Key"],
+            "expose_headers": ["X-Job-Id", "X-Task-Id", "Retry-After"],
         }
     })
 
     app.register_blueprint(api_bp)
 
+    # 创建进程共享的图片生成执行器，随应用生命周期存在
+    executor = get_generation_executor()
+    app.extensions['generation_executor'] = executor
+    atexit.register(executor.shutdown)
+
+    # 启动后台任务工作线程（JOB_WORKERS=0 时由独立的 python -m backend.worker 进程执行任务）
+    if _is_serving_process():
+        start_job_workers()
+        atexit.register(stop_job_workers)
+    else:
+        logger.info("🔁 自动重载监视进程，任务工作线程在处理请求的子进程中启动")
+
     # 启动时验证配置
     _validate_config_on_startup(logger)
 
@@ -88,6 +105,11 @@ def create_app():
                     "health": "/api/health",
                     "outline": "POST /api/outline",
                     "generate": "POST /api/generate",
+                    "job": "GET /api/jobs/<job_id>",
+                    "task_events": "GET /api/task/<task_id>/events",
+                    "task_cancel": "POST /api/task/<task_id>/cancel",
+                    "stats": "GET /api/stats",
+                    "breakers": "GET /api/breakers",
                     "images": "GET /api/images/<filename>"
                 }
             }
@@ -95,6 +117,21 @@ def create_app():
     return app
 
 
+def _is_serving_process() -> bool:
+    """
+    当前进程是否处理请求
+
+    python -m backend.app 以调试模式运行时 werkzeug 会启用自动重载：父进程只监视文件变化，
+    由设置了 WERKZEUG_RUN_MAIN 的子进程处理请求，父进程不应执行任务和恢复中断的任务。
+    """
+    reloader_parent = (
+        __name__ == '__main__'
+        and Config.DEBUG
+        and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
+    )
+    return not reloader_parent
+
+
 def _validate_config_on_startup(logger):
     """启动时验证配置"""
     from pathlib import Path
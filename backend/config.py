@@ -19,6 +19,54 @@ class Config:
     GOOGLE_CLOUD_API_KEY = os.getenv('GOOGLE_CLOUD_API_KEY')
     OUTPUT_DIR = os.getenv('OUTPUT_DIR', 'output')
     STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'local')
+    # 共享图片生成线程池的全局工作线程数（各服务商的并发上限在 image_providers.yaml 中配置）
+    GENERATION_MAX_WORKERS = int(os.getenv('GENERATION_MAX_WORKERS', 32))
+    # 页面生成引擎：thread（每页占用一个工作线程）或 async（在一个事件循环中以协程执行，不占用线程）
+    GENERATION_ENGINE = os.getenv('GENERATION_ENGINE', 'thread').strip().lower()
+    # async 引擎同时执行的页面数上限（同时也是共享 HTTP 连接池的连接数上限）
+    ASYNC_MAX_INFLIGHT_PAGES = int(os.getenv('ASYNC_MAX_INFLIGHT_PAGES', 1000))
+    # 排队页面每等待多少秒提升一个调度优先级（防止批量补全等低优先级页面饿死，0 表示严格按优先级）
+    SCHEDULER_AGING_SECONDS = float(os.getenv('SCHEDULER_AGING_SECONDS', 10))
+    # 同一优先级内按客户端（X-Client-Id，没有时按任务）公平分配服务商并发；可为客户端配置权重，如 "vip:2,guest:0.5"
+    SCHEDULER_TENANT_WEIGHTS = os.getenv('SCHEDULER_TENANT_WEIGHTS', '')
+    # 图片压缩结果缓存（MB，按内容哈希复用同一参考图/封面图的压缩结果，0 表示不缓存）
+    IMAGE_COMPRESS_CACHE_MB = float(os.getenv('IMAGE_COMPRESS_CACHE_MB', 32))
+    # 请求截止时间（秒，0 表示不限制）；部署在 Vercel 时默认略小于 vercel.json 中的 maxDuration (60)
+    GENERATION_DEADLINE_SECONDS = float(os.getenv('GENERATION_DEADLINE_SECONDS', 55 if os.getenv('VERCEL') else 0))
+    TEXT_DEADLINE_SECONDS = float(os.getenv('TEXT_DEADLINE_SECONDS', 55 if os.getenv('VERCEL') else 0))
+    # 后台任务队列（SQLite）：数据库路径（默认 history/jobs.db）、当前进程同时执行的任务数
+    # （0 表示只入队，由独立的 python -m backend.worker 进程执行）、租约时长和已结束任务的保留时长；
+    # 任务线程只等待共享执行器中的页面，服务商并发不受任务数影响，任务数应不低于准入控制允许的任务数
+    JOB_QUEUE_PATH = os.getenv('JOB_QUEUE_PATH', '')
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', 16))
+    JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', 60))
+    JOB_RETENTION_HOURS = float(os.getenv('JOB_RETENTION_HOURS', 24))
+    # 每个任务保留的 SSE 事件数（断线重连时按 Last-Event-ID 重放）
+    JOB_EVENT_BUFFER_SIZE = int(os.getenv('JOB_EVENT_BUFFER_SIZE', 500))
+    # SSE 订阅者全部断开多久后取消任务（秒，0 表示客户端断开后任务继续执行）
+    JOB_ABANDON_SECONDS = float(os.getenv('JOB_ABANDON_SECONDS', 120))
+    # 准入控制：实例饱和时 /api/generate 和 /api/outline 返回 503（单个客户端任务过多时返回 429）并带 Retry-After；
+    # 阈值分别为排队任务数、执行器中的页面数、新任务的估算等待秒数、每个客户端同时进行的任务数、同时生成的大纲数（0 表示不检查）；
+    # 排队任务数和页面数留空时按可同时执行的任务数（JOB_WORKERS）和执行器容量（各服务商并发上限之和）自动计算
+    ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'True').lower() == 'true'
+    ADMISSION_MAX_QUEUED_JOBS = int(os.getenv('ADMISSION_MAX_QUEUED_JOBS') or -1)
+    ADMISSION_MAX_INFLIGHT_PAGES = int(os.getenv('ADMISSION_MAX_INFLIGHT_PAGES') or -1)
+    ADMISSION_MAX_WAIT_SECONDS = float(os.getenv('ADMISSION_MAX_WAIT_SECONDS', 300))
+    ADMISSION_MAX_JOBS_PER_CLIENT = int(os.getenv('ADMISSION_MAX_JOBS_PER_CLIENT', 3))
+    ADMISSION_MAX_OUTLINE_INFLIGHT = int(os.getenv('ADMISSION_MAX_OUTLINE_INFLIGHT', 16))
+    # 显式传入 Idempotency-Key 的 /api/regenerate 请求，成功结果在进程内保留多久（秒）用于重复提交
+    IDEMPOTENCY_TTL_SECONDS = float(os.getenv('IDEMPOTENCY_TTL_SECONDS', 3600))
+    # 启动时是否自动继续被进程退出中断的生成任务（否则只把缺失页面标记为可重试），
+    # 以及只恢复最近多少小时内的任务
+    TASK_AUTO_RESUME = os.getenv('TASK_AUTO_RESUME', 'True').lower() == 'true'
+    TASK_RECOVERY_MAX_AGE_HOURS = float(os.getenv('TASK_RECOVERY_MAX_AGE_HOURS', 24))
+    # 内存中任务上下文的图片数据预算（MB，超出后溢出到任务目录或移出内存）和未访问过期时间（秒）
+    TASK_STATE_MAX_MB = float(os.getenv('TASK_STATE_MAX_MB', 64))
+    TASK_STATE_TTL_SECONDS = float(os.getenv('TASK_STATE_TTL_SECONDS', 3600))
+    # 任务状态后端：memory（默认，本地 history 目录）或 redis（多个工作进程/节点共享）
+    TASK_STATE_BACKEND = os.getenv('TASK_STATE_BACKEND', 'memory').lower()
+    TASK_STATE_REDIS_URL = os.getenv('TASK_STATE_REDIS_URL', '')
+    TASK_STATE_REDIS_TTL_HOURS = float(os.getenv('TASK_STATE_REDIS_TTL_HOURS', 72))
 
     _image_providers_config = None
     _text_providers_config = None
@@ -139,6 +187,53 @@ class Config:
         # 允许通过环境变量覆盖
         return os.getenv('IMAGE_PROVIDER', config.get('active_provider', 'google_genai'))
 
+    @classmethod
+    def get_image_provider_pool(cls):
+        """
+        获取图片服务商池
+
+        image_providers.yaml 中配置 provider_pool（服务商名称列表）时，页面按各服务商的
+        weight 分配到池中的服务商，失败时切换到池中其他服务商；未配置时只使用激活的服务商。
+        """
+        config = cls.load_image_providers_config()
+        providers = config.get('providers', {})
+
+        pool = []
+        for entry in config.get('provider_pool') or []:
+            name = entry.get('name') if isinstance(entry, dict) else entry
+            if name in pool:
+                continue
+            if name not in providers:
+                logger.warning(f"provider_pool 中的服务商 [{name}] 不存在，已忽略")
+                continue
+            pool.append(name)
+
+        return pool or [cls.get_active_image_provider()]
+
+    @classmethod
+    def get_page_routing(cls):
+        """
+        获取按页面类型的路由规则
+
+        image_providers.yaml 中的 page_routing 把页面类型（cover / content / summary）
+        映射到服务商、模型和分辨率，例如封面使用高质量模型，内容页使用更快的模型。
+
+        Returns:
+            页面类型 -> 规则字典（provider、model、image_size、size、quality，均可选）
+        """
+        config = cls.load_image_providers_config()
+        providers = config.get('providers', {})
+
+        routing = {}
+        for page_type, rule in (config.get('page_routing') or {}).items():
+            if not isinstance(rule, dict):
+                continue
+            if rule.get('provider') and rule['provider'] not in providers:
+                logger.warning(f"page_routing.{page_type} 中的服务商 [{rule['provider']}] 不存在，已忽略该规则")
+                continue
+            routing[page_type] = rule
+        return routing
+
     @classmethod
     def get_image_provider_config(cls, provider_name: str = None):
         config = cls.load_image_providers_config()
@@ -151,6 +246,12 @@ class Config:
             raise ValueError(f"未找到图片生成服务商配置: {provider_name}\n可用的服务商: {available}")
 
         provider_config = config['providers'][provider_name].copy()
+        provider_config['name'] = provider_name
+
+        # provider_pool 中以 {name, weight} 形式填写的权重
+        for entry in config.get('provider_pool') or []:
+            if isinstance(entry, dict) and entry.get('name') == provider_name and 'weight' in entry:
+                provider_config['weight'] = entry['weight']
 
         # Handle API Key from Env (User feature)
         api_key_env = provider_config.get('api_key_env')
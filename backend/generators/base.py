@@ -1,6 +1,19 @@
 """图片生成器抽象基类"""
 from abc import ABC, abstractmethod
 from typing import Dict, Any, Optional
+import httpx
+from ..utils.async_http import get_async_http_client
+from ..utils.circuit_breaker import get_circuit_breaker
+from ..utils.retry import get_retry_policy
+
+
+class ProviderHTTPError(Exception):
+    """服务商 HTTP 请求失败（携带状态码和服务商建议的重试等待时间）"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
 
 
 class ImageGeneratorBase(ABC):
@@ -16,6 +29,12 @@ class ImageGeneratorBase(ABC):
         self.config = config
         self.api_key = config.get('api_key')
         self.base_url = config.get('base_url')
+        # 服务商名称（用于按服务商共享的限流、并发控制）
+        self.provider_name = config.get('name') or config.get('type', 'default')
+        # 该服务商的重试策略（所有任务共享同一份重试预算）
+        self.retry_policy = get_retry_policy(self.provider_name, config)
+        # 该服务商的熔断器（连续失败或失败率过高时快速失败）
+        self.circuit_breaker = get_circuit_breaker(self.provider_name, "image", config)
 
     @abstractmethod
     def generate_image(
@@ -28,7 +47,8 @@ class ImageGeneratorBase(ABC):
 
         Args:
             prompt: 提示词
-            **kwargs: 其他参数（如分辨率、宽高比等）
+            **kwargs: 其他参数（如分辨率、宽高比等）；支持参考图的生成器接受
+                reference_bundle（ReferenceBundle，每个任务预先编码一次的参考图）
 
         Returns:
             图片二进制数据
@@ -62,3 +82,35 @@ class ImageGeneratorBase(ABC):
             支持的宽高比列表
         """
         return self.config.get('supported_aspect_ratios', ['1:1', '3:4', '16:9'])
+
+
+class AsyncImageGeneratorBase(ImageGeneratorBase):
+    """
+    支持协程调用的图片生成器基类
+
+    除同步的 generate_image 外，还实现参数相同的 agenerate_image：在异步生成引擎的
+    事件循环中执行，等待服务商响应、重试退避和限流冷却期间都不占用线程。
+    """
+
+    @abstractmethod
+    async def agenerate_image(
+        self,
+        prompt: str,
+        **kwargs
+    ) -> bytes:
+        """
+        生成图片（协程版本，参数和返回值同 generate_image）
+
+        Args:
+            prompt: 提示词
+            **kwargs: 其他参数
+
+        Returns:
+            图片二进制数据
+        """
+        pass
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        """当前事件循环共享的 HTTP 客户端（只能在事件循环中使用）"""
+        return get_async_http_client()
@@ -1,59 +1,19 @@
 """Google GenAI 图片生成器"""
 import logging
-import time
-import random
 import base64
-from functools import wraps
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from google import genai
 from google.genai import types
-from .base import ImageGeneratorBase
+from .base import AsyncImageGeneratorBase
+from ..utils.deadline import Deadline, DeadlineExceededError, resolve_deadline
+from ..utils.retry import retry_with_policy, aretry_with_policy, ContentBlockedError
 from ..utils.image_compressor import compress_image
+from ..utils.reference import ReferenceBundle
 
 logger = logging.getLogger(__name__)
 
 
-def retry_on_429(max_retries=5, base_delay=3):
-    """429 错误自动重试装饰器"""
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            last_error = None
-            for attempt in range(max_retries):
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    last_error = e
-                    error_str = str(e)
-                    if "429" in error_str or "RESOURCE_EXHAUSTED" in error_str:
-                        if attempt < max_retries - 1:
-                            # 指数退避 + 随机抖动
-                            wait_time = (base_delay ** attempt) + random.uniform(0, 1)
-                            logger.warning(f"遇到资源限制 (429)，{wait_time:.1f}秒后重试 (尝试 {attempt + 2}/{max_retries})")
-                            time.sleep(wait_time)
-                            continue
-                    # 其他错误也进行重试
-                    elif attempt < max_retries - 1:
-                        wait_time = min(2 ** attempt, 10) + random.uniform(0, 1)
-                        logger.warning(f"请求失败: {error_str[:100]}，{wait_time:.1f}秒后重试 (尝试 {attempt + 2}/{max_retries})")
-                        time.sleep(wait_time)
-                        continue
-                    raise
-            logger.error(f"图片生成失败: 重试 {max_retries} 次后仍失败")
-            raise Exception(
-                f"图片生成失败：重试 {max_retries} 次后仍失败。\n"
-                f"最后错误: {last_error}\n"
-                "可能原因：\n"
-                "1. API配额已用尽或达到速率限制\n"
-                "2. 网络连接不稳定\n"
-                "3. API服务暂时不可用\n"
-                "建议：稍后再试，或检查API配额和网络状态"
-            )
-        return wrapper
-    return decorator
-
-
-class GoogleGenAIGenerator(ImageGeneratorBase):
+class GoogleGenAIGenerator(AsyncImageGeneratorBase):
     """Google GenAI 图片生成器"""
 
     def __init__(self, config: Dict[str, Any]):
@@ -88,7 +48,7 @@ class GoogleGenAIGenerator(ImageGeneratorBase):
         """验证配置"""
         return bool(self.api_key)
 
-    @retry_on_429(max_retries=5, base_delay=3)
+    @retry_with_policy
     def generate_image(
         self,
         prompt: str,
@@ -96,41 +56,141 @@ class GoogleGenAIGenerator(ImageGeneratorBase):
         temperature: float = 1.0,
         model: str = "gemini-3-pro-image-preview",
         reference_image: Optional[bytes] = None,
+        image_size: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+        reference_bundle: Optional[ReferenceBundle] = None,
         **kwargs
     ) -> bytes:
         """
         生成图片
 
+        收到图片数据后立即停止读取并关闭流式响应，不再等待服务商发送剩余内容。
+
         Args:
             prompt: 提示词
             aspect_ratio: 宽高比 (如 "3:4", "1:1", "16:9")
             temperature: 温度
             model: 模型名称
             reference_image: 参考图片二进制数据（用于保持风格一致）
+            image_size: 分辨率（如 "1K"、"2K"、"4K"，不传时使用模型默认值）
+            deadline: 任务截止时间（请求超时按剩余时间收缩，流式读取期间也会检查）
+            reference_bundle: 任务预先编码的参考图（使用其中的封面图 Part，优先于 reference_image）
             **kwargs: 其他参数
 
         Returns:
             图片二进制数据
         """
+        deadline = resolve_deadline(deadline)
+        contents, generate_content_config = self._build_request(
+            prompt, aspect_ratio, temperature, model, reference_image, image_size, deadline, reference_bundle
+        )
+
+        result = _StreamResult()
+        logger.debug(f"  开始调用 API: model={model}")
+        stream = self.client.models.generate_content_stream(
+            model=model,
+            contents=contents,
+            config=generate_content_config,
+        )
+        try:
+            for chunk in stream:
+                _check_stream_deadline(deadline)
+                if result.feed(chunk):
+                    break
+        finally:
+            # 提前结束时关闭底层连接，不再读取剩余的流式响应
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+
+        return result.image()
+
+    @aretry_with_policy
+    async def agenerate_image(
+        self,
+        prompt: str,
+        aspect_ratio: str = "3:4",
+        temperature: float = 1.0,
+        model: str = "gemini-3-pro-image-preview",
+        reference_image: Optional[bytes] = None,
+        image_size: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+        reference_bundle: Optional[ReferenceBundle] = None,
+        **kwargs
+    ) -> bytes:
+        """
+        生成图片（协程版本，基于 SDK 的 client.aio 接口）
+
+        多个页面可以在同一个事件循环中并发生成，等待服务商响应期间不占用线程。
+        参数和返回值同 generate_image()。
+        """
+        deadline = resolve_deadline(deadline)
+        contents, generate_content_config = self._build_request(
+            prompt, aspect_ratio, temperature, model, reference_image, image_size, deadline, reference_bundle
+        )
+
+        result = _StreamResult()
+        logger.debug(f"  开始调用 API (async): model={model}")
+        stream = await self.client.aio.models.generate_content_stream(
+            model=model,
+            contents=contents,
+            config=generate_content_config,
+        )
+        try:
+            async for chunk in stream:
+                _check_stream_deadline(deadline)
+                if result.feed(chunk):
+                    break
+        finally:
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+        return result.image()
+
+    def _build_request(
+        self,
+        prompt: str,
+        aspect_ratio: str,
+        temperature: float,
+        model: str,
+        reference_image: Optional[bytes],
+        image_size: Optional[str],
+        deadline: Deadline,
+        reference_bundle: Optional[ReferenceBundle]
+    ) -> Tuple[List[types.Content], types.GenerateContentConfig]:
+        """
+        构建请求内容和生成配置
+
+        Returns:
+            (contents, generate_content_config)
+        """
+        cover_reference = reference_bundle.cover if reference_bundle else None
         logger.info(f"Google GenAI 生成图片: model={model}, aspect_ratio={aspect_ratio}")
-        logger.debug(f"  prompt 长度: {len(prompt)} 字符, 有参考图: {reference_image is not None}")
+        logger.debug(
+            f"  prompt 长度: {len(prompt)} 字符, 有参考图: {cover_reference is not None or reference_image is not None}"
+        )
 
         # 构建 parts 列表
         parts = []
 
         # 如果有参考图，先添加参考图和说明
-        if reference_image:
-            logger.debug(f"  添加参考图片 ({len(reference_image)} bytes)")
-            # 压缩参考图到 200KB 以内
-            compressed_ref = compress_image(reference_image, max_size_kb=200)
-            logger.debug(f"  参考图压缩后: {len(compressed_ref)} bytes")
-            # 添加参考图
-            parts.append(types.Part(
-                inline_data=types.Blob(
-                    mime_type="image/png",
-                    data=compressed_ref
-                )
-            ))
+        if cover_reference is not None or reference_image:
+            if cover_reference is not None:
+                # 任务预先构建的封面图 Part，每页直接引用
+                parts.append(cover_reference.genai_part)
+            else:
+                logger.debug(f"  添加参考图片 ({len(reference_image)} bytes)")
+                # 压缩参考图到 200KB 以内
+                compressed_ref = compress_image(reference_image, max_size_kb=200)
+                logger.debug(f"  参考图压缩后: {len(compressed_ref)} bytes")
+                # 添加参考图
+                parts.append(types.Part(
+                    inline_data=types.Blob(
+                        mime_type="image/png",
+                        data=compressed_ref
+                    )
+                ))
             # 添加带参考说明的提示词
             enhanced_prompt = f"""请参考上面这张图片的视觉风格（包括配色、排版风格、字体风格、装饰元素风格），生成一张风格一致的新图片。
 
@@ -154,6 +214,9 @@ class GoogleGenAIGenerator(ImageGeneratorBase):
             )
         ]
 
+        # 请求超时（默认 300 秒，按任务剩余时间收缩；HttpOptions.timeout 单位为毫秒）
+        http_options = types.HttpOptions(timeout=int(deadline.timeout(300, "Google GenAI 请求") * 1000))
+
         generate_content_config = types.GenerateContentConfig(
             temperature=temperature,
             top_p=0.95,
@@ -162,26 +225,73 @@ class GoogleGenAIGenerator(ImageGeneratorBase):
             safety_settings=self.safety_settings,
             image_config=types.ImageConfig(
                 aspect_ratio=aspect_ratio,
+                image_size=image_size,
                 output_mime_type="image/png",
             ),
+            http_options=http_options,
         )
+        return contents, generate_content_config
 
-        image_data = None
-        logger.debug(f"  开始调用 API: model={model}")
-        for chunk in self.client.models.generate_content_stream(
-            model=model,
-            contents=contents,
-            config=generate_content_config,
-        ):
-            if chunk.candidates and chunk.candidates[0].content and chunk.candidates[0].content.parts:
-                for part in chunk.candidates[0].content.parts:
-                    # 检查是否有图片数据
-                    if hasattr(part, 'inline_data') and part.inline_data:
-                        image_data = part.inline_data.data
-                        logger.debug(f"  收到图片数据: {len(image_data)} bytes")
-                        break
-
-        if not image_data:
+    def get_supported_aspect_ratios(self) -> list:
+        """获取支持的宽高比"""
+        return ["1:1", "3:4", "4:3", "16:9", "9:16"]
+
+
+def _check_stream_deadline(deadline: Deadline):
+    """读取流式响应期间检查任务是否被取消或超过截止时间"""
+    deadline.check_cancelled("图片生成")
+    if deadline.expired():
+        raise DeadlineExceededError(
+            "图片生成失败：读取 Google GenAI 流式响应时超过任务截止时间 (deadline exceeded)"
+        )
+
+
+class _StreamResult:
+    """逐块解析 generate_content_stream 的响应，记录第一张图片和安全拦截原因"""
+
+    def __init__(self):
+        self.image_data: Optional[bytes] = None
+        self.block_reason: Optional[str] = None
+
+    def feed(self, chunk) -> bool:
+        """
+        处理一个响应块
+
+        Returns:
+            是否已收到完整的图片（可以停止读取）
+        """
+        # 记录安全拦截原因（提示词被拦截或候选结果因安全原因终止）
+        if chunk.prompt_feedback and chunk.prompt_feedback.block_reason:
+            self.block_reason = str(chunk.prompt_feedback.block_reason)
+        if chunk.candidates and chunk.candidates[0].finish_reason:
+            finish_reason = str(chunk.candidates[0].finish_reason)
+            if any(marker in finish_reason for marker in ("SAFETY", "PROHIBITED_CONTENT", "BLOCKLIST")):
+                self.block_reason = finish_reason
+        if chunk.candidates and chunk.candidates[0].content and chunk.candidates[0].content.parts:
+            for part in chunk.candidates[0].content.parts:
+                # inline_data 在一个响应块中完整返回，收到即可结束
+                if getattr(part, 'inline_data', None) and part.inline_data.data:
+                    self.image_data = part.inline_data.data
+                    logger.debug(f"  收到图片数据: {len(self.image_data)} bytes")
+                    return True
+        return False
+
+    def image(self) -> bytes:
+        """
+        读取结束后的图片数据
+
+        Raises:
+            ContentBlockedError: 被安全策略拦截
+            ValueError: 没有返回图片
+        """
+        if not self.image_data and self.block_reason:
+            logger.error(f"图片生成被安全策略拦截: {self.block_reason}")
+            raise ContentBlockedError(
+                f"图片生成失败：内容被安全策略拦截 ({self.block_reason})。\n"
+                "建议：修改该页内容或提示词后重试"
+            )
+
+        if not self.image_data:
             logger.error("API 返回为空，未生成图片")
             raise ValueError(
                 "图片生成失败：API返回为空。\n"
@@ -192,9 +302,5 @@ class GoogleGenAIGenerator(ImageGeneratorBase):
                 "建议：修改提示词内容后重试，或检查网络连接"
             )
 
-        logger.info(f"✅ Google GenAI 图片生成成功: {len(image_data)} bytes")
-        return image_data
-
-    def get_supported_aspect_ratios(self) -> list:
-        """获取支持的宽高比"""
-        return ["1:1", "3:4", "4:3", "16:9", "9:16"]
+        logger.info(f"✅ Google GenAI 图片生成成功: {len(self.image_data)} bytes")
+        return self.image_data
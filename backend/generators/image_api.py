@@ -1,36 +1,20 @@
 """Image API 图片生成器"""
 import logging
-import time
-import random
 import base64
 import requests
-from typing import Dict, Any, Optional, List
-from .base import ImageGeneratorBase
+from typing import Dict, Any, Optional, List, Tuple
+from .base import AsyncImageGeneratorBase, ProviderHTTPError
+from ..utils.deadline import Deadline, resolve_deadline
+from ..utils.flow_control import parse_retry_after
+from ..utils.image_response import aread_b64_json_image, read_b64_json_image
+from ..utils.retry import aretry_with_policy, retry_with_policy
 from ..utils.image_compressor import compress_image
+from ..utils.reference import ReferenceBundle
 
 logger = logging.getLogger(__name__)
 
 
-def retry_on_error(max_retries: int = 3, base_delay: float = 2):
-    """错误重试装饰器"""
-    def decorator(func):
-        def wrapper(*args, **kwargs):
-            last_error = None
-            for attempt in range(max_retries):
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    last_error = e
-                    if attempt < max_retries - 1:
-                        delay = base_delay * (2 ** attempt) + random.uniform(0, 1)
-                        logger.warning(f"请求失败，{delay:.1f}秒后重试 (尝试 {attempt + 2}/{max_retries}): {str(e)[:100]}")
-                        time.sleep(delay)
-            raise last_error
-        return wrapper
-    return decorator
-
-
-class ImageApiGenerator(ImageGeneratorBase):
+class ImageApiGenerator(AsyncImageGeneratorBase):
     """Image API 生成器"""
 
     def __init__(self, config: Dict[str, Any]):
@@ -60,7 +44,7 @@ class ImageApiGenerator(ImageGeneratorBase):
         """获取支持的宽高比"""
         return ["1:1", "2:3", "3:2", "3:4", "4:3", "4:5", "5:4", "9:16", "16:9", "21:9"]
 
-    @retry_on_error(max_retries=3, base_delay=2)
+    @retry_with_policy
     def generate_image(
         self,
         prompt: str,
@@ -69,6 +53,9 @@ class ImageApiGenerator(ImageGeneratorBase):
         model: str = None,
         reference_image: Optional[bytes] = None,
         reference_images: Optional[List[bytes]] = None,
+        image_size: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+        reference_bundle: Optional[ReferenceBundle] = None,
         **kwargs
     ) -> bytes:
         """
@@ -81,12 +68,93 @@ class ImageApiGenerator(ImageGeneratorBase):
             model: 模型名称
             reference_image: 单张参考图片数据（向后兼容）
             reference_images: 多张参考图片数据列表
+            image_size: 分辨率（如 "1K"、"2K"、"4K"，默认使用配置中的 image_size）
+            deadline: 任务截止时间（请求超时按剩余时间收缩）
+            reference_bundle: 任务预先编码的参考图（优先于 reference_image / reference_images，
+                直接引用已生成的 Data URI）
 
         Returns:
             生成的图片二进制数据
         """
         self.validate_config()
+        deadline = resolve_deadline(deadline)
+        api_url, headers, payload = self._build_request(
+            prompt, aspect_ratio, model, reference_image, reference_images, image_size, reference_bundle
+        )
+
+        # 发送请求
+        logger.debug(f"  发送请求到: {api_url}")
+        # 流式读取响应：4K 图片的 b64_json 有数十 MB，边读取边解码
+        response = requests.post(
+            api_url,
+            headers=headers,
+            json=payload,
+            timeout=deadline.timeout(300, "Image API 请求"),
+            stream=True
+        )
+
+        if response.status_code != 200:
+            raise self._request_error(api_url, response.status_code, response.text[:500], response.headers)
+
+        # 提取 b64_json 数据（自动去掉 Data URI 前缀 data:image/png;base64,）
+        image_data, _, preview = read_b64_json_image(response, deadline, "读取 Image API 响应")
+        return self._extract_image(image_data, preview)
+
+    @aretry_with_policy
+    async def agenerate_image(
+        self,
+        prompt: str,
+        aspect_ratio: str = None,
+        temperature: float = 1.0,
+        model: str = None,
+        reference_image: Optional[bytes] = None,
+        reference_images: Optional[List[bytes]] = None,
+        image_size: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+        reference_bundle: Optional[ReferenceBundle] = None,
+        **kwargs
+    ) -> bytes:
+        """
+        生成图片（协程版本，参数和返回值同 generate_image）
+        """
+        self.validate_config()
+        deadline = resolve_deadline(deadline)
+        api_url, headers, payload = self._build_request(
+            prompt, aspect_ratio, model, reference_image, reference_images, image_size, reference_bundle
+        )
+
+        logger.debug(f"  发送请求到: {api_url}")
+        request = self.http_client.build_request(
+            "POST", api_url, headers=headers, json=payload, timeout=deadline.timeout(300, "Image API 请求")
+        )
+        response = await self.http_client.send(request, stream=True)
+
+        if response.status_code != 200:
+            try:
+                await response.aread()
+            finally:
+                await response.aclose()
+            raise self._request_error(api_url, response.status_code, response.text[:500], response.headers)
+
+        image_data, _, preview = await aread_b64_json_image(response, deadline, "读取 Image API 响应")
+        return self._extract_image(image_data, preview)
+
+    def _build_request(
+        self,
+        prompt: str,
+        aspect_ratio: Optional[str],
+        model: Optional[str],
+        reference_image: Optional[bytes],
+        reference_images: Optional[List[bytes]],
+        image_size: Optional[str],
+        reference_bundle: Optional[ReferenceBundle]
+    ) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+        """
+        构建请求
 
+        Returns:
+            (请求地址, 请求头, 请求体)
+        """
         if aspect_ratio is None:
             aspect_ratio = self.default_aspect_ratio
 
@@ -106,36 +174,39 @@ class ImageApiGenerator(ImageGeneratorBase):
             "prompt": prompt,
             "response_format": "b64_json",  # 关键！获取 base64 数据而不是 URL
             "aspect_ratio": aspect_ratio,
-            "image_size": self.image_size  # 4K 参数（nano-banana-2 专属）
+            "image_size": image_size or self.image_size  # 4K 参数（nano-banana-2 专属）
         }
 
-        # 收集所有参考图片
-        all_reference_images = []
+        image_uris = []
+        if reference_bundle:
+            # 任务预先编码的参考图：每页只引用同一份 Data URI
+            image_uris = [reference.data_uri for reference in reference_bundle.all()]
+        else:
+            # 收集所有参考图片
+            all_reference_images = []
 
-        # 优先使用 reference_images 列表
-        if reference_images and len(reference_images) > 0:
-            all_reference_images.extend(reference_images)
+            # 优先使用 reference_images 列表
+            if reference_images and len(reference_images) > 0:
+                all_reference_images.extend(reference_images)
 
-        # 向后兼容：如果有单张 reference_image，添加到列表
-        if reference_image and reference_image not in all_reference_images:
-            all_reference_images.append(reference_image)
+            # 向后兼容：如果有单张 reference_image，添加到列表
+            if reference_image and reference_image not in all_reference_images:
+                all_reference_images.append(reference_image)
 
-        # 如果有参考图片，添加到 image 数组（Data URI 格式）
-        if all_reference_images:
-            logger.debug(f"  添加 {len(all_reference_images)} 张参考图片")
-            image_uris = []
             for idx, img_data in enumerate(all_reference_images):
                 # 压缩图片到 200KB 以内
                 compressed_img = compress_image(img_data, max_size_kb=200)
                 logger.debug(f"  参考图 {idx}: {len(img_data)} -> {len(compressed_img)} bytes")
                 base64_image = base64.b64encode(compressed_img).decode('utf-8')
-                data_uri = f"data:image/png;base64,{base64_image}"
-                image_uris.append(data_uri)
+                image_uris.append(f"data:image/png;base64,{base64_image}")
 
+        # 如果有参考图片，添加到 image 数组（Data URI 格式）
+        if image_uris:
+            logger.debug(f"  添加 {len(image_uris)} 张参考图片")
             payload["image"] = image_uris  # images/generations 端点使用 image 数组
 
             # 增强提示词以利用参考图
-            ref_count = len(all_reference_images)
+            ref_count = len(image_uris)
             enhanced_prompt = f"""参考提供的 {ref_count} 张图片的风格（色彩、光影、构图、氛围），生成一张新图片。
 
 新图片内容：{prompt}
@@ -147,56 +218,36 @@ class ImageApiGenerator(ImageGeneratorBase):
 4. 如果参考图中有人物或产品，可以适当融入"""
             payload["prompt"] = enhanced_prompt
 
-        # 发送请求
         api_url = f"{self.base_url}/v1/images/generations"
-        logger.debug(f"  发送请求到: {api_url}")
-        response = requests.post(
-            api_url,
-            headers=headers,
-            json=payload,
-            timeout=300
+        return api_url, headers, payload
+
+    def _request_error(self, api_url: str, status_code: int, error_detail: str, headers) -> ProviderHTTPError:
+        """构造请求失败的错误（携带状态码和 Retry-After）"""
+        logger.error(f"Image API 请求失败: status={status_code}, error={error_detail}")
+        return ProviderHTTPError(
+            f"Image API 请求失败 (状态码: {status_code})\n"
+            f"错误详情: {error_detail}\n"
+            f"请求地址: {api_url}\n"
+            "可能原因：\n"
+            "1. API密钥无效或已过期\n"
+            "2. 请求参数不符合API要求\n"
+            "3. API服务端错误\n"
+            "4. Base URL配置错误\n"
+            "建议：检查API密钥和base_url配置",
+            status_code=status_code,
+            retry_after=parse_retry_after(headers.get('Retry-After'))
         )
 
-        if response.status_code != 200:
-            error_detail = response.text[:500]
-            logger.error(f"Image API 请求失败: status={response.status_code}, error={error_detail}")
-            raise Exception(
-                f"Image API 请求失败 (状态码: {response.status_code})\n"
-                f"错误详情: {error_detail}\n"
-                f"请求地址: {api_url}\n"
-                "可能原因：\n"
-                "1. API密钥无效或已过期\n"
-                "2. 请求参数不符合API要求\n"
-                "3. API服务端错误\n"
-                "4. Base URL配置错误\n"
-                "建议：检查API密钥和base_url配置"
-            )
-
-        result = response.json()
-        logger.debug(f"  API 响应: data 长度={len(result.get('data', []))}")
-
-        # 提取 b64_json 数据
-        if "data" in result and len(result["data"]) > 0:
-            item = result["data"][0]
-
-            if "b64_json" in item:
-                b64_data_uri = item["b64_json"]
-
-                # 去掉 Data URI 前缀（data:image/png;base64,）
-                if b64_data_uri.startswith('data:'):
-                    b64_string = b64_data_uri.split(',', 1)[1]
-                else:
-                    b64_string = b64_data_uri
-
-                # 解码 base64
-                image_data = base64.b64decode(b64_string)
-                logger.info(f"✅ Image API 图片生成成功: {len(image_data)} bytes")
-                return image_data
+    def _extract_image(self, image_data: Optional[bytes], preview: str) -> bytes:
+        """返回解码得到的图片；响应中没有 b64_json 时抛出错误"""
+        if image_data:
+            logger.info(f"✅ Image API 图片生成成功: {len(image_data)} bytes")
+            return image_data
 
-        logger.error(f"无法从响应中提取图片数据: {str(result)[:200]}")
+        logger.error(f"无法从响应中提取图片数据: {preview[:200]}")
         raise Exception(
             f"图片数据提取失败：未找到 b64_json 数据。\n"
-            f"API响应片段: {str(result)[:500]}\n"
+            f"API响应片段: {preview}\n"
             "可能原因：\n"
             "1. API返回格式与预期不符\n"
             "2. response_format 参数未生效\n"
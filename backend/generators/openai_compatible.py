@@ -1,54 +1,18 @@
 """OpenAI 兼容接口图片生成器"""
 import logging
-import time
-import random
 import base64
-from functools import wraps
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
 import requests
-from .base import ImageGeneratorBase
+from .base import AsyncImageGeneratorBase, ProviderHTTPError
+from ..utils.deadline import Deadline, resolve_deadline
+from ..utils.flow_control import parse_retry_after
+from ..utils.image_response import aread_b64_json_image, read_b64_json_image
+from ..utils.retry import aretry_with_policy, retry_with_policy
 
 logger = logging.getLogger(__name__)
 
 
-def retry_on_error(max_retries=5, base_delay=3):
-    """错误自动重试装饰器"""
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            for attempt in range(max_retries):
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    error_str = str(e)
-                    # 检查是否是速率限制错误
-                    if "429" in error_str or "rate" in error_str.lower():
-                        if attempt < max_retries - 1:
-                            wait_time = (base_delay ** attempt) + random.uniform(0, 1)
-                            logger.warning(f"遇到速率限制，{wait_time:.1f}秒后重试 (尝试 {attempt + 2}/{max_retries})")
-                            time.sleep(wait_time)
-                            continue
-                    # 其他错误或重试耗尽
-                    if attempt < max_retries - 1:
-                        wait_time = 2 ** attempt
-                        logger.warning(f"请求失败: {error_str[:100]}，{wait_time}秒后重试")
-                        time.sleep(wait_time)
-                        continue
-                    raise
-            logger.error(f"图片生成失败: 重试 {max_retries} 次后仍失败")
-            raise Exception(
-                f"图片生成失败：重试 {max_retries} 次后仍失败。\n"
-                "可能原因：\n"
-                "1. API持续限流或配额不足\n"
-                "2. 网络连接持续不稳定\n"
-                "3. API服务暂时不可用\n"
-                "建议：稍后再试，或检查API配额和网络状态"
-            )
-        return wrapper
-    return decorator
-
-
-class OpenAICompatibleGenerator(ImageGeneratorBase):
+class OpenAICompatibleGenerator(AsyncImageGeneratorBase):
     """OpenAI 兼容接口图片生成器"""
 
     def __init__(self, config: Dict[str, Any]):
@@ -81,13 +45,14 @@ class OpenAICompatibleGenerator(ImageGeneratorBase):
         """验证配置"""
         return bool(self.api_key and self.base_url)
 
-    @retry_on_error(max_retries=5, base_delay=3)
+    @retry_with_policy
     def generate_image(
         self,
         prompt: str,
         size: str = "1024x1024",
         model: str = None,
         quality: str = "standard",
+        deadline: Optional[Deadline] = None,
         **kwargs
     ) -> bytes:
         """
@@ -98,6 +63,7 @@ class OpenAICompatibleGenerator(ImageGeneratorBase):
             size: 图片尺寸 (如 "1024x1024", "2048x2048", "4096x4096")
             model: 模型名称
             quality: 质量 ("standard" 或 "hd")
+            deadline: 任务截止时间（请求超时按剩余时间收缩）
             **kwargs: 其他参数
 
         Returns:
@@ -105,40 +71,128 @@ class OpenAICompatibleGenerator(ImageGeneratorBase):
         """
         if model is None:
             model = self.default_model
+        deadline = resolve_deadline(deadline)
 
         logger.info(f"OpenAI 兼容 API 生成图片: model={model}, size={size}, endpoint={self.endpoint_type}")
 
         if self.endpoint_type == 'images':
-            return self._generate_via_images_api(prompt, size, model, quality)
+            return self._generate_via_images_api(prompt, size, model, quality, deadline)
         elif self.endpoint_type == 'chat':
-            return self._generate_via_chat_api(prompt, size, model)
+            return self._generate_via_chat_api(prompt, size, model, deadline)
         else:
-            logger.error(f"不支持的端点类型: {self.endpoint_type}")
-            raise ValueError(
-                f"不支持的端点类型: {self.endpoint_type}\n"
-                "支持的类型: images, chat\n"
-                "解决方案：\n"
-                "在 image_providers.yaml 中设置正确的 endpoint_type\n"
-                "- 'images': 使用 /v1/images/generations 端点 (标准)\n"
-                "- 'chat': 使用 /v1/chat/completions 端点 (特殊)"
-            )
+            raise self._unsupported_endpoint_error()
+
+    @aretry_with_policy
+    async def agenerate_image(
+        self,
+        prompt: str,
+        size: str = "1024x1024",
+        model: str = None,
+        quality: str = "standard",
+        deadline: Optional[Deadline] = None,
+        **kwargs
+    ) -> bytes:
+        """
+        生成图片（协程版本，参数和返回值同 generate_image）
+        """
+        if model is None:
+            model = self.default_model
+        deadline = resolve_deadline(deadline)
+
+        logger.info(f"OpenAI 兼容 API 生成图片 (async): model={model}, size={size}, endpoint={self.endpoint_type}")
+
+        if self.endpoint_type == 'images':
+            return await self._agenerate_via_images_api(prompt, size, model, quality, deadline)
+        elif self.endpoint_type == 'chat':
+            return await self._agenerate_via_chat_api(prompt, size, model, deadline)
+        else:
+            raise self._unsupported_endpoint_error()
+
+    def _unsupported_endpoint_error(self) -> ValueError:
+        logger.error(f"不支持的端点类型: {self.endpoint_type}")
+        return ValueError(
+            f"不支持的端点类型: {self.endpoint_type}\n"
+            "支持的类型: images, chat\n"
+            "解决方案：\n"
+            "在 image_providers.yaml 中设置正确的 endpoint_type\n"
+            "- 'images': 使用 /v1/images/generations 端点 (标准)\n"
+            "- 'chat': 使用 /v1/chat/completions 端点 (特殊)"
+        )
+
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
 
     def _generate_via_images_api(
         self,
         prompt: str,
         size: str,
         model: str,
-        quality: str
+        quality: str,
+        deadline: Deadline
     ) -> bytes:
         """通过 /v1/images/generations 端点生成"""
+        url, payload = self._images_request(prompt, size, model, quality)
+
+        # 流式读取响应，b64_json 边读取边解码
+        response = requests.post(
+            url, headers=self._headers(), json=payload,
+            timeout=deadline.timeout(180, "OpenAI 兼容 API 请求"), stream=True
+        )
+
+        if response.status_code != 200:
+            raise self._images_error(url, model, response.status_code, response.text[:500], response.headers)
+
+        img_bytes, result, preview = read_b64_json_image(response, deadline, "读取 OpenAI Images API 响应")
+        image_url = self._images_result(img_bytes, result, preview)
+        if image_url is None:
+            return img_bytes
+
+        # 处理URL格式
+        logger.debug(f"  下载图片 URL...")
+        img_response = requests.get(image_url, timeout=deadline.timeout(60, "下载图片"))
+        return self._downloaded_image(img_response.status_code, img_response.content)
+
+    async def _agenerate_via_images_api(
+        self,
+        prompt: str,
+        size: str,
+        model: str,
+        quality: str,
+        deadline: Deadline
+    ) -> bytes:
+        """通过 /v1/images/generations 端点生成（协程版本）"""
+        url, payload = self._images_request(prompt, size, model, quality)
+
+        request = self.http_client.build_request(
+            "POST", url, headers=self._headers(), json=payload,
+            timeout=deadline.timeout(180, "OpenAI 兼容 API 请求")
+        )
+        response = await self.http_client.send(request, stream=True)
+
+        if response.status_code != 200:
+            try:
+                await response.aread()
+            finally:
+                await response.aclose()
+            raise self._images_error(url, model, response.status_code, response.text[:500], response.headers)
+
+        img_bytes, result, preview = await aread_b64_json_image(response, deadline, "读取 OpenAI Images API 响应")
+        image_url = self._images_result(img_bytes, result, preview)
+        if image_url is None:
+            return img_bytes
+
+        logger.debug(f"  下载图片 URL...")
+        img_response = await self.http_client.get(image_url, timeout=deadline.timeout(60, "下载图片"))
+        return self._downloaded_image(img_response.status_code, img_response.content)
+
+    def _images_request(self, prompt: str, size: str, model: str, quality: str) -> Tuple[str, Dict[str, Any]]:
+        """构建 /v1/images/generations 请求（请求地址, 请求体）"""
         url = f"{self.base_url.rstrip('/')}/v1/images/generations"
         logger.debug(f"  发送请求到: {url}")
 
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-
         payload = {
             "model": model,
             "prompt": prompt,
@@ -150,34 +204,46 @@ class OpenAICompatibleGenerator(ImageGeneratorBase):
         # 如果模型支持quality参数
         if quality and model.startswith('dall-e'):
             payload["quality"] = quality
+        return url, payload
+
+    def _images_error(self, url: str, model: str, status_code: int, error_detail: str, headers) -> ProviderHTTPError:
+        logger.error(f"OpenAI Images API 请求失败: status={status_code}, error={error_detail}")
+        return ProviderHTTPError(
+            f"OpenAI Images API 请求失败 (状态码: {status_code})\n"
+            f"错误详情: {error_detail}\n"
+            f"请求地址: {url}\n"
+            f"模型: {model}\n"
+            "可能原因：\n"
+            "1. API密钥无效或已过期\n"
+            "2. 模型名称不正确或无权访问\n"
+            "3. 请求参数不符合要求\n"
+            "4. API配额已用尽\n"
+            "5. Base URL配置错误\n"
+            "建议：检查API密钥、base_url和模型名称配置",
+            status_code=status_code,
+            retry_after=parse_retry_after(headers.get('Retry-After'))
+        )
 
-        response = requests.post(url, headers=headers, json=payload, timeout=180)
+    def _images_result(self, img_bytes: Optional[bytes], result: Any, preview: str) -> Optional[str]:
+        """
+        检查 /v1/images/generations 的响应
 
-        if response.status_code != 200:
-            error_detail = response.text[:500]
-            logger.error(f"OpenAI Images API 请求失败: status={response.status_code}, error={error_detail}")
-            raise Exception(
-                f"OpenAI Images API 请求失败 (状态码: {response.status_code})\n"
-                f"错误详情: {error_detail}\n"
-                f"请求地址: {url}\n"
-                f"模型: {model}\n"
-                "可能原因：\n"
-                "1. API密钥无效或已过期\n"
-                "2. 模型名称不正确或无权访问\n"
-                "3. 请求参数不符合要求\n"
-                "4. API配额已用尽\n"
-                "5. Base URL配置错误\n"
-                "建议：检查API密钥、base_url和模型名称配置"
-            )
+        Returns:
+            已解码 b64_json 时返回 None；否则返回需要下载的图片 URL
 
-        result = response.json()
-        logger.debug(f"  API 响应: data 长度={len(result.get('data', []))}")
+        Raises:
+            ValueError: 响应中没有图片数据
+        """
+        # 处理base64格式
+        if img_bytes:
+            logger.info(f"✅ OpenAI Images API 图片生成成功: {len(img_bytes)} bytes")
+            return None
 
-        if "data" not in result or len(result["data"]) == 0:
-            logger.error(f"API 未返回图片数据: {str(result)[:200]}")
+        if not isinstance(result, dict) or not result.get("data"):
+            logger.error(f"API 未返回图片数据: {preview[:200]}")
             raise ValueError(
                 "OpenAI API 未返回图片数据。\n"
-                f"响应内容: {str(result)[:500]}\n"
+                f"响应内容: {preview}\n"
                 "可能原因：\n"
                 "1. 提示词被安全过滤拦截\n"
                 "2. 模型不支持图片生成\n"
@@ -186,48 +252,68 @@ class OpenAICompatibleGenerator(ImageGeneratorBase):
             )
 
         image_data = result["data"][0]
+        if "url" in image_data:
+            return image_data["url"]
 
-        # 处理base64格式
-        if "b64_json" in image_data:
-            img_bytes = base64.b64decode(image_data["b64_json"])
-            logger.info(f"✅ OpenAI Images API 图片生成成功: {len(img_bytes)} bytes")
-            return img_bytes
-
-        # 处理URL格式
-        elif "url" in image_data:
-            logger.debug(f"  下载图片 URL...")
-            img_response = requests.get(image_data["url"], timeout=60)
-            if img_response.status_code == 200:
-                logger.info(f"✅ OpenAI Images API 图片生成成功: {len(img_response.content)} bytes")
-                return img_response.content
-            else:
-                logger.error(f"下载图片失败: {img_response.status_code}")
-                raise Exception(f"下载图片失败: {img_response.status_code}")
+        logger.error(f"无法从响应中提取图片数据: {str(image_data)[:200]}")
+        raise ValueError(
+            "无法从API响应中提取图片数据。\n"
+            f"响应数据: {str(image_data)[:500]}\n"
+            "可能原因：\n"
+            "1. 响应格式不包含 b64_json 或 url 字段\n"
+            "2. response_format 参数未生效\n"
+            "建议：检查API文档确认图片返回格式"
+        )
 
-        else:
-            logger.error(f"无法从响应中提取图片数据: {str(image_data)[:200]}")
-            raise ValueError(
-                "无法从API响应中提取图片数据。\n"
-                f"响应数据: {str(image_data)[:500]}\n"
-                "可能原因：\n"
-                "1. 响应格式不包含 b64_json 或 url 字段\n"
-                "2. response_format 参数未生效\n"
-                "建议：检查API文档确认图片返回格式"
-            )
+    def _downloaded_image(self, status_code: int, content: bytes) -> bytes:
+        """检查图片 URL 的下载结果"""
+        if status_code == 200:
+            logger.info(f"✅ OpenAI Images API 图片生成成功: {len(content)} bytes")
+            return content
+        logger.error(f"下载图片失败: {status_code}")
+        raise Exception(f"下载图片失败: {status_code}")
 
     def _generate_via_chat_api(
         self,
         prompt: str,
         size: str,
-        model: str
+        model: str,
+        deadline: Deadline
     ) -> bytes:
         """通过 /v1/chat/completions 端点生成（某些服务商使用此方式）"""
-        url = f"{self.base_url.rstrip('/')}/v1/chat/completions"
+        url, payload = self._chat_request(prompt, size, model)
 
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+        response = requests.post(
+            url, headers=self._headers(), json=payload, timeout=deadline.timeout(180, "OpenAI 兼容 API 请求")
+        )
+
+        if response.status_code != 200:
+            raise self._chat_error(url, model, response.status_code, response.text[:500], response.headers)
+
+        return self._chat_result(response.json())
+
+    async def _agenerate_via_chat_api(
+        self,
+        prompt: str,
+        size: str,
+        model: str,
+        deadline: Deadline
+    ) -> bytes:
+        """通过 /v1/chat/completions 端点生成（协程版本）"""
+        url, payload = self._chat_request(prompt, size, model)
+
+        response = await self.http_client.post(
+            url, headers=self._headers(), json=payload, timeout=deadline.timeout(180, "OpenAI 兼容 API 请求")
+        )
+
+        if response.status_code != 200:
+            raise self._chat_error(url, model, response.status_code, response.text[:500], response.headers)
+
+        return self._chat_result(response.json())
+
+    def _chat_request(self, prompt: str, size: str, model: str) -> Tuple[str, Dict[str, Any]]:
+        """构建 /v1/chat/completions 请求（请求地址, 请求体）"""
+        url = f"{self.base_url.rstrip('/')}/v1/chat/completions"
 
         payload = {
             "model": model,
@@ -243,26 +329,26 @@ class OpenAICompatibleGenerator(ImageGeneratorBase):
             "response_format": {"type": "image"},
             "size": size
         }
+        return url, payload
+
+    def _chat_error(self, url: str, model: str, status_code: int, error_detail: str, headers) -> ProviderHTTPError:
+        return ProviderHTTPError(
+            f"OpenAI Chat API 请求失败 (状态码: {status_code})\n"
+            f"错误详情: {error_detail}\n"
+            f"请求地址: {url}\n"
+            f"模型: {model}\n"
+            "可能原因：\n"
+            "1. API密钥无效或已过期\n"
+            "2. 该服务商不支持通过 chat 端点生成图片\n"
+            "3. 请求参数格式错误\n"
+            "4. API配额已用尽\n"
+            "建议：尝试将 endpoint_type 改为 'images' 或检查API密钥",
+            status_code=status_code,
+            retry_after=parse_retry_after(headers.get('Retry-After'))
+        )
 
-        response = requests.post(url, headers=headers, json=payload, timeout=180)
-
-        if response.status_code != 200:
-            error_detail = response.text[:500]
-            raise Exception(
-                f"OpenAI Chat API 请求失败 (状态码: {response.status_code})\n"
-                f"错误详情: {error_detail}\n"
-                f"请求地址: {url}\n"
-                f"模型: {model}\n"
-                "可能原因：\n"
-                "1. API密钥无效或已过期\n"
-                "2. 该服务商不支持通过 chat 端点生成图片\n"
-                "3. 请求参数格式错误\n"
-                "4. API配额已用尽\n"
-                "建议：尝试将 endpoint_type 改为 'images' 或检查API密钥"
-            )
-
-        result = response.json()
-
+    def _chat_result(self, result: Dict[str, Any]) -> bytes:
+        """从 /v1/chat/completions 的响应中提取图片"""
         # 这部分需要根据具体服务商的返回格式调整
         # 假设返回格式类似OpenAI
         if "choices" in result and len(result["choices"]) > 0:
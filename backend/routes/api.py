@@ -4,12 +4,27 @@ import logging
 import os
 import time
 import traceback
+import uuid
 import zipfile
 import io
+from typing import Tuple
 from flask import Blueprint, request, jsonify, Response, send_file
 from backend.services.outline import get_outline_service
 from backend.services.image import get_image_service
 from backend.services.history import get_history_service
+from backend.services.async_engine import get_async_engine
+from backend.services.executor import get_generation_executor
+from backend.services.job_queue import cancel_task_jobs, get_job_queue
+from backend.services.task_store import get_task_store
+from backend.services.admission import get_admission_controller
+from backend.services.idempotency import get_idempotency_registry, request_fingerprint
+from backend.utils.flow_control import get_limiter_stats, get_cooldown_stats
+from backend.utils.retry import get_retry_stats
+from backend.utils.hedging import get_hedge_stats
+from backend.utils.circuit_breaker import get_breaker_stats
+from backend.utils.image_compressor import get_compression_cache_stats
+from backend.utils.deadline import Deadline
+from backend.config import Config
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +44,124 @@ def _log_request(endpoint: str, data: dict = None):
         logger.debug(f"  请求数据: {safe_data}")
 
 
+def _request_deadline(data: dict, default_seconds: float) -> Deadline:
+    """
+    创建本次请求的截止时间
+
+    Args:
+        data: 请求参数，可选 deadline_seconds 字段
+        default_seconds: 配置的默认截止时间（秒，0 表示不限制）
+
+    Returns:
+        截止时间；配置和请求参数都设置时取较小值
+    """
+    candidates = [float(default_seconds or 0)]
+    try:
+        candidates.append(float((data or {}).get('deadline_seconds') or 0))
+    except (TypeError, ValueError):
+        pass
+    bounded = [seconds for seconds in candidates if seconds > 0]
+    return Deadline(min(bounded) if bounded else None)
+
+
+def _client_id(data: dict) -> str:
+    """
+    获取客户端标识（请求头 X-Client-Id，或请求体中的 client_id）
+
+    图片生成按客户端公平分配服务商并发，没有标识时按任务区分。
+    """
+    client_id = request.headers.get('X-Client-Id') or (data or {}).get('client_id') or ''
+    return str(client_id)[:64]
+
+
+def _idempotency_key(*parts) -> Tuple[str, bool]:
+    """
+    获取幂等键：请求头 Idempotency-Key，没有时按请求内容计算指纹
+
+    Args:
+        *parts: 计算指纹的请求内容
+
+    Returns:
+        (幂等键, 是否由客户端显式传入)
+    """
+    key = (request.headers.get('Idempotency-Key') or '').strip()
+    if key:
+        return key[:128], True
+    return request_fingerprint(*parts), False
+
+
+def _reject(rejection: dict) -> Response:
+    """
+    返回准入控制的拒绝响应（429/503，带 Retry-After 响应头）
+
+    Args:
+        rejection: AdmissionController 返回的 {"status", "reason", "retry_after"}
+    """
+    response = jsonify({
+        "success": False,
+        "error": f"{rejection['reason']}。\n请在 {rejection['retry_after']} 秒后重试",
+        "retry_after": rejection["retry_after"]
+    })
+    response.status_code = rejection["status"]
+    response.headers['Retry-After'] = str(rejection["retry_after"])
+    return response
+
+
+def _deadline_at(deadline: Deadline):
+    """截止时间对应的时间戳（写入任务队列，由工作线程恢复），不限制时返回 None"""
+    remaining = deadline.remaining()
+    return time.time() + remaining if remaining is not None else None
+
+
+# 没有新事件时发送 SSE 保活注释的间隔（秒），避免代理断开空闲连接
+SSE_KEEPALIVE_SECONDS = 15
+
+
+def _job_event_stream(job_id: str, last_event_id: int = 0) -> Response:
+    """
+    以 SSE 返回任务事件
+
+    响应只是任务事件的订阅者：客户端断开连接时任务继续在后台执行，
+    所有订阅者断开超过 JOB_ABANDON_SECONDS 秒仍没有重新订阅时任务被取消。
+    每个事件带有 id（任务内递增的序号），客户端可以凭 Last-Event-ID 断点续传。
+
+    Args:
+        job_id: 任务 ID
+        last_event_id: 客户端已收到的最后一个事件序号，从其后开始重放
+
+    Returns:
+        SSE 响应（X-Job-Id 头为后台任务 ID，X-Task-Id 头为图片任务 ID）
+    """
+    job_queue = get_job_queue()
+    job = job_queue.get_job(job_id) or {}
+
+    def generate():
+        """SSE 生成器（客户端断开时写入失败，生成器被关闭）"""
+        job_queue.attach(job_id)
+        try:
+            for event in job_queue.subscribe(job_id, last_event_id, heartbeat=SSE_KEEPALIVE_SECONDS):
+                if event is None:
+                    yield ": keepalive\n\n"
+                    continue
+                # 格式化为 SSE 格式（id 放在 data 之后，前端按前两行解析 event 和 data）
+                yield f"event: {event['event']}\n"
+                yield f"data: {json.dumps(event['data'], ensure_ascii=False)}\n"
+                yield f"id: {event['seq']}\n\n"
+        finally:
+            job_queue.detach(job_id)
+
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+            'X-Job-Id': job_id,
+            'X-Task-Id': job.get('task_id') or '',
+        }
+    )
+
+
 def _log_error(endpoint: str, error: Exception):
     """记录错误日志"""
     logger.error(f"❌ 请求失败: {endpoint}")
@@ -45,6 +178,7 @@ def generate_outline():
         # 检查是否是 multipart/form-data（带图片）
         if request.content_type and 'multipart/form-data' in request.content_type:
             topic = request.form.get('topic')
+            deadline = _request_deadline(request.form, Config.TEXT_DEADLINE_SECONDS)
             # 获取上传的图片
             images = []
             if 'images' in request.files:
@@ -58,6 +192,7 @@ def generate_outline():
             # JSON 请求（无图片或 base64 图片）
             data = request.get_json()
             topic = data.get('topic')
+            deadline = _request_deadline(data, Config.TEXT_DEADLINE_SECONDS)
             # 支持 base64 格式的图片
             images_base64 = data.get('images', [])
             images = []
@@ -77,10 +212,16 @@ def generate_outline():
                 "error": "参数错误：topic 不能为空。\n请提供要生成图文的主题内容。"
             }), 400
 
+        admission = get_admission_controller()
+        rejection = admission.check_outline()
+        if rejection:
+            return _reject(rejection)
+
         # 调用大纲生成服务
         logger.info(f"🔄 开始生成大纲，主题: {topic[:50]}...")
         outline_service = get_outline_service()
-        result = outline_service.generate_outline(topic, images if images else None)
+        with admission.track_outline():
+            result = outline_service.generate_outline(topic, images if images else None, deadline=deadline)
 
         elapsed = time.time() - start_time
         if result["success"]:
@@ -101,7 +242,7 @@ def generate_outline():
 
 @api_bp.route('/generate', methods=['POST'])
 def generate_images():
-    """生成图片（SSE 流式返回，支持用户上传参考图片）"""
+    """生成图片（写入后台任务队列，SSE 流式返回任务事件，支持用户上传参考图片）"""
     try:
         # JSON 请求
         data = request.get_json()
@@ -109,15 +250,13 @@ def generate_images():
         task_id = data.get('task_id')
         full_outline = data.get('full_outline', '')
         user_topic = data.get('user_topic', '')  # 用户原始输入
-        # 支持 base64 格式的用户参考图片
-        user_images_base64 = data.get('user_images', [])
-        user_images = []
-        if user_images_base64:
-            import base64
-            for img_b64 in user_images_base64:
-                if ',' in img_b64:
-                    img_b64 = img_b64.split(',')[1]
-                user_images.append(base64.b64decode(img_b64))
+        # 截止时间从收到请求时开始计算
+        deadline = _request_deadline(data, Config.GENERATION_DEADLINE_SECONDS)
+        # 支持 base64 格式的用户参考图片（去掉 data URL 前缀后原样写入任务）
+        user_images = [
+            img_b64.split(',')[1] if ',' in img_b64 else img_b64
+            for img_b64 in data.get('user_images') or []
+        ]
 
         _log_request('/generate', {
             'pages_count': len(pages) if pages else 0,
@@ -133,32 +272,45 @@ def generate_images():
                 "error": "参数错误：pages 不能为空。\n请提供要生成的页面列表数据。"
             }), 400
 
-        # 获取图片生成服务
-        logger.info(f"🖼️  开始图片生成任务: {task_id}, 共 {len(pages)} 页")
-        image_service = get_image_service()
+        # 重复提交（浏览器重试、连续点击）订阅已有任务的事件，不再重新生成；
+        # 没有 Idempotency-Key 时按客户端、任务ID和页面内容去重
+        client_id = _client_id(data)
+        idempotency_key, explicit = _idempotency_key(client_id, task_id, pages, full_outline, user_topic, user_images)
+        if not explicit and not (client_id or task_id):
+            # 无法区分请求是否来自同一客户端，不按内容去重
+            idempotency_key = None
+        queue = get_job_queue()
+        if idempotency_key:
+            existing = queue.find_idempotent("generate", idempotency_key, reuse_finished=explicit)
+            if existing:
+                logger.info(f"🔁 重复的图片生成请求，订阅已有任务: job={existing}")
+                return _job_event_stream(existing)
+
+        # 实例饱和或该客户端的任务过多时直接拒绝，不再排队
+        rejection = get_admission_controller().check_generate(client_id)
+        if rejection:
+            return _reject(rejection)
+
+        # 写入后台任务队列，由工作线程执行
+        task_id = task_id or f"task_{uuid.uuid4().hex[:8]}"
+        payload = {
+            "pages": pages,
+            "task_id": task_id,
+            "full_outline": full_outline,
+            "user_images": user_images,
+            "user_topic": user_topic,
+            "deadline_at": _deadline_at(deadline),
+            "client_id": client_id,
+        }
+        if idempotency_key:
+            job_id, _ = queue.enqueue_idempotent(
+                "generate", payload, idempotency_key, task_id=task_id, reuse_finished=explicit
+            )
+        else:
+            job_id = queue.enqueue("generate", payload, task_id=task_id)
+        logger.info(f"🖼️  图片生成任务已入队: {task_id}, job={job_id}, 共 {len(pages)} 页")
 
-        def generate():
-            """SSE 生成器"""
-            for event in image_service.generate_images(
-                pages, task_id, full_outline,
-                user_images=user_images if user_images else None,
-                user_topic=user_topic
-            ):
-                event_type = event["event"]
-                event_data = event["data"]
-
-                # 格式化为 SSE 格式
-                yield f"event: {event_type}\n"
-                yield f"data: {json.dumps(event_data, ensure_ascii=False)}\n\n"
-
-        return Response(
-            generate(),
-            mimetype='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'X-Accel-Buffering': 'no',
-            }
-        )
+        return _job_event_stream(job_id)
 
     except Exception as e:
         _log_error('/generate', e)
@@ -220,6 +372,7 @@ def retry_single_image():
         task_id = data.get('task_id')
         page = data.get('page')
         use_reference = data.get('use_reference', True)
+        deadline = _request_deadline(data, Config.GENERATION_DEADLINE_SECONDS)
 
         _log_request('/retry', {'task_id': task_id, 'page_index': page.get('index') if page else None})
 
@@ -232,7 +385,9 @@ def retry_single_image():
 
         logger.info(f"🔄 重试生成图片: task={task_id}, page={page.get('index')}")
         image_service = get_image_service()
-        result = image_service.retry_single_image(task_id, page, use_reference)
+        result = image_service.retry_single_image(
+            task_id, page, use_reference, deadline=deadline, client_id=_client_id(data)
+        )
 
         if result["success"]:
             logger.info(f"✅ 图片重试成功: {result.get('image_url')}")
@@ -252,11 +407,12 @@ def retry_single_image():
 
 @api_bp.route('/retry-failed', methods=['POST'])
 def retry_failed_images():
-    """批量重试失败的图片（SSE 流式返回）"""
+    """批量重试失败的图片（写入后台任务队列，SSE 流式返回任务事件）"""
     try:
         data = request.get_json()
         task_id = data.get('task_id')
         pages = data.get('pages')
+        deadline = _request_deadline(data, Config.GENERATION_DEADLINE_SECONDS)
 
         _log_request('/retry-failed', {'task_id': task_id, 'pages_count': len(pages) if pages else 0})
 
@@ -267,26 +423,20 @@ def retry_failed_images():
                 "error": "参数错误：task_id 和 pages 不能为空。\n请提供任务ID和要重试的页面列表。"
             }), 400
 
-        logger.info(f"🔄 批量重试失败图片: task={task_id}, 共 {len(pages)} 页")
-        image_service = get_image_service()
-
-        def generate():
-            """SSE 生成器"""
-            for event in image_service.retry_failed_images(task_id, pages):
-                event_type = event["event"]
-                event_data = event["data"]
-
-                yield f"event: {event_type}\n"
-                yield f"data: {json.dumps(event_data, ensure_ascii=False)}\n\n"
-
-        return Response(
-            generate(),
-            mimetype='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'X-Accel-Buffering': 'no',
-            }
-        )
+        # 同一任务、同样页面的重复提交订阅已有的批量重试任务
+        idempotency_key, explicit = _idempotency_key(task_id, pages)
+        job_id, created = get_job_queue().enqueue_idempotent("retry_failed", {
+            "task_id": task_id,
+            "pages": pages,
+            "deadline_at": _deadline_at(deadline),
+            "client_id": _client_id(data),
+        }, idempotency_key, task_id=task_id, reuse_finished=explicit)
+        if not created:
+            logger.info(f"🔁 重复的批量重试请求，订阅已有任务: job={job_id}")
+            return _job_event_stream(job_id)
+        logger.info(f"🔄 批量重试任务已入队: task={task_id}, job={job_id}, 共 {len(pages)} 页")
+
+        return _job_event_stream(job_id)
 
     except Exception as e:
         _log_error('/retry-failed', e)
@@ -307,6 +457,7 @@ def regenerate_image():
         use_reference = data.get('use_reference', True)
         full_outline = data.get('full_outline', '')
         user_topic = data.get('user_topic', '')
+        deadline = _request_deadline(data, Config.GENERATION_DEADLINE_SECONDS)
 
         _log_request('/regenerate', {'task_id': task_id, 'page_index': page.get('index') if page else None})
 
@@ -319,11 +470,21 @@ def regenerate_image():
 
         logger.info(f"🔄 重新生成图片: task={task_id}, page={page.get('index')}")
         image_service = get_image_service()
-        result = image_service.regenerate_image(
-            task_id, page, use_reference,
-            full_outline=full_outline,
-            user_topic=user_topic
+        # 同一页面的重复提交等待进行中的请求并共享结果；显式传入 Idempotency-Key 时成功结果也会复用
+        idempotency_key, explicit = _idempotency_key(task_id, page, use_reference)
+        result, reused = get_idempotency_registry().run(
+            f"regenerate:{idempotency_key}",
+            lambda: image_service.regenerate_image(
+                task_id, page, use_reference,
+                full_outline=full_outline,
+                user_topic=user_topic,
+                deadline=deadline,
+                client_id=_client_id(data)
+            ),
+            reuse_finished=explicit
         )
+        if reused:
+            logger.info(f"🔁 重复的重新生成请求，复用结果: task={task_id}, page={page.get('index')}")
 
         if result["success"]:
             logger.info(f"✅ 图片重新生成成功: {result.get('image_url')}")
@@ -351,14 +512,14 @@ def get_task_state(task_id):
         if state is None:
             return jsonify({
                 "success": False,
-                "error": f"任务不存在：{task_id}\n可能原因：\n1. 任务ID错误\n2. 任务已过期或被清理\n3. 服务重启导致状态丢失"
+                "error": f"任务不存在：{task_id}\n可能原因：\n1. 任务ID错误\n2. 任务已过期或被清理\n3. 任务目录或任务日志 (journal.jsonl) 已被删除"
             }), 404
 
         # 不返回封面图片数据（太大）
         safe_state = {
-            "generated": state.get("generated", {}),
-            "failed": state.get("failed", {}),
-            "has_cover": state.get("cover_image") is not None
+            "generated": state.generated,
+            "failed": state.failed,
+            "has_cover": state.cover_image is not None
         }
 
         return jsonify({
@@ -374,15 +535,178 @@ def get_task_state(task_id):
         }), 500
 
 
+@api_bp.route('/task/<task_id>/events', methods=['GET'])
+def subscribe_task_events(task_id):
+    """
+    订阅任务事件（SSE，支持断线重连）
+
+    重放 Last-Event-ID（请求头，或 last_event_id 查询参数）之后的事件，然后继续推送
+    新事件直到任务结束。默认订阅该任务最近一次的生成/批量重试，也可以用 job_id 参数指定。
+    """
+    try:
+        job_queue = get_job_queue()
+        job_id = request.args.get('job_id') or job_queue.latest_job_for_task(task_id)
+        job = job_queue.get_job(job_id) if job_id else None
+        if job is None or job['task_id'] != task_id:
+            return jsonify({
+                "success": False,
+                "error": f"任务没有可订阅的事件：{task_id}\n可能原因：任务ID错误，或任务已结束并超过保留时间被清理"
+            }), 404
+
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0
+        try:
+            last_event_id = max(0, int(last_event_id))
+        except (TypeError, ValueError):
+            last_event_id = 0
+
+        logger.info(f"📡 订阅任务事件: task={task_id}, job={job_id}, last_event_id={last_event_id}")
+        return _job_event_stream(job_id, last_event_id)
+
+    except Exception as e:
+        _log_error('/task/events', e)
+        error_msg = str(e)
+        return jsonify({
+            "success": False,
+            "error": f"订阅任务事件失败。\n错误详情: {error_msg}"
+        }), 500
+
+
+@api_bp.route('/task/<task_id>/cancel', methods=['POST'])
+def cancel_task(task_id):
+    """
+    取消任务正在进行的生成/批量重试
+
+    排队中的页面立即丢弃，执行中的页面在下一个检查点中止（不再重试、不保存结果），
+    被取消的页面记为失败，之后仍可以重试。
+    """
+    try:
+        _log_request('/task/cancel', {'task_id': task_id})
+        job_ids = cancel_task_jobs(task_id)
+        if not job_ids:
+            return jsonify({
+                "success": False,
+                "error": f"任务没有正在进行的生成：{task_id}"
+            }), 404
+
+        logger.info(f"🛑 取消任务: task={task_id}, jobs={job_ids}")
+        return jsonify({
+            "success": True,
+            "task_id": task_id,
+            "job_ids": job_ids
+        }), 200
+
+    except Exception as e:
+        _log_error('/task/cancel', e)
+        error_msg = str(e)
+        return jsonify({
+            "success": False,
+            "error": f"取消任务失败。\n错误详情: {error_msg}"
+        }), 500
+
+
+@api_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """获取后台任务状态（queued / running / succeeded / failed / cancelled）"""
+    try:
+        job = get_job_queue().get_job(job_id)
+        if job is None:
+            return jsonify({
+                "success": False,
+                "error": f"任务不存在：{job_id}\n可能原因：任务ID错误，或任务已结束并超过保留时间被清理"
+            }), 404
+
+        return jsonify({
+            "success": True,
+            "job": job
+        }), 200
+
+    except Exception as e:
+        error_msg = str(e)
+        return jsonify({
+            "success": False,
+            "error": f"获取任务状态失败。\n错误详情: {error_msg}"
+        }), 500
+
+
 @api_bp.route('/health', methods=['GET'])
 def health_check():
-    """健康检查"""
+    """健康检查（实例饱和时返回 503，ready 为 false）"""
+    try:
+        readiness = get_admission_controller().readiness()
+    except Exception as e:
+        _log_error('/health', e)
+        return jsonify({
+            "success": True,
+            "message": "服务正常运行",
+            "ready": True
+        }), 200
+
+    if not readiness["ready"]:
+        response = jsonify({
+            "success": False,
+            "message": f"服务繁忙：{readiness['reason']}",
+            "ready": False,
+            "retry_after": readiness["retry_after"],
+            "load": readiness["load"]
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = str(readiness["retry_after"])
+        return response
+
     return jsonify({
         "success": True,
-        "message": "服务正常运行"
+        "message": "服务正常运行",
+        "ready": True,
+        "load": readiness["load"]
     }), 200
 
 
+@api_bp.route('/stats', methods=['GET'])
+def get_stats():
+    """获取图片生成运行状态（排队数、活跃工作线程数、各服务商并发上限、限流冷却、重试预算与对冲请求、熔断状态、服务商池与后台任务队列、任务上下文存储、准入控制、请求幂等、图片压缩缓存、异步生成引擎）"""
+    try:
+        return jsonify({
+            "success": True,
+            "executor": get_generation_executor().get_stats(),
+            "limiters": get_limiter_stats(),
+            "cooldowns": get_cooldown_stats(),
+            "retry_policies": get_retry_stats(),
+            "hedging": get_hedge_stats(),
+            "breakers": get_breaker_stats(),
+            "provider_pool": get_image_service().pool.get_stats(),
+            "jobs": get_job_queue().get_stats(),
+            "task_store": get_task_store().get_stats(),
+            "admission": get_admission_controller().get_stats(),
+            "idempotency": get_idempotency_registry().get_stats(),
+            "compress_cache": get_compression_cache_stats(),
+            "async_engine": get_async_engine().get_stats()
+        }), 200
+
+    except Exception as e:
+        error_msg = str(e)
+        return jsonify({
+            "success": False,
+            "error": f"获取运行状态失败。\n错误详情: {error_msg}"
+        }), 500
+
+
+@api_bp.route('/breakers', methods=['GET'])
+def get_breakers():
+    """获取图片和文本服务商的熔断器状态（closed / open / half_open）"""
+    try:
+        return jsonify({
+            "success": True,
+            "breakers": get_breaker_stats()
+        }), 200
+
+    except Exception as e:
+        error_msg = str(e)
+        return jsonify({
+            "success": False,
+            "error": f"获取熔断状态失败。\n错误详情: {error_msg}"
+        }), 500
+
+
 # ==================== 历史记录相关 API ====================
 
 @api_bp.route('/history', methods=['POST'])
@@ -755,6 +1079,8 @@ def get_config():
                 },
                 "image_generation": {
                     "active_provider": image_config.get('active_provider', ''),
+                    "provider_pool": image_config.get('provider_pool', []),
+                    "page_routing": image_config.get('page_routing', {}),
                     "providers": _prepare_providers_for_response(image_config.get('providers', {}))
                 }
             }
@@ -791,6 +1117,14 @@ def update_config():
             if 'active_provider' in image_gen_data:
                 image_config['active_provider'] = image_gen_data['active_provider']
 
+            if 'provider_pool' in image_gen_data:
+                # 服务商池：名称列表或 {name, weight} 列表，为空时只使用 active_provider
+                image_config['provider_pool'] = image_gen_data['provider_pool'] or []
+
+            if 'page_routing' in image_gen_data:
+                # 按页面类型路由：{cover|content|summary: {provider, model, image_size, size, quality}}
+                image_config['page_routing'] = image_gen_data['page_routing'] or {}
+
             if 'providers' in image_gen_data:
                 # 合并 providers，保留未更新的 api_key
                 existing_providers = image_config.get('providers', {})
@@ -0,0 +1,293 @@
+"""准入控制（过载时拒绝新的生成请求，而不是让所有任务一起变慢、一起超时）"""
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from backend.config import Config
+from backend.services.executor import get_generation_executor
+from backend.services.job_queue import get_job_queue, get_job_worker_capacity
+
+logger = logging.getLogger(__name__)
+
+# 还没有执行样本时假定的单页耗时 / 大纲耗时（秒）
+DEFAULT_PAGE_SECONDS = 30.0
+DEFAULT_OUTLINE_SECONDS = 15.0
+# 还没有任务样本时，单个任务的耗时按几页估算（先生成封面，其余页面并发生成）
+DEFAULT_JOB_PAGES = 2
+# Retry-After 的上限（秒）
+MAX_RETRY_AFTER_SECONDS = 600
+# 自动计算阈值时：排队任务数上限为可同时执行任务数的倍数，
+# 执行器中的页面数上限为执行器容量的倍数（执行中的一轮加上排队的几轮）
+AUTO_QUEUED_JOBS_FACTOR = 1
+AUTO_INFLIGHT_PAGES_FACTOR = 4
+
+
+class AdmissionController:
+    """
+    /api/generate 和 /api/outline 的准入控制
+
+    根据排队中的任务数、执行器中在途的页面数和估算的排队等待时间判断实例是否饱和：
+    饱和时返回 503，单个客户端同时进行的任务过多时返回 429，两者都带有按当前积压
+    计算的 Retry-After。/api/health 据此报告实例是否就绪，负载均衡不再把请求
+    转发给饱和的实例。
+
+    新任务要先等到空闲的任务工作线程，再和其他任务一起占用服务商并发，
+    等待时间按两者中较长的估算；排队任务数和在途页面数的阈值默认按可同时执行的
+    任务数和执行器容量（各服务商并发上限之和）自动计算，随服务商并发上限调整而变化。
+
+    执行器负载只统计当前进程；任务由独立的工作进程执行时（JOB_WORKERS=0），
+    主要依据共享队列中的排队任务数和页面数。
+    """
+
+    def __init__(
+        self,
+        max_queued_jobs: Optional[int] = None,
+        max_inflight_pages: Optional[int] = None,
+        max_wait_seconds: float = 300.0,
+        max_jobs_per_client: int = 3,
+        max_outline_inflight: int = 16
+    ):
+        """
+        初始化准入控制
+
+        Args:
+            max_queued_jobs: 排队中（尚未开始执行）的任务数上限；None 时为可同时执行的任务数
+            max_inflight_pages: 执行器中执行中和排队中的页面数上限；None 时按执行器容量计算
+            max_wait_seconds: 新任务估算排队等待时间的上限（秒）
+            max_jobs_per_client: 单个客户端同时进行的生成任务数上限
+            max_outline_inflight: 同时生成的大纲数上限
+
+            以上各项为 0 时不检查该项。
+        """
+        self.max_queued_jobs = max_queued_jobs
+        self.max_inflight_pages = max_inflight_pages
+        self.max_wait_seconds = max_wait_seconds
+        self.max_jobs_per_client = max_jobs_per_client
+        self.max_outline_inflight = max_outline_inflight
+
+        self._lock = threading.Lock()
+        self._outline_inflight = 0
+        self._outline_seconds: Optional[float] = None
+        self.admitted: Dict[str, int] = {"generate": 0, "outline": 0}
+        self.rejected: Dict[str, int] = {}
+
+    def get_load(self) -> Dict[str, Any]:
+        """
+        获取当前负载
+
+        Returns:
+            队列与执行器负载、可同时执行的任务数 job_slots 和页面数 capacity、
+            单页和单个任务的平均耗时，以及新任务的估算等待时间 estimated_wait_seconds
+        """
+        executor_load = get_generation_executor().get_load()
+        queue_load = get_job_queue().get_load()
+        page_seconds = executor_load["avg_service_seconds"] or DEFAULT_PAGE_SECONDS
+        job_seconds = queue_load["avg_job_seconds"] or DEFAULT_JOB_PAGES * page_seconds
+        capacity = max(1, executor_load["capacity"])
+        job_slots = get_job_worker_capacity() or max(1, queue_load["running_jobs"])
+
+        # 等待空闲的任务工作线程：前面的任务每轮占满所有工作线程
+        jobs_ahead = queue_load["running_jobs"] + queue_load["queued_jobs"]
+        job_wait = max(0, jobs_ahead - job_slots + 1) / job_slots * job_seconds
+        # 等待服务商并发：积压的页面按执行器容量逐轮执行
+        backlog_pages = executor_load["active"] + executor_load["queued"] + queue_load["queued_pages"]
+        page_wait = backlog_pages * page_seconds / capacity
+        with self._lock:
+            outline_inflight = self._outline_inflight
+        return {
+            "queued_jobs": queue_load["queued_jobs"],
+            "running_jobs": queue_load["running_jobs"],
+            "job_slots": job_slots,
+            "inflight_pages": executor_load["active"] + executor_load["queued"],
+            "backlog_pages": backlog_pages,
+            "capacity": capacity,
+            "page_seconds": round(page_seconds, 2),
+            "job_seconds": round(job_seconds, 2),
+            "estimated_wait_seconds": round(max(job_wait, page_wait), 1),
+            "outline_inflight": outline_inflight,
+        }
+
+    def limits(self, load: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        当前生效的阈值（未配置的阈值按当前容量计算）
+
+        Args:
+            load: get_load() 的结果
+
+        Returns:
+            {"max_queued_jobs", "max_inflight_pages", "max_wait_seconds"}
+        """
+        max_queued_jobs = self.max_queued_jobs
+        if max_queued_jobs is None:
+            max_queued_jobs = AUTO_QUEUED_JOBS_FACTOR * load["job_slots"]
+        max_inflight_pages = self.max_inflight_pages
+        if max_inflight_pages is None:
+            max_inflight_pages = AUTO_INFLIGHT_PAGES_FACTOR * load["capacity"]
+        return {
+            "max_queued_jobs": max_queued_jobs,
+            "max_inflight_pages": max_inflight_pages,
+            "max_wait_seconds": self.max_wait_seconds,
+        }
+
+    def _saturation(self, load: Dict[str, Any]) -> Optional[str]:
+        """实例饱和的原因；未饱和时返回 None"""
+        limits = self.limits(load)
+        if limits["max_queued_jobs"] and load["queued_jobs"] >= limits["max_queued_jobs"]:
+            return f"排队中的任务已达 {load['queued_jobs']} 个"
+        if limits["max_inflight_pages"] and load["inflight_pages"] >= limits["max_inflight_pages"]:
+            return f"正在生成的页面已达 {load['inflight_pages']} 页"
+        if limits["max_wait_seconds"] and load["estimated_wait_seconds"] >= limits["max_wait_seconds"]:
+            return f"预计排队等待 {load['estimated_wait_seconds']:.0f} 秒"
+        return None
+
+    def _retry_after(self, load: Dict[str, Any]) -> int:
+        """积压降到各项阈值以下所需的大致时间（秒），至少为一页的耗时"""
+        limits = self.limits(load)
+        seconds = load["page_seconds"]
+        if limits["max_queued_jobs"]:
+            # 每空出一个工作线程，排队的任务减少一个
+            excess_jobs = load["queued_jobs"] - limits["max_queued_jobs"] + 1
+            seconds = max(seconds, excess_jobs * load["job_seconds"] / load["job_slots"])
+        if limits["max_inflight_pages"]:
+            excess_pages = load["inflight_pages"] - limits["max_inflight_pages"] + 1
+            seconds = max(seconds, excess_pages * load["page_seconds"] / load["capacity"])
+        if limits["max_wait_seconds"]:
+            seconds = max(seconds, load["estimated_wait_seconds"] - limits["max_wait_seconds"])
+        return int(min(MAX_RETRY_AFTER_SECONDS, max(1, math.ceil(seconds))))
+
+    def _reject(self, endpoint: str, status: int, reason: str, retry_after: int) -> Dict[str, Any]:
+        key = f"{endpoint}:{status}"
+        with self._lock:
+            self.rejected[key] = self.rejected.get(key, 0) + 1
+        logger.warning(f"🚦 拒绝 {endpoint} 请求 ({status}): {reason}，{retry_after} 秒后重试")
+        return {"status": status, "reason": reason, "retry_after": retry_after}
+
+    def check_generate(self, client_id: str = "") -> Optional[Dict[str, Any]]:
+        """
+        判断是否接受新的图片生成任务
+
+        Args:
+            client_id: 客户端标识
+
+        Returns:
+            拒绝时返回 {"status": 429/503, "reason", "retry_after"}；接受时返回 None
+        """
+        if not Config.ADMISSION_ENABLED:
+            return None
+
+        load = self.get_load()
+        reason = self._saturation(load)
+        if reason:
+            return self._reject("generate", 503, f"服务繁忙：{reason}", self._retry_after(load))
+
+        if self.max_jobs_per_client and client_id:
+            active = get_job_queue().count_active_jobs(client_id)
+            if active >= self.max_jobs_per_client:
+                return self._reject(
+                    "generate", 429,
+                    f"同时进行的生成任务已达 {active} 个，请等待之前的任务完成",
+                    int(min(MAX_RETRY_AFTER_SECONDS, max(1, math.ceil(load["job_seconds"]))))
+                )
+
+        with self._lock:
+            self.admitted["generate"] += 1
+        return None
+
+    def check_outline(self) -> Optional[Dict[str, Any]]:
+        """
+        判断是否接受新的大纲生成请求（图片生成已饱和时同样拒绝，大纲之后就是生成图片）
+
+        Returns:
+            拒绝时返回 {"status": 503, "reason", "retry_after"}；接受时返回 None
+        """
+        if not Config.ADMISSION_ENABLED:
+            return None
+
+        with self._lock:
+            outline_inflight = self._outline_inflight
+            outline_seconds = self._outline_seconds or DEFAULT_OUTLINE_SECONDS
+        if self.max_outline_inflight and outline_inflight >= self.max_outline_inflight:
+            return self._reject(
+                "outline", 503,
+                f"服务繁忙：正在生成的大纲已达 {outline_inflight} 个",
+                int(min(MAX_RETRY_AFTER_SECONDS, max(1, math.ceil(outline_seconds))))
+            )
+
+        load = self.get_load()
+        reason = self._saturation(load)
+        if reason:
+            return self._reject("outline", 503, f"服务繁忙：{reason}", self._retry_after(load))
+
+        with self._lock:
+            self.admitted["outline"] += 1
+        return None
+
+    @contextmanager
+    def track_outline(self) -> Iterator[None]:
+        """记录一次大纲生成（在途数和耗时）"""
+        started_at = time.monotonic()
+        with self._lock:
+            self._outline_inflight += 1
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started_at
+            with self._lock:
+                self._outline_inflight -= 1
+                if self._outline_seconds is None:
+                    self._outline_seconds = elapsed
+                else:
+                    self._outline_seconds = 0.8 * self._outline_seconds + 0.2 * elapsed
+
+    def readiness(self) -> Dict[str, Any]:
+        """
+        实例是否就绪（未饱和）
+
+        Returns:
+            {"ready", "reason", "retry_after", "load"}；就绪时 retry_after 为 None
+        """
+        load = self.get_load()
+        reason = self._saturation(load) if Config.ADMISSION_ENABLED else None
+        retry_after = self._retry_after(load) if reason else None
+        return {"ready": reason is None, "reason": reason, "retry_after": retry_after, "load": load}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取准入控制状态"""
+        load = self.get_load()
+        with self._lock:
+            stats = {
+                "enabled": Config.ADMISSION_ENABLED,
+                **self.limits(load),
+                "max_jobs_per_client": self.max_jobs_per_client,
+                "max_outline_inflight": self.max_outline_inflight,
+                "admitted": dict(self.admitted),
+                "rejected": dict(self.rejected),
+            }
+        stats["load"] = load
+        return stats
+
+
+# 全局准入控制实例
+_admission_instance: Optional[AdmissionController] = None
+_admission_lock = threading.Lock()
+
+
+def get_admission_controller() -> AdmissionController:
+    """获取全局准入控制实例"""
+    global _admission_instance
+    with _admission_lock:
+        if _admission_instance is None:
+            # 配置为负数（默认）时按容量自动计算
+            _admission_instance = AdmissionController(
+                max_queued_jobs=Config.ADMISSION_MAX_QUEUED_JOBS if Config.ADMISSION_MAX_QUEUED_JOBS >= 0 else None,
+                max_inflight_pages=(
+                    Config.ADMISSION_MAX_INFLIGHT_PAGES if Config.ADMISSION_MAX_INFLIGHT_PAGES >= 0 else None
+                ),
+                max_wait_seconds=Config.ADMISSION_MAX_WAIT_SECONDS,
+                max_jobs_per_client=Config.ADMISSION_MAX_JOBS_PER_CLIENT,
+                max_outline_inflight=Config.ADMISSION_MAX_OUTLINE_INFLIGHT
+            )
+        return _admission_instance
@@ -0,0 +1,136 @@
+"""异步生成引擎（在专用事件循环中执行协程版本的页面生成）"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from backend.utils.async_http import aclose_async_http_client
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncGenerationEngine:
+    """
+    进程级共享的异步生成引擎
+
+    一个后台线程运行事件循环，GENERATION_ENGINE=async 时共享执行器把派发的页面
+    作为协程交给这里执行：等待服务商响应、重试退避、限流冷却都只是挂起的协程，
+    不再每页占用一个线程，一个进程可以同时保持上千个服务商调用在途。
+    排队、优先级和各服务商的并发上限仍由共享执行器负责；SSE 接口照常等待执行器
+    返回的 Future，不需要感知页面是在线程还是事件循环中生成的。
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._tasks: set = set()
+        self._started_at: Optional[float] = None
+
+        self.spawned = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        """启动事件循环线程（首次使用时）"""
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+
+                self._thread = threading.Thread(target=run, name="generation-async", daemon=True)
+                self._thread.start()
+                ready.wait()
+                self._loop = loop
+                self._started_at = time.monotonic()
+                logger.info("AsyncGenerationEngine 事件循环已启动")
+            return self._loop
+
+    def spawn(self, fn: Callable, args: tuple, kwargs: dict, on_done: Callable[[asyncio.Future], None]):
+        """
+        在事件循环中执行协程函数
+
+        Args:
+            fn: 协程函数
+            args, kwargs: 调用参数
+            on_done: 协程结束后的回调（在事件循环线程中调用，参数为结束的 asyncio.Future）
+        """
+        loop = self._ensure_started()
+        loop.call_soon_threadsafe(self._start, fn, args, kwargs, on_done)
+
+    def _start(self, fn: Callable, args: tuple, kwargs: dict, on_done: Callable[[asyncio.Future], None]):
+        try:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+        except BaseException as e:
+            # 创建协程失败（如参数错误）时同样经由回调报告
+            task = asyncio.get_running_loop().create_future()
+            task.set_exception(e)
+        self._tasks.add(task)
+        self.spawned += 1
+        task.add_done_callback(self._on_task_done)
+        task.add_done_callback(on_done)
+
+    def _on_task_done(self, task: asyncio.Future):
+        self._tasks.discard(task)
+        if task.cancelled():
+            self.cancelled += 1
+        elif task.exception() is not None:
+            self.failed += 1
+        else:
+            self.completed += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取引擎运行状态"""
+        return {
+            "running": self._loop is not None and self._loop.is_running(),
+            "inflight": len(self._tasks),
+            "spawned": self.spawned,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "uptime_seconds": round(time.monotonic() - self._started_at) if self._started_at else 0,
+        }
+
+    def shutdown(self, timeout: float = 5.0):
+        """取消所有在途的协程并停止事件循环"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = None
+        if loop is None:
+            return
+
+        async def stop():
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            await aclose_async_http_client()
+
+        try:
+            asyncio.run_coroutine_threadsafe(stop(), loop).result(timeout=timeout)
+        except Exception as e:
+            logger.warning(f"AsyncGenerationEngine 关闭时未能完成清理: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=timeout)
+        logger.info("AsyncGenerationEngine 已停止")
+
+
+# 全局异步生成引擎（整个进程共享）
+_engine_instance: Optional[AsyncGenerationEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_async_engine() -> AsyncGenerationEngine:
+    """获取全局异步生成引擎实例"""
+    global _engine_instance
+    if _engine_instance is None:
+        with _engine_lock:
+            if _engine_instance is None:
+                _engine_instance = AsyncGenerationEngine()
+    return _engine_instance
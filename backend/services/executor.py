@@ -0,0 +1,732 @@
+"""共享的图片生成执行器"""
+import asyncio
+import inspect
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from backend.config import Config
+from backend.services.async_engine import get_async_engine
+from backend.utils.flow_control import AdaptiveLimiter, get_provider_cooldown
+
+logger = logging.getLogger(__name__)
+
+# 调度优先级（数值越小越优先）
+PRIORITY_COVER = 0        # 新任务的封面（其余页面都在等它作为参考图）
+PRIORITY_INTERACTIVE = 1  # 用户点击的单页重试 / 重新生成
+PRIORITY_CONTENT = 2      # 批量生成的内容页
+PRIORITY_RETRY = 3        # 批量补全失败的页面
+
+PRIORITY_NAMES = {
+    PRIORITY_COVER: "cover",
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_CONTENT: "content",
+    PRIORITY_RETRY: "batch_retry",
+}
+
+
+# 未指定租户时使用的租户名
+DEFAULT_TENANT = "default"
+
+
+def parse_tenant_weights(value: str) -> Dict[str, float]:
+    """
+    解析租户权重配置
+
+    Args:
+        value: 形如 "client_a:2,client_b:0.5" 的字符串
+
+    Returns:
+        {租户: 权重}，格式错误的项被忽略
+    """
+    weights = {}
+    for item in (value or "").split(","):
+        tenant, _, weight = item.strip().rpartition(":")
+        try:
+            if tenant and float(weight) > 0:
+                weights[tenant] = float(weight)
+        except ValueError:
+            logger.warning(f"忽略无效的租户权重配置: {item}")
+    return weights
+
+
+class _PendingItem:
+    """排队中的一次提交"""
+
+    __slots__ = ("future", "fn", "args", "kwargs", "priority", "tenant", "weight", "enqueued_at", "is_async")
+
+    def __init__(
+        self,
+        future: Future,
+        fn: Callable,
+        args: tuple,
+        kwargs: dict,
+        priority: int,
+        tenant: str = DEFAULT_TENANT,
+        weight: float = 1.0
+    ):
+        self.future = future
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.tenant = tenant
+        self.weight = weight
+        self.enqueued_at = time.monotonic()
+        # 协程函数在异步生成引擎中执行，不占用工作线程
+        self.is_async = inspect.iscoroutinefunction(fn)
+
+
+class _FairQueue:
+    """
+    单个优先级内按租户加权公平排队（stride 调度）
+
+    每个租户一个 FIFO 队列和一个进度值，每派发一次进度增加 1 / 权重，
+    总是派发进度最小的租户。新出现的租户从当前进度开始，不能用空闲期间
+    积累的额度一次占满服务商；同一个用户提交 20 页也只和其他用户轮流派发。
+    """
+
+    def __init__(self):
+        self._tenants: "OrderedDict[str, Deque[_PendingItem]]" = OrderedDict()
+        self._pass: Dict[str, float] = {}
+        self._vtime = 0.0
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self._tenants.values())
+
+    def __bool__(self) -> bool:
+        return bool(self._tenants)
+
+    def append(self, item: _PendingItem):
+        queue = self._tenants.get(item.tenant)
+        if queue is None:
+            queue = deque()
+            self._tenants[item.tenant] = queue
+            self._pass[item.tenant] = self._vtime
+        queue.append(item)
+
+    def head(self) -> Optional[_PendingItem]:
+        """进度最小的租户的队首（进度相同时先到先得）"""
+        best = None
+        best_key = None
+        for tenant, queue in self._tenants.items():
+            key = (self._pass[tenant], queue[0].enqueued_at)
+            if best_key is None or key < best_key:
+                best, best_key = queue[0], key
+        return best
+
+    def popleft(self) -> _PendingItem:
+        """取出 head() 返回的提交"""
+        item = self.head()
+        queue = self._tenants[item.tenant]
+        queue.popleft()
+        self._vtime = self._pass[item.tenant]
+        self._pass[item.tenant] += 1.0 / item.weight
+        if not queue:
+            # 租户暂时没有排队的页面：释放队列，再次出现时从当前进度开始
+            del self._tenants[item.tenant]
+            del self._pass[item.tenant]
+        return item
+
+    def tenants(self) -> Dict[str, int]:
+        """各租户排队的提交数"""
+        return {tenant: len(queue) for tenant, queue in self._tenants.items()}
+
+    def drain(self) -> List[_PendingItem]:
+        items = [item for queue in self._tenants.values() for item in queue]
+        self._tenants.clear()
+        self._pass.clear()
+        return items
+
+
+class _PriorityQueue:
+    """
+    按优先级排队，并按等待时间老化（防止低优先级饿死）
+
+    每个优先级一个按租户公平排队的队列；选择时比较各优先级下一个提交的有效优先级：
+    priority - 已等待秒数 / aging_seconds。等待足够久的低优先级提交最终会排到
+    新到的高优先级提交前面。
+    """
+
+    def __init__(self, aging_seconds: float):
+        self.aging_seconds = aging_seconds
+        self._queues: Dict[int, _FairQueue] = {priority: _FairQueue() for priority in PRIORITY_NAMES}
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def append(self, item: _PendingItem):
+        self._queues[item.priority].append(item)
+
+    def _effective(self, item: _PendingItem, now: float) -> float:
+        if self.aging_seconds <= 0:
+            return item.priority
+        return item.priority - (now - item.enqueued_at) / self.aging_seconds
+
+    def peek(self, now: float) -> Optional[_PendingItem]:
+        """下一个应派发的提交"""
+        best = None
+        best_key = None
+        for queue in self._queues.values():
+            if not queue:
+                continue
+            head = queue.head()
+            key = (self._effective(head, now), head.enqueued_at)
+            if best_key is None or key < best_key:
+                best, best_key = head, key
+        return best
+
+    def effective_priority(self, now: float) -> Optional[float]:
+        """下一个提交的有效优先级（用于在服务商之间选择）"""
+        item = self.peek(now)
+        return None if item is None else self._effective(item, now)
+
+    def top_priority(self) -> Optional[int]:
+        """当前排队中的最高优先级（不考虑老化）"""
+        priorities = [priority for priority, queue in self._queues.items() if queue]
+        return min(priorities) if priorities else None
+
+    def pop(self, item: _PendingItem):
+        """取出 peek() 返回的提交"""
+        self._queues[item.priority].popleft()
+
+    def count(self, priority: int) -> int:
+        return len(self._queues[priority])
+
+    def tenants(self) -> Dict[str, int]:
+        """各租户排队的提交数"""
+        counts: Dict[str, int] = {}
+        for queue in self._queues.values():
+            for tenant, count in queue.tenants().items():
+                counts[tenant] = counts.get(tenant, 0) + count
+        return counts
+
+    def drain(self) -> List[_PendingItem]:
+        """取出所有提交"""
+        items = []
+        for queue in self._queues.values():
+            items.extend(queue.drain())
+        return items
+
+
+class _ClassStats:
+    """单个优先级的调度统计"""
+
+    __slots__ = ("submitted", "dispatched", "completed", "failed", "dropped", "promoted", "wait_total", "wait_max")
+
+    def __init__(self):
+        self.submitted = 0
+        self.dispatched = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.promoted = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+class _ProviderLane:
+    """单个服务商的排队通道（限制该服务商的同时在途请求数，按优先级派发）"""
+
+    def __init__(self, name: str, limiter: Optional[AdaptiveLimiter] = None, aging_seconds: float = 10.0):
+        self.name = name
+        self.limiter = limiter
+        self.cooldown = get_provider_cooldown(name)
+        self.resume_timer: Optional[threading.Timer] = None
+        self.active = 0
+        self.pending = _PriorityQueue(aging_seconds)
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        # 直接占用名额的额外调用（对冲请求）次数
+        self.extra = 0
+
+    @property
+    def limit(self) -> int:
+        """当前并发上限（由服务商的自适应限制器决定，未登记的服务商串行执行）"""
+        return self.limiter.limit if self.limiter is not None else 1
+
+
+class GenerationExecutor:
+    """
+    进程级共享的图片生成执行器
+
+    所有任务（/generate、/retry、/retry-failed、/regenerate）都把页面提交到这里，
+    由一个长期存在的线程池执行；每个服务商有独立的并发上限，超出上限的页面在
+    该服务商的通道中排队，而不是每个请求各自创建线程池同时打满服务商。
+
+    排队的页面按优先级派发：新任务的封面 > 用户交互的单页重试/重新生成 >
+    批量内容页 > 批量补全。低优先级的页面随等待时间老化，不会被持续到来的
+    高优先级页面饿死。同一优先级内按租户（客户端）加权公平派发，多个用户同时
+    生成时服务商并发在各用户之间交替分配。
+
+    提交的函数是协程函数时（GENERATION_ENGINE=async），派发后交给异步生成引擎的
+    事件循环执行，不占用工作线程，全局在途数改由 max_async_inflight 限制。
+    """
+
+    def __init__(
+        self,
+        max_workers: int,
+        aging_seconds: float = 10.0,
+        tenant_weights: Optional[Dict[str, float]] = None,
+        max_async_inflight: int = 0
+    ):
+        """
+        初始化执行器
+
+        Args:
+            max_workers: 全局最大工作线程数
+            aging_seconds: 排队页面每等待多少秒提升一个优先级（0 表示严格按优先级）
+            tenant_weights: 租户权重（未配置的租户权重为 1）
+            max_async_inflight: 异步生成引擎中同时执行的页面数上限（0 表示与 max_workers 相同）
+        """
+        self.max_workers = max(1, int(max_workers))
+        self.max_async_inflight = max(0, int(max_async_inflight))
+        self.aging_seconds = aging_seconds
+        self.tenant_weights = tenant_weights or {}
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix="generation"
+        )
+        # 对冲时执行首个请求的辅助线程（调用方的工作线程只等待结果），与工作线程数相同的上限
+        self._helper_pool = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix="generation-helper"
+        )
+        self._helpers_active = 0
+        self._lock = threading.Lock()
+        self._lanes: Dict[str, _ProviderLane] = {}
+        self._classes: Dict[int, _ClassStats] = {priority: _ClassStats() for priority in PRIORITY_NAMES}
+        self._tenant_active: Dict[str, int] = {}
+        # 单页执行耗时的指数移动平均（秒），用于估算排队等待时间
+        self._service_seconds: Optional[float] = None
+        self._active_total = 0
+        self._active_threads = 0
+        self._active_async = 0
+        self._shutdown = False
+        logger.info(f"GenerationExecutor 初始化完成: max_workers={self.max_workers}, aging={self.aging_seconds:g}s")
+
+    def configure_provider(self, provider_name: str, limiter: AdaptiveLimiter):
+        """
+        登记服务商的并发限制器
+
+        Args:
+            provider_name: 服务商名称
+            limiter: 该服务商的自适应并发限制器，其当前上限即该通道的最大在途请求数
+        """
+        with self._lock:
+            lane = self._lanes.get(provider_name)
+            if lane is None:
+                lane = _ProviderLane(provider_name, limiter, self.aging_seconds)
+                self._lanes[provider_name] = lane
+            else:
+                lane.limiter = limiter
+            logger.debug(f"服务商并发上限: {provider_name}={lane.limit}")
+            self._dispatch_locked()
+
+        # 并发上限提升时立即派发排队中的任务；进入冷却时暂停派发
+        limiter.add_listener(self._on_limit_changed)
+        lane.cooldown.add_listener(self._on_limit_changed)
+
+    def _on_limit_changed(self):
+        with self._lock:
+            self._dispatch_locked()
+
+    def _schedule_resume_locked(self, lane: _ProviderLane, delay: float):
+        """服务商冷却期间暂停派发，并在冷却结束后重新派发该通道的排队任务"""
+        if lane.resume_timer is not None and lane.resume_timer.is_alive():
+            return
+        lane.resume_timer = threading.Timer(delay + 0.01, self._on_limit_changed)
+        lane.resume_timer.daemon = True
+        lane.resume_timer.start()
+
+    def submit(
+        self,
+        provider_name: str,
+        fn: Callable,
+        *args,
+        priority: int = PRIORITY_CONTENT,
+        tenant: Optional[str] = None,
+        **kwargs
+    ) -> Future:
+        """
+        提交一个生成任务
+
+        Args:
+            provider_name: 执行该任务所使用的服务商
+            fn: 要执行的函数
+            *args, **kwargs: 函数参数
+            priority: 调度优先级（PRIORITY_*）
+            tenant: 租户（客户端标识或任务 ID），同一优先级内按租户公平派发
+
+        Returns:
+            该任务的 Future
+        """
+        future: Future = Future()
+        if priority not in PRIORITY_NAMES:
+            priority = PRIORITY_CONTENT
+        tenant = tenant or DEFAULT_TENANT
+        weight = self.tenant_weights.get(tenant, 1.0)
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("GenerationExecutor 已关闭，无法提交新任务")
+
+            lane = self._lanes.get(provider_name)
+            if lane is None:
+                # 未登记限制器的服务商默认串行执行
+                lane = _ProviderLane(provider_name, aging_seconds=self.aging_seconds)
+                self._lanes[provider_name] = lane
+
+            lane.pending.append(_PendingItem(future, fn, args, kwargs, priority, tenant, weight))
+            lane.submitted += 1
+            self._classes[priority].submitted += 1
+            self._dispatch_locked()
+        return future
+
+    def _dispatch_locked(self):
+        """
+        在持有锁的情况下，把排队的任务派发到线程池
+
+        每次在所有可派发的服务商通道中选出有效优先级最高的提交，
+        全局工作线程不足时也优先派发高优先级的页面。
+        """
+        while True:
+            now = time.monotonic()
+            selected = None
+            selected_key = None
+            for lane in self._lanes.values():
+                if lane.active >= lane.limit or not len(lane.pending):
+                    continue
+                cooldown_remaining = lane.cooldown.remaining()
+                if cooldown_remaining > 0:
+                    self._schedule_resume_locked(lane, cooldown_remaining)
+                    continue
+                if not self._has_slot_locked(lane.pending.peek(now)):
+                    continue
+                key = lane.pending.effective_priority(now)
+                if selected_key is None or key < selected_key:
+                    selected, selected_key = lane, key
+            if selected is None:
+                return
+
+            lane = selected
+            top_priority = lane.pending.top_priority()
+            item = lane.pending.peek(now)
+            lane.pending.pop(item)
+            stats = self._classes[item.priority]
+            # 已被调用方取消的任务直接丢弃
+            if not item.future.set_running_or_notify_cancel():
+                stats.dropped += 1
+                continue
+
+            waited = now - item.enqueued_at
+            stats.dispatched += 1
+            stats.wait_total += waited
+            stats.wait_max = max(stats.wait_max, waited)
+            if top_priority is not None and item.priority > top_priority:
+                # 因等待老化而排到了更高优先级的页面前面
+                stats.promoted += 1
+
+            lane.active += 1
+            self._active_total += 1
+            self._tenant_active[item.tenant] = self._tenant_active.get(item.tenant, 0) + 1
+            if item.is_async:
+                self._active_async += 1
+                # 引擎的回调总是在事件循环线程中异步触发，不会在持有锁时重入
+                get_async_engine().spawn(
+                    item.fn, item.args, item.kwargs,
+                    lambda task, lane=lane, item=item, dispatched_at=now: self._on_async_done(
+                        lane, item, dispatched_at, task
+                    )
+                )
+            else:
+                self._active_threads += 1
+                self._pool.submit(self._run, lane, item, now)
+
+    def _has_slot_locked(self, item: _PendingItem) -> bool:
+        """全局是否还能再执行一个该类型的提交（线程池或异步生成引擎）"""
+        if item.is_async:
+            return self._active_async < (self.max_async_inflight or self.max_workers)
+        return self._active_threads < self.max_workers
+
+    def _run(self, lane: _ProviderLane, item: _PendingItem, dispatched_at: float):
+        """在工作线程中执行任务，并在结束后释放服务商通道"""
+        succeeded = False
+        try:
+            result = item.fn(*item.args, **item.kwargs)
+            item.future.set_result(result)
+            succeeded = True
+        except BaseException as e:
+            item.future.set_exception(e)
+        finally:
+            self._finish(lane, item, dispatched_at, succeeded)
+
+    def _on_async_done(self, lane: _ProviderLane, item: _PendingItem, dispatched_at: float, task: asyncio.Future):
+        """异步生成引擎中的协程结束：转交结果，并释放服务商通道"""
+        succeeded = False
+        if task.cancelled():
+            # 只有引擎关闭时协程才会被直接取消（任务取消由截止时间转换为 TaskCancelledError）
+            item.future.set_exception(RuntimeError("异步生成引擎已关闭，页面生成被中止"))
+        elif task.exception() is not None:
+            item.future.set_exception(task.exception())
+        else:
+            item.future.set_result(task.result())
+            succeeded = True
+        self._finish(lane, item, dispatched_at, succeeded)
+
+    def _finish(self, lane: _ProviderLane, item: _PendingItem, dispatched_at: float, succeeded: bool):
+        """记录执行结果，释放服务商通道并派发排队中的任务"""
+        with self._lock:
+            elapsed = time.monotonic() - dispatched_at
+            if self._service_seconds is None:
+                self._service_seconds = elapsed
+            else:
+                self._service_seconds = 0.8 * self._service_seconds + 0.2 * elapsed
+            lane.active -= 1
+            self._active_total -= 1
+            if item.is_async:
+                self._active_async -= 1
+            else:
+                self._active_threads -= 1
+            remaining = self._tenant_active.get(item.tenant, 1) - 1
+            if remaining > 0:
+                self._tenant_active[item.tenant] = remaining
+            else:
+                self._tenant_active.pop(item.tenant, None)
+            stats = self._classes[item.priority]
+            if succeeded:
+                lane.completed += 1
+                stats.completed += 1
+            else:
+                lane.failed += 1
+                stats.failed += 1
+            self._dispatch_locked()
+
+    def try_reserve(self, provider_name: str, is_async: bool = False) -> bool:
+        """
+        为一次额外的服务商调用（对冲请求）直接占用一个名额，不排队
+
+        额外调用与派发的页面一样占用该服务商通道的一个并发名额和一个全局执行名额，
+        因此同样受服务商的自适应并发上限约束；只使用空闲的名额：通道已满、有页面在排队、
+        服务商冷却中或全局名额已满时返回 False。占用成功后必须调用 release() 归还。
+
+        Args:
+            provider_name: 服务商名称
+            is_async: 调用是否在异步生成引擎中执行（占用 max_async_inflight 而不是工作线程名额）
+
+        Returns:
+            是否占用成功
+        """
+        with self._lock:
+            lane = self._lanes.get(provider_name)
+            if (self._shutdown or lane is None or lane.active >= lane.limit
+                    or len(lane.pending) or lane.cooldown.remaining() > 0):
+                return False
+            if is_async:
+                if self._active_async >= (self.max_async_inflight or self.max_workers):
+                    return False
+                self._active_async += 1
+            else:
+                if self._active_threads >= self.max_workers:
+                    return False
+                self._active_threads += 1
+            lane.active += 1
+            lane.extra += 1
+            self._active_total += 1
+            return True
+
+    def release(self, provider_name: str, is_async: bool = False):
+        """归还 try_reserve() 占用的名额，并派发排队中的任务"""
+        with self._lock:
+            lane = self._lanes[provider_name]
+            lane.active -= 1
+            self._active_total -= 1
+            if is_async:
+                self._active_async -= 1
+            else:
+                self._active_threads -= 1
+            self._dispatch_locked()
+
+    def run_reserved(self, fn: Callable, *args, **kwargs) -> Future:
+        """
+        在共享线程池中执行一次已通过 try_reserve() 占用名额的调用（不排队，名额由调用方归还）
+
+        Args:
+            fn: 要执行的函数
+            *args, **kwargs: 函数参数
+
+        Returns:
+            调用的 Future
+        """
+        return self._pool.submit(fn, *args, **kwargs)
+
+    def try_run_helper(self, fn: Callable, *args, **kwargs) -> Optional[Future]:
+        """
+        在辅助线程池中执行调用方名额内的一次调用（对冲时的首个请求，调用方线程只等待结果）
+
+        首个请求在对冲请求获胜后可能继续执行一段时间，因此辅助线程不占用工作线程，
+        而是单独限制在 max_workers 个以内。
+
+        Args:
+            fn: 要执行的函数
+            *args, **kwargs: 函数参数
+
+        Returns:
+            调用的 Future；辅助线程已满或执行器已关闭时返回 None（调用方直接执行，不对冲）
+        """
+        with self._lock:
+            if self._shutdown or self._helpers_active >= self.max_workers:
+                return None
+            self._helpers_active += 1
+
+        def run():
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._helpers_active -= 1
+
+        return self._helper_pool.submit(run)
+
+    def provider_slots(self, provider_name: str) -> "ProviderSlots":
+        """服务商通道的额外调用名额（交给该服务商的对冲控制使用）"""
+        return ProviderSlots(self, provider_name)
+
+    def get_load(self) -> Dict[str, Any]:
+        """
+        获取执行器负载（准入控制使用）
+
+        Returns:
+            active: 执行中的页面数；queued: 排队中的页面数；
+            capacity: 当前可同时执行的页面数（各服务商并发上限之和，不超过全局工作线程数，
+                使用异步生成引擎时不超过 max_async_inflight）；
+            avg_service_seconds: 单页平均执行耗时（尚无样本时为 None）
+        """
+        with self._lock:
+            lane_capacity = sum(lane.limit for lane in self._lanes.values())
+            slots = self.max_async_inflight or self.max_workers
+            return {
+                "active": self._active_total,
+                "queued": sum(len(lane.pending) for lane in self._lanes.values()),
+                "capacity": min(slots, lane_capacity) if lane_capacity else slots,
+                "avg_service_seconds": self._service_seconds,
+            }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取执行器运行状态
+
+        Returns:
+            包含全局与各服务商的排队数、活跃工作线程数，以及各优先级调度统计的字典
+        """
+        with self._lock:
+            providers = {
+                name: {
+                    "limit": lane.limit,
+                    "active": lane.active,
+                    "queued": len(lane.pending),
+                    "queued_by_priority": {
+                        PRIORITY_NAMES[priority]: lane.pending.count(priority) for priority in PRIORITY_NAMES
+                    },
+                    "submitted": lane.submitted,
+                    "completed": lane.completed,
+                    "failed": lane.failed,
+                    "extra": lane.extra,
+                    "cooling_down": lane.cooldown.remaining() > 0,
+                }
+                for name, lane in self._lanes.items()
+            }
+            priorities = {}
+            for priority, stats in self._classes.items():
+                priorities[PRIORITY_NAMES[priority]] = {
+                    "queued": sum(lane.pending.count(priority) for lane in self._lanes.values()),
+                    "submitted": stats.submitted,
+                    "dispatched": stats.dispatched,
+                    "completed": stats.completed,
+                    "failed": stats.failed,
+                    "dropped": stats.dropped,
+                    "promoted": stats.promoted,
+                    "avg_wait_ms": round(stats.wait_total / stats.dispatched * 1000) if stats.dispatched else 0,
+                    "max_wait_ms": round(stats.wait_max * 1000),
+                }
+            tenants: Dict[str, Dict[str, int]] = {
+                tenant: {"active": active, "queued": 0} for tenant, active in self._tenant_active.items()
+            }
+            for lane in self._lanes.values():
+                for tenant, count in lane.pending.tenants().items():
+                    tenants.setdefault(tenant, {"active": 0, "queued": 0})["queued"] += count
+            return {
+                "max_workers": self.max_workers,
+                "active_workers": self._active_threads,
+                "max_async_inflight": self.max_async_inflight,
+                "active_async": self._active_async,
+                "active_helpers": self._helpers_active,
+                "queue_depth": sum(len(lane.pending) for lane in self._lanes.values()),
+                "aging_seconds": self.aging_seconds,
+                "avg_service_ms": round(self._service_seconds * 1000) if self._service_seconds is not None else None,
+                "providers": providers,
+                "priorities": priorities,
+                "tenants": tenants,
+            }
+
+    def shutdown(self, wait: bool = False):
+        """关闭执行器，取消所有尚未开始的任务（异步生成引擎中在途的协程一并中止）"""
+        with self._lock:
+            self._shutdown = True
+            for lane in self._lanes.values():
+                for item in lane.pending.drain():
+                    item.future.cancel()
+        self._pool.shutdown(wait=wait)
+        self._helper_pool.shutdown(wait=wait)
+        get_async_engine().shutdown()
+
+
+class ProviderSlots:
+    """
+    单个服务商通道的额外调用名额
+
+    对冲请求通过它占用执行器的空闲名额，与页面一样计入服务商的并发上限和全局执行名额。
+    """
+
+    def __init__(self, executor: GenerationExecutor, provider_name: str):
+        self.executor = executor
+        self.provider_name = provider_name
+
+    def try_reserve(self, is_async: bool = False) -> bool:
+        """占用一个空闲名额（见 GenerationExecutor.try_reserve）"""
+        return self.executor.try_reserve(self.provider_name, is_async)
+
+    def release(self, is_async: bool = False):
+        """归还 try_reserve() 占用的名额"""
+        self.executor.release(self.provider_name, is_async)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """在共享线程池中执行已占用名额的调用"""
+        return self.executor.run_reserved(fn, *args, **kwargs)
+
+    def run_primary(self, fn: Callable, *args, **kwargs) -> Optional[Future]:
+        """在辅助线程中执行调用方名额内的首个请求（见 GenerationExecutor.try_run_helper）"""
+        return self.executor.try_run_helper(fn, *args, **kwargs)
+
+
+# 全局执行器实例（整个进程共享，不随配置更新重建）
+_executor_instance: Optional[GenerationExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_generation_executor() -> GenerationExecutor:
+    """获取全局图片生成执行器实例"""
+    global _executor_instance
+    if _executor_instance is None:
+        with _executor_lock:
+            if _executor_instance is None:
+                _executor_instance = GenerationExecutor(
+                    Config.GENERATION_MAX_WORKERS,
+                    aging_seconds=Config.SCHEDULER_AGING_SECONDS,
+                    tenant_weights=parse_tenant_weights(Config.SCHEDULER_TENANT_WEIGHTS),
+                    max_async_inflight=Config.ASYNC_MAX_INFLIGHT_PAGES if Config.GENERATION_ENGINE == 'async' else 0
+                )
+    return _executor_instance
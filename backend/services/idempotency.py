@@ -0,0 +1,153 @@
+"""请求幂等（重复提交的生成请求复用进行中或已完成的结果，不再重复调用服务商）"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from backend.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def request_fingerprint(*parts: Any) -> str:
+    """
+    计算请求内容的指纹（客户端没有传入 Idempotency-Key 时作为幂等键）
+
+    Args:
+        *parts: 参与计算的请求内容（需可 JSON 序列化）
+
+    Returns:
+        十六进制摘要
+    """
+    content = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]
+
+
+class _Call:
+    """一次进行中的请求"""
+
+    __slots__ = ("done", "result")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+
+
+class IdempotencyRegistry:
+    """
+    同步接口（/api/regenerate）的幂等登记
+
+    同一个幂等键的请求正在执行时，重复提交等待并共享它的结果（single-flight）；
+    显式传入 Idempotency-Key 的请求成功后保存结果，在 ttl_seconds 内重复提交直接返回。
+    只在当前进程内生效；写入后台任务队列的接口（/api/generate、/api/retry-failed）
+    由任务队列按幂等键去重，跨进程同样有效。
+    """
+
+    def __init__(self, ttl_seconds: float = 3600.0, max_entries: int = 1000):
+        """
+        初始化幂等登记
+
+        Args:
+            ttl_seconds: 成功结果的保留时间（秒）
+            max_entries: 最多保留的结果数
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._inflight: Dict[str, _Call] = {}
+        self._results: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.executed = 0
+        self.joined = 0
+        self.replayed = 0
+
+    def run(
+        self,
+        key: str,
+        fn: Callable[[], Dict[str, Any]],
+        reuse_finished: bool = False
+    ) -> Tuple[Dict[str, Any], bool]:
+        """
+        按幂等键执行请求
+
+        Args:
+            key: 幂等键
+            fn: 实际执行请求的函数，返回带 success 字段的结果
+            reuse_finished: 是否保存并复用成功的结果（客户端显式传入 Idempotency-Key 时）
+
+        Returns:
+            (结果, 是否复用了其他请求的结果)
+        """
+        with self._lock:
+            self._expire_locked()
+            stored = self._results.get(key)
+            if stored is not None and reuse_finished:
+                self.replayed += 1
+                return stored[1], True
+            call = self._inflight.get(key)
+            owner = call is None
+            if owner:
+                call = _Call()
+                self._inflight[key] = call
+                self.executed += 1
+            else:
+                self.joined += 1
+
+        if not owner:
+            logger.info(f"🔁 重复提交，等待进行中的请求: {key}")
+            call.done.wait()
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.result = {"success": False, "error": f"请求执行失败: {e}"}
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                if reuse_finished and call.result and call.result.get("success"):
+                    self._results[key] = (time.monotonic(), call.result)
+                    self._results.move_to_end(key)
+                    while len(self._results) > self.max_entries:
+                        self._results.popitem(last=False)
+            call.done.set()
+        return call.result, False
+
+    def _expire_locked(self):
+        cutoff = time.monotonic() - self.ttl_seconds
+        while self._results:
+            key, (stored_at, _) = next(iter(self._results.items()))
+            if stored_at >= cutoff:
+                break
+            self._results.popitem(last=False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取幂等登记状态"""
+        with self._lock:
+            self._expire_locked()
+            return {
+                "inflight": len(self._inflight),
+                "stored": len(self._results),
+                "ttl_seconds": self.ttl_seconds,
+                "executed": self.executed,
+                "joined": self.joined,
+                "replayed": self.replayed,
+            }
+
+
+# 全局幂等登记实例
+_registry_instance: Optional[IdempotencyRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_idempotency_registry() -> IdempotencyRegistry:
+    """获取全局幂等登记实例"""
+    global _registry_instance
+    with _registry_lock:
+        if _registry_instance is None:
+            _registry_instance = IdempotencyRegistry(ttl_seconds=Config.IDEMPOTENCY_TTL_SECONDS)
+        return _registry_instance
@@ -1,14 +1,22 @@
 """图片生成服务"""
+import asyncio
 import logging
 import os
 import uuid
-import time
-import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import CancelledError, Future, InvalidStateError, TimeoutError as FuturesTimeoutError, as_completed
 from typing import Dict, Any, Generator, List, Optional, Tuple
 from backend.config import Config
-from backend.generators.factory import ImageGeneratorFactory
+from backend.generators.base import AsyncImageGeneratorBase
+from backend.services.executor import (
+    PRIORITY_CONTENT, PRIORITY_COVER, PRIORITY_INTERACTIVE, PRIORITY_RETRY, get_generation_executor
+)
+from backend.services.provider_pool import ImageProvider, ProviderPool, should_failover
+from backend.services.task import GenerationTask
+from backend.services.task_store import get_task_store
+from backend.utils.deadline import Deadline, is_deadline_exceeded
 from backend.utils.image_compressor import compress_image
+from backend.utils.reference import ReferenceBundle
+from backend.utils.retry import classify_error
 
 logger = logging.getLogger(__name__)
 
@@ -16,10 +24,6 @@ logger = logging.getLogger(__name__)
 class ImageService:
     """图片生成服务类"""
 
-    # 并发配置
-    MAX_CONCURRENT = 15  # 最大并发数
-    AUTO_RETRY_COUNT = 3  # 自动重试次数
-
     def __init__(self, provider_name: str = None):
         """
         初始化图片生成服务
@@ -29,21 +33,21 @@ class ImageService:
         """
         logger.debug("初始化 ImageService...")
 
-        # 获取服务商配置
+        # 服务商池：未指定服务商时使用配置中的 provider_pool（未配置则只有激活的服务商）
         if provider_name is None:
-            provider_name = Config.get_active_image_provider()
-
-        logger.info(f"使用图片服务商: {provider_name}")
-        provider_config = Config.get_image_provider_config(provider_name)
+            provider_names = Config.get_image_provider_pool()
+        else:
+            provider_names = [provider_name]
 
-        # 创建生成器实例
-        provider_type = provider_config.get('type', provider_name)
-        logger.debug(f"创建生成器: type={provider_type}")
-        self.generator = ImageGeneratorFactory.create(provider_type, provider_config)
+        # 按页面类型的路由规则（封面 / 内容页 / 总结页使用不同的服务商、模型和分辨率）
+        self.page_routing = Config.get_page_routing()
+        routed_names = [rule['provider'] for rule in self.page_routing.values() if rule.get('provider')]
 
-        # 保存配置信息
-        self.provider_name = provider_name
-        self.provider_config = provider_config
+        logger.info(f"使用图片服务商: {', '.join(provider_names)}")
+        self.executor = get_generation_executor()
+        self.pool = ProviderPool(provider_names, self.executor, routed_names)
+        # GENERATION_ENGINE=async 时页面以协程提交，由异步生成引擎执行（不占用工作线程）
+        self.async_engine = Config.GENERATION_ENGINE == 'async'
 
         # 加载提示词模板
         self.prompt_template = self._load_prompt_template()
@@ -55,13 +59,155 @@ class ImageService:
         )
         os.makedirs(self.history_root_dir, exist_ok=True)
 
-        # 当前任务的输出目录（每个任务一个子文件夹）
-        self.current_task_dir = None
+        # 任务上下文存储（用于重试，进程级共享），每个任务一个子文件夹
+        self.task_store = get_task_store()
+
+        logger.info(f"ImageService 初始化完成: providers={[p.name for p in self.pool.providers]}")
+
+    def _submit_page(
+        self,
+        task: GenerationTask,
+        page: Dict,
+        use_reference: bool = True,
+        deadline: Optional[Deadline] = None,
+        priority: int = PRIORITY_CONTENT,
+        tenant: Optional[str] = None
+    ) -> Future:
+        """
+        把单页生成提交到共享执行器，返回结果 Future
+
+        页面先交给服务商池按权重选出的服务商；失败且错误适合切换时（限流、熔断、
+        服务端错误等），依次提交到池中其他服务商的通道。切换服务商时保持原优先级。
+        同一优先级的页面按租户（默认为任务的客户端）公平派发。
+
+        Returns:
+            结果为 (index, success, filename, error_message) 的 Future
+        """
+        result: Future = Future()
+        if (deadline or task.deadline).cancelled:
+            # 任务已取消：不再提交到执行器
+            result.set_result((page["index"], False, None, str((deadline or task.deadline).cancelled_error("图片生成"))))
+            return result
+
+        rule = self.page_routing.get(page.get("type"), {})
+        providers = self.pool.plan(rule.get('provider'))
+        index = page["index"]
+        tenant = tenant or task.tenant
+        current = {}
+
+        def resolve(value):
+            try:
+                result.set_result(value)
+            except InvalidStateError:
+                # 调用方已取消（如超过截止时间）
+                pass
+
+        def attempt(position: int):
+            provider = providers[position]
+            inner = self.executor.submit(
+                provider.name,
+                self._agenerate_single_image if self.async_engine else self._generate_single_image,
+                task,
+                page,
+                use_reference,
+                deadline,
+                provider,
+                priority=priority,
+                tenant=tenant
+            )
+            current["future"] = inner
+            inner.add_done_callback(lambda f: on_done(position, f))
+
+        def on_done(position: int, inner: Future):
+            if result.cancelled():
+                return
+            if inner.cancelled():
+                resolve((index, False, None, "生成已取消"))
+                return
+            error = inner.exception()
+            if error is None:
+                resolve((index, True, inner.result(), None))
+                return
+
+            next_position = position + 1
+            if (next_position < len(providers) and should_failover(error)
+                    and not (deadline or task.deadline).expired()):
+                self.pool.record_failover(providers[position].name, providers[next_position].name, str(error))
+                try:
+                    attempt(next_position)
+                    return
+                except RuntimeError as e:
+                    error = e
+            resolve((index, False, None, str(error)))
+
+        def on_cancel(f: Future):
+            if f.cancelled() and current.get("future") is not None:
+                current["future"].cancel()
+
+        result.add_done_callback(on_cancel)
+        attempt(0)
+        return result
+
+    def _wait_page(self, future: Future, page: Dict, deadline: Deadline) -> Tuple[int, bool, Optional[str], Optional[str]]:
+        """等待单页结果；超过截止时间仍未完成时取消排队并按 deadline exceeded 失败，任务取消时立即返回"""
+        deadline.add_cancel_callback(future.cancel)
+        try:
+            return future.result(timeout=deadline.remaining())
+        except FuturesTimeoutError:
+            future.cancel()
+            return (page["index"], False, None, str(deadline.error("图片生成")))
+        except CancelledError:
+            return (page["index"], False, None, str(deadline.cancelled_error("图片生成")))
+        except Exception as e:
+            return (page["index"], False, None, str(e))
+        finally:
+            deadline.remove_cancel_callback(future.cancel)
+
+    def _iter_page_results(
+        self,
+        future_to_page: Dict[Future, Dict],
+        deadline: Deadline
+    ) -> Generator[Tuple[Dict, Tuple[int, bool, Optional[str], Optional[str]]], None, None]:
+        """
+        按完成顺序产出每页的结果
 
-        # 存储任务状态（用于重试）
-        self._task_states: Dict[str, Dict] = {}
+        超过截止时间后，尚未完成的页面不再等待：排队中的直接取消，
+        所有未完成页面以 deadline exceeded 失败。任务被取消时所有未完成页面立即取消，
+        执行中的服务商调用在下一个检查点中止。
 
-        logger.info(f"ImageService 初始化完成: provider={provider_name}, type={provider_type}")
+        Yields:
+            (page, (index, success, filename, error_message))
+        """
+        pending = set(future_to_page)
+
+        def cancel_pending():
+            cancelled = [future for future in list(pending) if future.cancel()]
+            for future in cancelled:
+                # 只有通知之后 as_completed 才会返回被取消的 Future
+                future.set_running_or_notify_cancel()
+            if cancelled:
+                logger.info(f"🛑 任务已取消，丢弃 {len(cancelled)} 个未完成的页面")
+
+        deadline.add_cancel_callback(cancel_pending)
+        try:
+            for future in as_completed(future_to_page, timeout=deadline.remaining()):
+                pending.discard(future)
+                page = future_to_page[future]
+                if future.cancelled():
+                    yield page, (page["index"], False, None, str(deadline.cancelled_error("图片生成")))
+                    continue
+                try:
+                    yield page, future.result()
+                except Exception as e:
+                    yield page, (page["index"], False, None, str(e))
+        except FuturesTimeoutError:
+            logger.warning(f"任务超过截止时间，{len(pending)} 页未完成")
+            for future in pending:
+                future.cancel()
+                page = future_to_page[future]
+                yield page, (page["index"], False, None, str(deadline.error("图片生成")))
+        finally:
+            deadline.remove_cancel_callback(cancel_pending)
 
     def _load_prompt_template(self) -> str:
         """加载 Prompt 模板"""
@@ -73,23 +219,91 @@ class ImageService:
         with open(prompt_path, "r", encoding="utf-8") as f:
             return f.read()
 
-    def _save_image(self, image_data: bytes, filename: str, task_dir: str = None) -> str:
+    def _get_task_dir(self, task_id: str) -> str:
+        """获取任务输出目录"""
+        return os.path.join(self.history_root_dir, task_id)
+
+    def _create_task(
+        self,
+        task_id: str,
+        pages: Optional[List[Dict]] = None,
+        full_outline: str = "",
+        user_images: Optional[List[bytes]] = None,
+        user_topic: str = "",
+        deadline: Optional[Deadline] = None
+    ) -> GenerationTask:
+        """
+        创建任务上下文并确保任务目录存在
+
+        Args:
+            task_id: 任务ID
+            pages: 页面列表
+            full_outline: 完整的大纲文本
+            user_images: 用户上传的参考图片列表（已压缩）
+            user_topic: 用户原始输入
+            deadline: 任务截止时间
+
+        Returns:
+            任务上下文
+        """
+        task_dir = self._get_task_dir(task_id)
+        task = GenerationTask(
+            task_id=task_id,
+            task_dir=task_dir,
+            pages=pages,
+            full_outline=full_outline,
+            user_images=user_images,
+            user_topic=user_topic,
+            deadline=deadline,
+            journal=self.task_store.create_journal(task_id, task_dir)
+        )
+        task.ensure_dir()
+        if pages:
+            # 新一轮生成：清除之前溢出的封面图，并写入任务日志（进程重启后可以还原并继续生成）
+            task.cover_image = None
+            task.journal.record_created(pages, full_outline, user_topic, user_images)
+        return task
+
+    def _restore_task(self, task_id: str) -> Optional[GenerationTask]:
+        """
+        获取任务上下文：优先使用内存中的任务，否则根据任务日志还原（如服务重启后）
+
+        Args:
+            task_id: 任务ID
+
+        Returns:
+            任务上下文；内存和任务日志中都没有时返回 None
+        """
+        task = self.task_store.get(task_id)
+        if task is not None:
+            return task
+
+        task_dir = self._get_task_dir(task_id)
+        task = GenerationTask.restore(
+            task_id,
+            task_dir,
+            journal=self.task_store.create_journal(task_id, task_dir)
+        )
+        if task is None:
+            return None
+
+        logger.info(f"♻️  从任务日志还原任务: {task_id}, 已完成 {task.completed_count}/{task.total} 页")
+        # 并发还原时以先放入的为准
+        return self.task_store.put(task, replace=False)
+
+    def _save_image(self, task: GenerationTask, image_data: bytes, filename: str) -> str:
         """
-        保存图片到本地，同时生成缩略图
+        保存图片到任务目录，同时生成缩略图
 
         Args:
+            task: 任务上下文
             image_data: 图片二进制数据
             filename: 文件名
-            task_dir: 任务目录（如果为None则使用当前任务目录）
 
         Returns:
             保存的文件路径
         """
-        if task_dir is None:
-            task_dir = self.current_task_dir
-
-        if task_dir is None:
-            raise ValueError("任务目录未设置")
+        task_dir = task.task_dir
 
         # 保存原图
         filepath = os.path.join(task_dir, filename)
@@ -97,7 +311,7 @@ class ImageService:
             f.write(image_data)
 
         # 生成缩略图（50KB左右）
-        thumbnail_data = compress_image(image_data, max_size_kb=50)
+        thumbnail_data = compress_image(image_data, max_size_kb=50, cache=False)
         thumbnail_filename = f"thumb_{filename}"
         thumbnail_path = os.path.join(task_dir, thumbnail_filename)
         with open(thumbnail_path, "wb") as f:
@@ -105,107 +319,213 @@ class ImageService:
 
         return filepath
 
+    def _route_options(self, page: Dict, provider: ImageProvider) -> Dict[str, Any]:
+        """
+        获取页面在该服务商上的路由参数（model、image_size、size、quality）
+
+        规则指定了服务商时，参数只在该服务商上生效（切换到后备服务商时使用其默认配置）；
+        未指定服务商时对所有服务商生效。
+        """
+        rule = self.page_routing.get(page.get("type"))
+        if not rule or (rule.get('provider') and rule['provider'] != provider.name):
+            return {}
+        return {key: rule[key] for key in ('model', 'image_size', 'size', 'quality') if rule.get(key)}
+
+    def _invoke_generator(
+        self,
+        provider: ImageProvider,
+        prompt: str,
+        references: Optional[ReferenceBundle] = None,
+        deadline: Optional[Deadline] = None,
+        options: Optional[Dict[str, Any]] = None
+    ) -> bytes:
+        """
+        按服务商类型调用生成器（重试和对冲请求由生成器上的服务商重试策略按每次尝试处理）
+
+        Args:
+            provider: 服务商
+            prompt: 图片生成提示词
+            references: 任务的参考图（用户参考图 + 封面图，已预先编码）
+            deadline: 截止时间（生成器据此收缩请求超时和重试）
+            options: 页面路由参数，覆盖服务商配置中的 model、image_size、size、quality
+
+        Returns:
+            图片二进制数据
+        """
+        return provider.generator.generate_image(
+            **self._generator_kwargs(provider, prompt, references, deadline, options)
+        )
+
+    async def _ainvoke_generator(
+        self,
+        provider: ImageProvider,
+        prompt: str,
+        references: Optional[ReferenceBundle] = None,
+        deadline: Optional[Deadline] = None,
+        options: Optional[Dict[str, Any]] = None
+    ) -> bytes:
+        """_invoke_generator 的协程版本；只有同步实现的自定义生成器在线程中调用"""
+        kwargs = self._generator_kwargs(provider, prompt, references, deadline, options)
+        if isinstance(provider.generator, AsyncImageGeneratorBase):
+            return await provider.generator.agenerate_image(**kwargs)
+        return await asyncio.to_thread(provider.generator.generate_image, **kwargs)
+
+    def _generator_kwargs(
+        self,
+        provider: ImageProvider,
+        prompt: str,
+        references: Optional[ReferenceBundle],
+        deadline: Optional[Deadline],
+        options: Optional[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """按服务商类型构造生成器的调用参数"""
+        config = dict(provider.config, **(options or {}))
+        if provider.type == 'google_genai':
+            logger.debug(f"  使用 Google GenAI 生成器")
+            return dict(
+                prompt=prompt,
+                aspect_ratio=config.get('default_aspect_ratio', '3:4'),
+                temperature=config.get('temperature', 1.0),
+                model=config.get('model', 'gemini-3-pro-image-preview'),
+                reference_bundle=references,
+                image_size=config.get('image_size'),
+                deadline=deadline,
+            )
+        elif provider.type == 'image_api':
+            logger.debug(f"  使用 Image API 生成器")
+            # Image API 支持多张参考图片：用户上传的图片 + 封面图
+            return dict(
+                prompt=prompt,
+                aspect_ratio=config.get('default_aspect_ratio', '3:4'),
+                temperature=config.get('temperature', 1.0),
+                model=config.get('model', 'nano-banana-2'),
+                reference_bundle=references,
+                image_size=config.get('image_size'),
+                deadline=deadline,
+            )
+        else:
+            logger.debug(f"  使用 OpenAI 兼容生成器")
+            return dict(
+                prompt=prompt,
+                size=config.get('default_size', '1024x1024'),
+                model=config.get('model'),
+                quality=config.get('quality', 'standard'),
+                deadline=deadline,
+            )
+
+    def _build_prompt(self, task: GenerationTask, page: Dict) -> str:
+        """构造图片生成 Prompt（包含完整大纲上下文和用户原始需求）"""
+        return self.prompt_template.format(
+            page_content=page["content"],
+            page_type=page["type"],
+            full_outline=task.full_outline,
+            user_topic=task.user_topic if task.user_topic else "未提供"
+        )
+
+    def _log_page_failure(self, index: int, provider: ImageProvider, deadline: Deadline, error: Exception):
+        if deadline.cancelled:
+            logger.info(f"图片 [{index}] 生成已取消 [{provider.name}]")
+        else:
+            logger.error(f"❌ 图片 [{index}] 生成失败 [{provider.name}] ({classify_error(error)}): {str(error)[:200]}")
+
     def _generate_single_image(
         self,
+        task: GenerationTask,
         page: Dict,
-        task_id: str,
-        reference_image: Optional[bytes] = None,
-        retry_count: int = 0,
-        full_outline: str = "",
-        user_images: Optional[List[bytes]] = None,
-        user_topic: str = ""
-    ) -> Tuple[int, bool, Optional[str], Optional[str]]:
+        use_reference: bool = True,
+        deadline: Optional[Deadline] = None,
+        provider: Optional[ImageProvider] = None
+    ) -> str:
         """
-        生成单张图片（带自动重试）
+        使用指定服务商生成单张图片
+
+        重试、退避和限流冷却统一由服务商的重试策略处理，这里不再嵌套重试，
+        避免一个无法成功的页面放大成多轮服务商调用；换服务商由 _submit_page 负责。
 
         Args:
+            task: 任务上下文（提供任务目录、封面图、用户参考图和大纲）
             page: 页面数据
-            task_id: 任务ID
-            reference_image: 参考图片（封面图）
-            retry_count: 当前重试次数
-            full_outline: 完整的大纲文本
-            user_images: 用户上传的参考图片列表
-            user_topic: 用户原始输入
+            use_reference: 是否使用任务封面作为参考图
+            deadline: 本次生成的截止时间（默认使用任务的截止时间）
+            provider: 使用的服务商（默认主服务商）
 
         Returns:
-            (index, success, filename, error_message)
+            保存的文件名
+
+        Raises:
+            生成失败时的原始错误
         """
         index = page["index"]
-        page_type = page["type"]
-        page_content = page["content"]
+        deadline = deadline or task.deadline
+        provider = provider or self.pool.primary
+
+        try:
+            # 在执行器中排队期间可能已经超时，直接失败而不再调用服务商
+            deadline.check(f"图片 [{index}] 生成")
+            logger.debug(f"生成图片 [{index}]: type={page['type']}, provider={provider.name}")
+
+            # 调用生成器生成图片
+            image_data = self._invoke_generator(
+                provider, self._build_prompt(task, page), task.reference_bundle(use_reference), deadline,
+                self._route_options(page, provider)
+            )
 
-        max_retries = self.AUTO_RETRY_COUNT
+            # 任务在生成期间被取消：不再保存结果
+            deadline.check_cancelled(f"图片 [{index}] 生成")
 
-        for attempt in range(max_retries):
-            try:
-                logger.debug(f"生成图片 [{index}]: type={page_type}, attempt={attempt + 1}/{max_retries}")
-
-                # 构造图片生成 Prompt（包含完整大纲上下文和用户原始需求）
-                prompt = self.prompt_template.format(
-                    page_content=page_content,
-                    page_type=page_type,
-                    full_outline=full_outline,
-                    user_topic=user_topic if user_topic else "未提供"
-                )
-
-                # 调用生成器生成图片
-                if self.provider_config.get('type') == 'google_genai':
-                    logger.debug(f"  使用 Google GenAI 生成器")
-                    image_data = self.generator.generate_image(
-                        prompt=prompt,
-                        aspect_ratio=self.provider_config.get('default_aspect_ratio', '3:4'),
-                        temperature=self.provider_config.get('temperature', 1.0),
-                        model=self.provider_config.get('model', 'gemini-3-pro-image-preview'),
-                        reference_image=reference_image,
-                    )
-                elif self.provider_config.get('type') == 'image_api':
-                    logger.debug(f"  使用 Image API 生成器")
-                    # Image API 支持多张参考图片
-                    # 组合参考图片：用户上传的图片 + 封面图
-                    reference_images = []
-                    if user_images:
-                        reference_images.extend(user_images)
-                    if reference_image:
-                        reference_images.append(reference_image)
-
-                    image_data = self.generator.generate_image(
-                        prompt=prompt,
-                        aspect_ratio=self.provider_config.get('default_aspect_ratio', '3:4'),
-                        temperature=self.provider_config.get('temperature', 1.0),
-                        model=self.provider_config.get('model', 'nano-banana-2'),
-                        reference_images=reference_images if reference_images else None,
-                    )
-                else:
-                    logger.debug(f"  使用 OpenAI 兼容生成器")
-                    image_data = self.generator.generate_image(
-                        prompt=prompt,
-                        size=self.provider_config.get('default_size', '1024x1024'),
-                        model=self.provider_config.get('model'),
-                        quality=self.provider_config.get('quality', 'standard'),
-                    )
-
-                # 保存图片（使用当前任务目录）
-                filename = f"{index}.png"
-                self._save_image(image_data, filename, self.current_task_dir)
-                logger.info(f"✅ 图片 [{index}] 生成成功: {filename}")
-
-                return (index, True, filename, None)
-
-            except Exception as e:
-                error_msg = str(e)
-                logger.warning(f"图片 [{index}] 生成失败 (尝试 {attempt + 1}/{max_retries}): {error_msg[:200]}")
-
-                if attempt < max_retries - 1:
-                    # 等待后重试
-                    wait_time = 2 ** attempt
-                    logger.debug(f"  等待 {wait_time} 秒后重试...")
-                    time.sleep(wait_time)
-                    continue
+            # 保存图片（使用任务自己的目录）
+            filename = f"{index}.png"
+            self._save_image(task, image_data, filename)
+            logger.info(f"✅ 图片 [{index}] 生成成功: {filename} (服务商: {provider.name})")
 
-                logger.error(f"❌ 图片 [{index}] 生成失败，已达最大重试次数")
-                return (index, False, None, error_msg)
+            return filename
 
-        return (index, False, None, "超过最大重试次数")
+        except Exception as e:
+            self._log_page_failure(index, provider, deadline, e)
+            raise
+
+    async def _agenerate_single_image(
+        self,
+        task: GenerationTask,
+        page: Dict,
+        use_reference: bool = True,
+        deadline: Optional[Deadline] = None,
+        provider: Optional[ImageProvider] = None
+    ) -> str:
+        """
+        使用指定服务商生成单张图片（协程版本，GENERATION_ENGINE=async 时由异步生成引擎执行）
+
+        任务被取消或超过截止时间时，正在等待的服务商请求立即中止，不必等到下一个检查点。
+        参数、返回值同 _generate_single_image。
+        """
+        index = page["index"]
+        deadline = deadline or task.deadline
+        provider = provider or self.pool.primary
+
+        try:
+            deadline.check(f"图片 [{index}] 生成")
+            logger.debug(f"生成图片 [{index}] (async): type={page['type']}, provider={provider.name}")
+
+            image_data = await deadline.guard(
+                self._ainvoke_generator(
+                    provider, self._build_prompt(task, page), task.reference_bundle(use_reference), deadline,
+                    self._route_options(page, provider)
+                ),
+                f"图片 [{index}] 生成"
+            )
+
+            deadline.check_cancelled(f"图片 [{index}] 生成")
+
+            # 写文件和生成缩略图在线程中执行，不阻塞事件循环
+            filename = f"{index}.png"
+            await asyncio.to_thread(self._save_image, task, image_data, filename)
+            logger.info(f"✅ 图片 [{index}] 生成成功: {filename} (服务商: {provider.name})")
+
+            return filename
+
+        except Exception as e:
+            self._log_page_failure(index, provider, deadline, e)
+            raise
 
     def generate_images(
         self,
@@ -213,7 +533,10 @@ class ImageService:
         task_id: str = None,
         full_outline: str = "",
         user_images: Optional[List[bytes]] = None,
-        user_topic: str = ""
+        user_topic: str = "",
+        deadline: Optional[Deadline] = None,
+        resume: bool = False,
+        client_id: str = ""
     ) -> Generator[Dict[str, Any], None, None]:
         """
         生成图片（生成器，支持 SSE 流式返回）
@@ -225,6 +548,9 @@ class ImageService:
             full_outline: 完整的大纲文本（用于保持风格一致）
             user_images: 用户上传的参考图片列表（可选）
             user_topic: 用户原始输入（用于保持意图一致）
+            deadline: 任务截止时间（可选，超过后未完成的页面以 deadline exceeded 失败）
+            resume: 是否继续之前中断的任务（根据任务日志还原，只生成尚未成功的页面）
+            client_id: 客户端标识（多个用户同时生成时按客户端公平分配服务商并发）
 
         Yields:
             进度事件字典
@@ -232,33 +558,62 @@ class ImageService:
         if task_id is None:
             task_id = f"task_{uuid.uuid4().hex[:8]}"
 
-        logger.info(f"开始图片生成任务: task_id={task_id}, pages={len(pages)}")
+        task = self._restore_task(task_id) if resume else None
+        if task is not None and task.pages:
+            # 继续中断的任务：已成功的页面直接作为完成事件返回
+            task.deadline = deadline or Deadline.none()
+            task.client_id = client_id or task.client_id
+            task.finished = False
+            pages = task.pages
+            logger.info(f"继续图片生成任务: task_id={task_id}, 剩余 {len(task.missing_pages())}/{task.total} 页")
+        else:
+            if not pages:
+                raise ValueError(f"任务 {task_id} 没有可恢复的任务日志，也没有提供页面列表")
+
+            logger.info(f"开始图片生成任务: task_id={task_id}, pages={len(pages)}")
+
+            # 压缩用户上传的参考图到200KB以内（减少内存和传输开销）
+            compressed_user_images = None
+            if user_images:
+                compressed_user_images = [compress_image(img, max_size_kb=200) for img in user_images]
+
+            # 创建任务上下文（任务专属目录、参考图和进度都保存在上下文中）
+            task = self._create_task(
+                task_id,
+                pages=pages,
+                full_outline=full_outline,
+                user_images=compressed_user_images,
+                user_topic=user_topic,
+                deadline=deadline
+            )
+            task.client_id = client_id
+            logger.debug(f"任务目录: {task.task_dir}")
 
-        # 创建任务专属目录
-        self.current_task_dir = os.path.join(self.history_root_dir, task_id)
-        os.makedirs(self.current_task_dir, exist_ok=True)
-        logger.debug(f"任务目录: {self.current_task_dir}")
+            self.task_store.put(task)
 
-        total = len(pages)
+        # 生成过程中任务不会被移出内存（图片数据仍可溢出到磁盘）
+        self.task_store.pin(task_id)
+        try:
+            yield from self._generate_task_images(task)
+        finally:
+            self.task_store.unpin(task_id)
+
+    def _generate_task_images(self, task: GenerationTask) -> Generator[Dict[str, Any], None, None]:
+        """
+        执行任务的图片生成：先生成封面，然后并发生成其他页面（已成功的页面直接返回完成事件）
+
+        Args:
+            task: 任务上下文
+
+        Yields:
+            进度事件字典
+        """
+        task_id = task.task_id
+        pages = task.pages
+        total = task.total
         generated_images = []
         failed_pages = []
-        cover_image_data = None
-
-        # 压缩用户上传的参考图到200KB以内（减少内存和传输开销）
-        compressed_user_images = None
-        if user_images:
-            compressed_user_images = [compress_image(img, max_size_kb=200) for img in user_images]
-
-        # 初始化任务状态
-        self._task_states[task_id] = {
-            "pages": pages,
-            "generated": {},
-            "failed": {},
-            "cover_image": None,
-            "full_outline": full_outline,
-            "user_images": compressed_user_images,
-            "user_topic": user_topic
-        }
+        already_generated = dict(task.generated)
 
         # ==================== 第一阶段：生成封面 ====================
         cover_page = None
@@ -275,7 +630,21 @@ class ImageService:
             cover_page = pages[0]
             other_pages = pages[1:]
 
-        if cover_page:
+        if cover_page and cover_page["index"] in already_generated:
+            # 继续任务时封面已生成：从磁盘加载作为后续页面的参考
+            filename = already_generated[cover_page["index"]]
+            generated_images.append(filename)
+            self._load_cover_from_disk(task)
+            yield {
+                "event": "complete",
+                "data": {
+                    "index": cover_page["index"],
+                    "status": "done",
+                    "image_url": task.image_url(filename),
+                    "phase": "cover"
+                }
+            }
+        elif cover_page:
             # 发送封面生成进度
             yield {
                 "event": "progress",
@@ -289,37 +658,37 @@ class ImageService:
                 }
             }
 
-            # 生成封面（使用用户上传的图片作为参考）
-            index, success, filename, error = self._generate_single_image(
-                cover_page, task_id, reference_image=None, full_outline=full_outline,
-                user_images=compressed_user_images, user_topic=user_topic
+            # 生成封面（此时任务还没有封面图，仅使用用户上传的图片作为参考）
+            index, success, filename, error = self._wait_page(
+                self._submit_page(task, cover_page, use_reference=False, priority=PRIORITY_COVER),
+                cover_page,
+                task.deadline
             )
 
             if success:
                 generated_images.append(filename)
-                self._task_states[task_id]["generated"][index] = filename
+                task.mark_generated(index, filename)
 
                 # 读取封面图片作为参考，并立即压缩到200KB以内
-                cover_path = os.path.join(self.current_task_dir, filename)
+                cover_path = os.path.join(task.task_dir, filename)
                 with open(cover_path, "rb") as f:
                     cover_image_data = f.read()
 
                 # 压缩封面图（减少内存占用和后续传输开销）
-                cover_image_data = compress_image(cover_image_data, max_size_kb=200)
-                self._task_states[task_id]["cover_image"] = cover_image_data
+                task.cover_image = compress_image(cover_image_data, max_size_kb=200)
 
                 yield {
                     "event": "complete",
                     "data": {
                         "index": index,
                         "status": "done",
-                        "image_url": f"/api/images/{task_id}/{filename}",
+                        "image_url": task.image_url(filename),
                         "phase": "cover"
                     }
                 }
             else:
                 failed_pages.append(cover_page)
-                self._task_states[task_id]["failed"][index] = error
+                task.mark_failed(index, error)
 
                 yield {
                     "event": "error",
@@ -328,173 +697,92 @@ class ImageService:
                         "status": "error",
                         "message": error,
                         "retryable": True,
+                        "deadline_exceeded": is_deadline_exceeded(error),
                         "phase": "cover"
                     }
                 }
 
         # ==================== 第二阶段：生成其他页面 ====================
-        if other_pages:
-            # 检查是否启用高并发模式
-            high_concurrency = self.provider_config.get('high_concurrency', False)
-
-            if high_concurrency:
-                # 高并发模式：并行生成
-                yield {
-                    "event": "progress",
-                    "data": {
-                        "status": "batch_start",
-                        "message": f"开始并发生成 {len(other_pages)} 页内容...",
-                        "current": len(generated_images),
-                        "total": total,
-                        "phase": "content"
-                    }
+        for page in [p for p in other_pages if p["index"] in already_generated]:
+            filename = already_generated[page["index"]]
+            generated_images.append(filename)
+            yield {
+                "event": "complete",
+                "data": {
+                    "index": page["index"],
+                    "status": "done",
+                    "image_url": task.image_url(filename),
+                    "phase": "content"
                 }
+            }
+        other_pages = [p for p in other_pages if p["index"] not in already_generated]
 
-                # 使用线程池并发生成
-                with ThreadPoolExecutor(max_workers=self.MAX_CONCURRENT) as executor:
-                    # 提交所有任务
-                    future_to_page = {
-                        executor.submit(
-                            self._generate_single_image,
-                            page,
-                            task_id,
-                            cover_image_data,  # 使用封面作为参考
-                            0,  # retry_count
-                            full_outline,  # 传入完整大纲
-                            compressed_user_images,  # 用户上传的参考图片（已压缩）
-                            user_topic  # 用户原始输入
-                        ): page
-                        for page in other_pages
-                    }
+        if other_pages:
+            # 所有页面提交到共享执行器，由服务商当前的并发上限控制实际并行度
+            mode = "并发" if self.pool.size > 1 or self.pool.primary.limiter.limit > 1 else "顺序"
+            yield {
+                "event": "progress",
+                "data": {
+                    "status": "batch_start",
+                    "message": f"开始{mode}生成 {len(other_pages)} 页内容...",
+                    "current": len(generated_images),
+                    "total": total,
+                    "phase": "content"
+                }
+            }
 
-                    # 发送每个页面的进度
-                    for page in other_pages:
-                        yield {
-                            "event": "progress",
-                            "data": {
-                                "index": page["index"],
-                                "status": "generating",
-                                "current": len(generated_images) + 1,
-                                "total": total,
-                                "phase": "content"
-                            }
-                        }
+            # 提交所有任务（使用封面作为参考）
+            future_to_page = {
+                self._submit_page(task, page, priority=PRIORITY_CONTENT): page
+                for page in other_pages
+            }
 
-                    # 收集结果
-                    for future in as_completed(future_to_page):
-                        page = future_to_page[future]
-                        try:
-                            index, success, filename, error = future.result()
-
-                            if success:
-                                generated_images.append(filename)
-                                self._task_states[task_id]["generated"][index] = filename
-
-                                yield {
-                                    "event": "complete",
-                                    "data": {
-                                        "index": index,
-                                        "status": "done",
-                                        "image_url": f"/api/images/{task_id}/{filename}",
-                                        "phase": "content"
-                                    }
-                                }
-                            else:
-                                failed_pages.append(page)
-                                self._task_states[task_id]["failed"][index] = error
-
-                                yield {
-                                    "event": "error",
-                                    "data": {
-                                        "index": index,
-                                        "status": "error",
-                                        "message": error,
-                                        "retryable": True,
-                                        "phase": "content"
-                                    }
-                                }
-
-                        except Exception as e:
-                            failed_pages.append(page)
-                            error_msg = str(e)
-                            self._task_states[task_id]["failed"][page["index"]] = error_msg
-
-                            yield {
-                                "event": "error",
-                                "data": {
-                                    "index": page["index"],
-                                    "status": "error",
-                                    "message": error_msg,
-                                    "retryable": True,
-                                    "phase": "content"
-                                }
-                            }
-            else:
-                # 顺序模式：逐个生成
+            # 发送每个页面的进度
+            for page in other_pages:
                 yield {
                     "event": "progress",
                     "data": {
-                        "status": "batch_start",
-                        "message": f"开始顺序生成 {len(other_pages)} 页内容...",
-                        "current": len(generated_images),
+                        "index": page["index"],
+                        "status": "generating",
+                        "current": len(generated_images) + 1,
                         "total": total,
                         "phase": "content"
                     }
                 }
 
-                for page in other_pages:
-                    # 发送生成进度
+            # 收集结果（超过截止时间后不再等待未完成的页面）
+            for page, (index, success, filename, error) in self._iter_page_results(future_to_page, task.deadline):
+                if success:
+                    generated_images.append(filename)
+                    task.mark_generated(index, filename)
+
                     yield {
-                        "event": "progress",
+                        "event": "complete",
                         "data": {
-                            "index": page["index"],
-                            "status": "generating",
-                            "current": len(generated_images) + 1,
-                            "total": total,
+                            "index": index,
+                            "status": "done",
+                            "image_url": task.image_url(filename),
                             "phase": "content"
                         }
                     }
+                else:
+                    failed_pages.append(page)
+                    task.mark_failed(index, error)
 
-                    # 生成单张图片
-                    index, success, filename, error = self._generate_single_image(
-                        page,
-                        task_id,
-                        cover_image_data,
-                        0,
-                        full_outline,
-                        compressed_user_images,
-                        user_topic
-                    )
-
-                    if success:
-                        generated_images.append(filename)
-                        self._task_states[task_id]["generated"][index] = filename
-
-                        yield {
-                            "event": "complete",
-                            "data": {
-                                "index": index,
-                                "status": "done",
-                                "image_url": f"/api/images/{task_id}/{filename}",
-                                "phase": "content"
-                            }
-                        }
-                    else:
-                        failed_pages.append(page)
-                        self._task_states[task_id]["failed"][index] = error
-
-                        yield {
-                            "event": "error",
-                            "data": {
-                                "index": index,
-                                "status": "error",
-                                "message": error,
-                                "retryable": True,
-                                "phase": "content"
-                            }
+                    yield {
+                        "event": "error",
+                        "data": {
+                            "index": index,
+                            "status": "error",
+                            "message": error,
+                            "retryable": True,
+                            "deadline_exceeded": is_deadline_exceeded(error),
+                            "phase": "content"
                         }
+                    }
 
         # ==================== 完成 ====================
+        task.mark_finished()
         yield {
             "event": "finish",
             "data": {
@@ -504,17 +792,65 @@ class ImageService:
                 "total": total,
                 "completed": len(generated_images),
                 "failed": len(failed_pages),
-                "failed_indices": [p["index"] for p in failed_pages]
+                "failed_indices": [p["index"] for p in failed_pages],
+                "deadline_exceeded": any(
+                    is_deadline_exceeded(task.failed.get(p["index"])) for p in failed_pages
+                ),
+                "cancelled": task.deadline.cancelled
             }
         }
 
+    def _get_or_create_task(
+        self,
+        task_id: str,
+        full_outline: str = "",
+        user_topic: str = ""
+    ) -> GenerationTask:
+        """
+        获取已有任务上下文（内存中没有时根据任务日志还原）；都不存在时根据传入的上下文新建
+
+        Args:
+            task_id: 任务ID
+            full_outline: 完整大纲文本（从前端传入，优先使用）
+            user_topic: 用户原始输入（从前端传入，优先使用）
+
+        Returns:
+            任务上下文
+        """
+        task = self._restore_task(task_id)
+
+        if task is None:
+            task = self._create_task(task_id, full_outline=full_outline, user_topic=user_topic)
+        else:
+            task.ensure_dir()
+            # 前端传入的上下文优先
+            if full_outline:
+                task.full_outline = full_outline
+            if user_topic:
+                task.user_topic = user_topic
+
+        return task
+
+    def _load_cover_from_disk(self, task: GenerationTask):
+        """任务上下文中没有封面图时，尝试从文件系统加载并压缩到 200KB"""
+        if task.cover_image is not None:
+            return
+
+        cover_path = os.path.join(task.task_dir, "0.png")
+        if os.path.exists(cover_path):
+            with open(cover_path, "rb") as f:
+                cover_data = f.read()
+            task.cover_image = compress_image(cover_data, max_size_kb=200)
+
     def retry_single_image(
         self,
         task_id: str,
         page: Dict,
         use_reference: bool = True,
         full_outline: str = "",
-        user_topic: str = ""
+        user_topic: str = "",
+        deadline: Optional[Deadline] = None,
+        client_id: str = ""
     ) -> Dict[str, Any]:
         """
         重试生成单张图片
@@ -525,70 +861,51 @@ class ImageService:
             use_reference: 是否使用封面作为参考
             full_outline: 完整大纲文本（从前端传入）
             user_topic: 用户原始输入（从前端传入）
+            deadline: 本次请求的截止时间（可选）
+            client_id: 客户端标识（可选）
 
         Returns:
             生成结果
         """
-        self.current_task_dir = os.path.join(self.history_root_dir, task_id)
-        os.makedirs(self.current_task_dir, exist_ok=True)
-
-        reference_image = None
-        user_images = None
-
-        # 首先尝试从任务状态中获取上下文
-        if task_id in self._task_states:
-            task_state = self._task_states[task_id]
-            if use_reference:
-                reference_image = task_state.get("cover_image")
-            # 如果没有传入上下文，则使用任务状态中的
-            if not full_outline:
-                full_outline = task_state.get("full_outline", "")
-            if not user_topic:
-                user_topic = task_state.get("user_topic", "")
-            user_images = task_state.get("user_images")
-
-        # 如果任务状态中没有封面图，尝试从文件系统加载
-        if use_reference and reference_image is None:
-            cover_path = os.path.join(self.current_task_dir, "0.png")
-            if os.path.exists(cover_path):
-                with open(cover_path, "rb") as f:
-                    cover_data = f.read()
-                # 压缩封面图到 200KB
-                reference_image = compress_image(cover_data, max_size_kb=200)
-
-        index, success, filename, error = self._generate_single_image(
+        task = self._get_or_create_task(task_id, full_outline, user_topic)
+
+        if use_reference:
+            self._load_cover_from_disk(task)
+
+        deadline = deadline or Deadline.none()
+        index, success, filename, error = self._wait_page(
+            # 用户在等待单页结果：排在批量生成的页面前面
+            self._submit_page(
+                task, page, use_reference=use_reference, deadline=deadline,
+                priority=PRIORITY_INTERACTIVE, tenant=client_id or None
+            ),
             page,
-            task_id,
-            reference_image,
-            0,
-            full_outline,
-            user_images,
-            user_topic
+            deadline
         )
 
         if success:
-            if task_id in self._task_states:
-                self._task_states[task_id]["generated"][index] = filename
-                if index in self._task_states[task_id]["failed"]:
-                    del self._task_states[task_id]["failed"][index]
+            task.mark_generated(index, filename)
 
             return {
                 "success": True,
                 "index": index,
-                "image_url": f"/api/images/{task_id}/{filename}"
+                "image_url": task.image_url(filename)
             }
         else:
             return {
                 "success": False,
                 "index": index,
                 "error": error,
-                "retryable": True
+                "retryable": True,
+                "deadline_exceeded": is_deadline_exceeded(error)
             }
 
     def retry_failed_images(
         self,
         task_id: str,
-        pages: List[Dict]
+        pages: List[Dict],
+        deadline: Optional[Deadline] = None,
+        client_id: str = ""
     ) -> Generator[Dict[str, Any], None, None]:
         """
         批量重试失败的图片
@@ -596,15 +913,41 @@ class ImageService:
         Args:
             task_id: 任务ID
             pages: 需要重试的页面列表
+            deadline: 本次请求的截止时间（可选）
+            client_id: 客户端标识（可选）
 
         Yields:
             进度事件
         """
-        # 获取参考图
-        reference_image = None
-        if task_id in self._task_states:
-            reference_image = self._task_states[task_id].get("cover_image")
+        # 获取任务上下文（包含参考图和完整大纲）
+        task = self._get_or_create_task(task_id)
+        self._load_cover_from_disk(task)
+        if client_id:
+            task.client_id = client_id
+
+        self.task_store.pin(task_id)
+        try:
+            yield from self._retry_task_images(task, pages, deadline)
+        finally:
+            self.task_store.unpin(task_id)
+
+    def _retry_task_images(
+        self,
+        task: GenerationTask,
+        pages: List[Dict],
+        deadline: Optional[Deadline] = None
+    ) -> Generator[Dict[str, Any], None, None]:
+        """
+        并发重试任务中的指定页面
 
+        Args:
+            task: 任务上下文
+            pages: 需要重试的页面列表
+            deadline: 本次请求的截止时间（可选）
+
+        Yields:
+            进度事件
+        """
         total = len(pages)
         success_count = 0
         failed_count = 0
@@ -617,68 +960,39 @@ class ImageService:
             }
         }
 
-        # 并发重试
-        # 从任务状态中获取完整大纲
-        full_outline = ""
-        if task_id in self._task_states:
-            full_outline = self._task_states[task_id].get("full_outline", "")
-
-        with ThreadPoolExecutor(max_workers=self.MAX_CONCURRENT) as executor:
-            future_to_page = {
-                executor.submit(
-                    self._generate_single_image,
-                    page,
-                    task_id,
-                    reference_image,
-                    0,  # retry_count
-                    full_outline  # 传入完整大纲
-                ): page
-                for page in pages
-            }
+        # 并发重试（提交到共享执行器）
+        deadline = deadline or Deadline.none()
+        future_to_page = {
+            self._submit_page(task, page, deadline=deadline, priority=PRIORITY_RETRY): page
+            for page in pages
+        }
 
-            for future in as_completed(future_to_page):
-                page = future_to_page[future]
-                try:
-                    index, success, filename, error = future.result()
-
-                    if success:
-                        success_count += 1
-                        if task_id in self._task_states:
-                            self._task_states[task_id]["generated"][index] = filename
-                            if index in self._task_states[task_id]["failed"]:
-                                del self._task_states[task_id]["failed"][index]
-
-                        yield {
-                            "event": "complete",
-                            "data": {
-                                "index": index,
-                                "status": "done",
-                                "image_url": f"/api/images/{task_id}/{filename}"
-                            }
-                        }
-                    else:
-                        failed_count += 1
-                        yield {
-                            "event": "error",
-                            "data": {
-                                "index": index,
-                                "status": "error",
-                                "message": error,
-                                "retryable": True
-                            }
-                        }
+        for page, (index, success, filename, error) in self._iter_page_results(future_to_page, deadline):
+            if success:
+                success_count += 1
+                task.mark_generated(index, filename)
 
-                except Exception as e:
-                    failed_count += 1
-                    yield {
-                        "event": "error",
-                        "data": {
-                            "index": page["index"],
-                            "status": "error",
-                            "message": str(e),
-                            "retryable": True
-                        }
+                yield {
+                    "event": "complete",
+                    "data": {
+                        "index": index,
+                        "status": "done",
+                        "image_url": task.image_url(filename)
                     }
+                }
+            else:
+                failed_count += 1
+                task.mark_failed(index, error)
+                yield {
+                    "event": "error",
+                    "data": {
+                        "index": index,
+                        "status": "error",
+                        "message": error,
+                        "retryable": True,
+                        "deadline_exceeded": is_deadline_exceeded(error)
+                    }
+                }
 
         yield {
             "event": "retry_finish",
@@ -686,7 +1000,8 @@ class ImageService:
                 "success": failed_count == 0,
                 "total": total,
                 "completed": success_count,
-                "failed": failed_count
+                "failed": failed_count,
+                "cancelled": deadline.cancelled
             }
         }
 
@@ -696,7 +1011,9 @@ class ImageService:
         page: Dict,
         use_reference: bool = True,
         full_outline: str = "",
-        user_topic: str = ""
+        user_topic: str = "",
+        deadline: Optional[Deadline] = None,
+        client_id: str = ""
     ) -> Dict[str, Any]:
         """
         重新生成图片（用户手动触发，即使成功的也可以重新生成）
@@ -707,6 +1024,8 @@ class ImageService:
             use_reference: 是否使用封面作为参考
             full_outline: 完整大纲文本
             user_topic: 用户原始输入
+            deadline: 本次请求的截止时间（可选）
+            client_id: 客户端标识（可选）
 
         Returns:
             生成结果
@@ -714,7 +1033,9 @@ class ImageService:
         return self.retry_single_image(
             task_id, page, use_reference,
             full_outline=full_outline,
-            user_topic=user_topic
+            user_topic=user_topic,
+            deadline=deadline,
+            client_id=client_id
         )
 
     def get_image_path(self, task_id: str, filename: str) -> str:
@@ -728,17 +1049,18 @@ class ImageService:
         Returns:
             完整路径
         """
-        task_dir = os.path.join(self.history_root_dir, task_id)
-        return os.path.join(task_dir, filename)
+        return os.path.join(self._get_task_dir(task_id), filename)
 
-    def get_task_state(self, task_id: str) -> Optional[Dict]:
-        """获取任务状态"""
-        return self._task_states.get(task_id)
+    def get_task_state(self, task_id: str) -> Optional[GenerationTask]:
+        """获取任务上下文（内存中没有时根据任务日志还原）"""
+        task = self._restore_task(task_id)
+        if task is not None and task.cover_image is None:
+            self._load_cover_from_disk(task)
+        return task
 
     def cleanup_task(self, task_id: str):
         """清理任务状态（释放内存）"""
-        if task_id in self._task_states:
-            del self._task_states[task_id]
+        self.task_store.pop(task_id)
 
 
 # 全局服务实例
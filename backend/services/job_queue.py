@@ -0,0 +1,1070 @@
+"""持久化的后台任务队列（图片生成与 SSE 请求解耦）"""
+import base64
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from typing import Any, Callable, Dict, Generator, List, Optional, Tuple
+
+from backend.config import Config
+from backend.services.task import GenerationTask
+from backend.services.task_journal import INTERRUPTED_ERROR, find_unfinished_tasks
+from backend.utils.deadline import Deadline
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+TERMINAL_STATUSES = {JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED}
+
+# 工作进程检查取消请求的间隔（秒）
+CANCEL_POLL_SECONDS = 1.0
+
+# 估算任务平均执行耗时时取最近多少个成功完成的任务
+JOB_DURATION_SAMPLES = 20
+
+# 各类任务的结束事件（任务异常中止时补发，保证订阅者总能收到结束事件）
+TERMINAL_EVENTS = {
+    "generate": "finish",
+    "retry_failed": "retry_finish",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    task_id TEXT,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    lease_expires_at REAL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    subscribers INTEGER NOT NULL DEFAULT 0,
+    detached_at REAL,
+    idempotency_key TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+"""
+
+# 旧版本数据库缺少的列
+_MIGRATIONS = {
+    "cancel_requested": "ALTER TABLE jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0",
+    "subscribers": "ALTER TABLE jobs ADD COLUMN subscribers INTEGER NOT NULL DEFAULT 0",
+    "detached_at": "ALTER TABLE jobs ADD COLUMN detached_at REAL",
+    "idempotency_key": "ALTER TABLE jobs ADD COLUMN idempotency_key TEXT",
+}
+
+
+class JobQueue:
+    """
+    基于 SQLite 的持久化任务队列
+
+    /api/generate 和 /api/retry-failed 只负责把任务写入队列，由工作线程（同一进程内，
+    或通过 `python -m backend.worker` 启动的独立进程）领取执行；任务产生的每个进度事件
+    都按顺序写入 job_events 表，SSE 接口只是这些事件的订阅者。浏览器关闭或代理断开
+    连接不会影响任务继续执行，任何进程都可以查询任务状态和事件。
+
+    工作线程领取任务时获得一个租约并定期续约；进程崩溃导致租约过期的任务会被
+    重新领取（最多 max_attempts 次）。
+
+    每个事件带有任务内递增的序号（即 SSE 的 id），客户端断线后可以带上
+    Last-Event-ID 重新订阅，从断点继续接收事件；每个任务只保留最近
+    max_events_per_job 个事件作为重放缓冲。
+
+    取消任务时，排队中的任务直接结束；执行中的任务记录取消请求，由执行它的
+    工作进程在下一次检查时取消任务的截止时间（即取消令牌）。SSE 订阅者全部断开
+    且超过宽限时间没有重新订阅的任务视为已被放弃，同样取消。
+
+    队列只在共享同一个数据库文件的进程之间可见（单节点）。TASK_STATE_BACKEND=redis
+    只共享任务状态，不共享队列和事件：多节点部署时，任务的提交、事件订阅和取消请求
+    需要路由到同一个节点。
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        lease_seconds: float = 60.0,
+        max_attempts: int = 2,
+        poll_interval: float = 0.5,
+        max_events_per_job: int = 500
+    ):
+        """
+        初始化任务队列
+
+        Args:
+            db_path: SQLite 数据库文件路径
+            lease_seconds: 工作线程领取任务的租约时长（秒），超过未续约视为工作进程已退出
+            max_attempts: 单个任务最多执行次数（含租约过期后的重新执行）
+            poll_interval: 订阅者轮询新事件的间隔（秒，跨进程时生效）
+            max_events_per_job: 每个任务保留的事件数（重放缓冲大小）
+        """
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.max_events_per_job = max(1, max_events_per_job)
+        self._local = threading.local()
+        # 同一进程内写入事件时唤醒订阅者，跨进程则依靠轮询
+        self._changed = threading.Condition()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for column, statement in _MIGRATIONS.items():
+            if column not in columns:
+                conn.execute(statement)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_idempotency ON jobs (idempotency_key)")
+        logger.info(f"任务队列已就绪: {db_path}")
+
+    def _conn(self) -> sqlite3.Connection:
+        """当前线程的数据库连接（sqlite3 连接不能跨线程共享）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], task_id: Optional[str] = None) -> str:
+        """
+        新建任务
+
+        Args:
+            kind: 任务类型（generate / retry_failed）
+            payload: 任务参数（需可 JSON 序列化）
+            task_id: 关联的图片任务 ID
+
+        Returns:
+            任务 ID
+        """
+        job_id = self._insert(self._conn(), kind, payload, task_id)
+        logger.info(f"📮 任务入队: job={job_id}, kind={kind}, task={task_id}")
+        self._notify()
+        return job_id
+
+    @staticmethod
+    def _insert(
+        conn: sqlite3.Connection,
+        kind: str,
+        payload: Dict[str, Any],
+        task_id: Optional[str],
+        idempotency_key: Optional[str] = None
+    ) -> str:
+        job_id = f"job_{uuid.uuid4().hex[:12]}"
+        conn.execute(
+            "INSERT INTO jobs (id, kind, task_id, status, payload, created_at, idempotency_key) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, task_id, JOB_QUEUED, json.dumps(payload, ensure_ascii=False), time.time(), idempotency_key)
+        )
+        return job_id
+
+    def enqueue_idempotent(
+        self,
+        kind: str,
+        payload: Dict[str, Any],
+        idempotency_key: str,
+        task_id: Optional[str] = None,
+        reuse_finished: bool = False
+    ) -> Tuple[str, bool]:
+        """
+        按幂等键新建任务：同一个键已有排队中或执行中的任务时直接返回该任务，不再重复生成
+
+        查找和写入在同一个写事务中完成，多个进程同时提交同一个键时也只会创建一个任务。
+
+        Args:
+            kind: 任务类型（generate / retry_failed）
+            payload: 任务参数（需可 JSON 序列化）
+            idempotency_key: 幂等键（不同类型的任务互不影响）
+            task_id: 关联的图片任务 ID
+            reuse_finished: 是否同样复用已成功结束的任务（客户端显式传入 Idempotency-Key 时）；
+                已失败或已取消的任务不复用，重复提交会重新执行
+
+        Returns:
+            (任务 ID, 是否新建)
+        """
+        key = f"{kind}:{idempotency_key}"
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            existing = self._find_idempotent(conn, key, reuse_finished)
+            if existing is not None:
+                conn.execute("COMMIT")
+                logger.info(f"🔁 重复提交，复用已有任务: job={existing}, kind={kind}, task={task_id}")
+                return existing, False
+            job_id = self._insert(conn, kind, payload, task_id, key)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        logger.info(f"📮 任务入队: job={job_id}, kind={kind}, task={task_id}")
+        self._notify()
+        return job_id, True
+
+    def enqueue_if_idle(self, kind: str, payload: Dict[str, Any], task_id: str) -> Optional[str]:
+        """
+        图片任务没有排队中或执行中的后台任务时新建任务
+
+        检查和写入在同一个写事务中完成，多个进程同时恢复同一个任务时也只会创建一个任务。
+
+        Args:
+            kind: 任务类型（generate / retry_failed）
+            payload: 任务参数（需可 JSON 序列化）
+            task_id: 关联的图片任务 ID
+
+        Returns:
+            新建的任务 ID；已有进行中的任务时返回 None
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self._has_active_job(conn, task_id):
+                conn.execute("COMMIT")
+                return None
+            job_id = self._insert(conn, kind, payload, task_id)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        logger.info(f"📮 任务入队: job={job_id}, kind={kind}, task={task_id}")
+        self._notify()
+        return job_id
+
+    def find_idempotent(self, kind: str, idempotency_key: str, reuse_finished: bool = False) -> Optional[str]:
+        """
+        查找幂等键对应的可复用任务（参数同 enqueue_idempotent）
+
+        Returns:
+            任务 ID；没有可复用的任务时返回 None
+        """
+        return self._find_idempotent(self._conn(), f"{kind}:{idempotency_key}", reuse_finished)
+
+    @staticmethod
+    def _find_idempotent(conn: sqlite3.Connection, key: str, reuse_finished: bool) -> Optional[str]:
+        statuses = (JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED) if reuse_finished else (JOB_QUEUED, JOB_RUNNING)
+        row = conn.execute(
+            f"SELECT id FROM jobs WHERE idempotency_key = ? AND status IN ({', '.join('?' * len(statuses))}) "
+            "ORDER BY created_at DESC LIMIT 1",
+            (key, *statuses)
+        ).fetchone()
+        return row["id"] if row else None
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """
+        领取一个待执行的任务（包括租约已过期的执行中任务）
+
+        Args:
+            worker_id: 工作线程标识
+
+        Returns:
+            任务字典；没有可领取的任务时返回 None
+        """
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? OR (status = ? AND lease_expires_at < ?) "
+                "ORDER BY created_at LIMIT 1",
+                (JOB_QUEUED, JOB_RUNNING, now)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+
+            if row["status"] == JOB_RUNNING:
+                if row["cancel_requested"]:
+                    conn.execute("COMMIT")
+                    self._finish_with_event(row["id"], JOB_CANCELLED, row["error"] or "任务已取消", row["kind"])
+                    return self.claim(worker_id)
+                logger.warning(f"任务 [{row['id']}] 的工作进程 [{row['worker']}] 租约已过期，重新执行")
+                if row["attempts"] >= self.max_attempts:
+                    conn.execute("COMMIT")
+                    self.fail(row["id"], f"任务执行 {row['attempts']} 次均未完成（工作进程异常退出）", kind=row["kind"])
+                    return self.claim(worker_id)
+
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, "
+                "started_at = COALESCE(started_at, ?), lease_expires_at = ? WHERE id = ?",
+                (JOB_RUNNING, worker_id, now, now + self.lease_seconds, row["id"])
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        job = self._row_to_job(row)
+        job["status"] = JOB_RUNNING
+        job["worker"] = worker_id
+        job["attempts"] += 1
+        return job
+
+    def renew(self, job_ids: List[str], worker_id: str):
+        """为工作线程持有的任务续约"""
+        if not job_ids:
+            return
+        expires_at = time.time() + self.lease_seconds
+        self._conn().executemany(
+            "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND worker = ? AND status = ?",
+            [(expires_at, job_id, worker_id, JOB_RUNNING) for job_id in job_ids]
+        )
+
+    def append_event(self, job_id: str, event: str, data: Dict[str, Any]) -> int:
+        """
+        追加一个任务事件
+
+        Args:
+            job_id: 任务 ID
+            event: 事件类型（与 SSE 的 event 字段一致）
+            data: 事件数据
+
+        Returns:
+            事件序号（从 1 开始递增）
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            seq = self._append_event_locked(conn, job_id, event, data)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._notify()
+        return seq
+
+    def _append_event_locked(self, conn: sqlite3.Connection, job_id: str, event: str, data: Dict[str, Any]) -> int:
+        """在调用方已开启的事务中追加事件，返回事件序号"""
+        seq = conn.execute(
+            "SELECT COALESCE(MAX(seq), 0) + 1 FROM job_events WHERE job_id = ?", (job_id,)
+        ).fetchone()[0]
+        conn.execute(
+            "INSERT INTO job_events (job_id, seq, event, data, created_at) VALUES (?, ?, ?, ?, ?)",
+            (job_id, seq, event, json.dumps(data, ensure_ascii=False), time.time())
+        )
+        if seq > self.max_events_per_job:
+            # 超出重放缓冲的旧事件不再保留
+            conn.execute(
+                "DELETE FROM job_events WHERE job_id = ? AND seq <= ?",
+                (job_id, seq - self.max_events_per_job)
+            )
+        return seq
+
+    def complete(self, job_id: str):
+        """标记任务执行完成（执行期间收到取消请求的任务标记为已取消；已结束的任务状态不变）"""
+        self._conn().execute(
+            "UPDATE jobs SET status = CASE WHEN cancel_requested THEN ? ELSE ? END, "
+            "finished_at = ?, lease_expires_at = NULL WHERE id = ? AND status IN (?, ?)",
+            (JOB_CANCELLED, JOB_SUCCEEDED, time.time(), job_id, JOB_QUEUED, JOB_RUNNING)
+        )
+        self._notify()
+
+    def fail(self, job_id: str, error: str, kind: Optional[str] = None):
+        """
+        标记任务失败，并补发一个结束事件
+
+        Args:
+            job_id: 任务 ID
+            error: 错误信息
+            kind: 任务类型（决定结束事件的类型）
+        """
+        self._finish_with_event(job_id, JOB_FAILED, error, kind)
+
+    def _finish_with_event(self, job_id: str, status: str, error: str, kind: Optional[str] = None) -> bool:
+        """
+        结束任务，并补发一个结束事件（任务没有自行产生结束事件时）
+
+        状态更新和结束事件在同一个事务中写入；已结束的任务状态不变，也不再补发事件。
+
+        Returns:
+            任务是否由本次调用结束
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            finished = self._finish_locked(conn, job_id, (JOB_QUEUED, JOB_RUNNING), status, error, kind)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._notify()
+        return finished
+
+    def _finish_locked(
+        self,
+        conn: sqlite3.Connection,
+        job_id: str,
+        from_statuses: tuple,
+        status: str,
+        error: str,
+        kind: Optional[str] = None
+    ) -> bool:
+        """在调用方已开启的事务中结束处于 from_statuses 的任务并追加结束事件，返回是否结束"""
+        placeholders = ",".join("?" * len(from_statuses))
+        updated = conn.execute(
+            f"UPDATE jobs SET status = ?, error = ?, finished_at = ?, lease_expires_at = NULL "
+            f"WHERE id = ? AND status IN ({placeholders})",
+            (status, error, time.time(), job_id, *from_statuses)
+        ).rowcount
+        if updated != 1:
+            return False
+
+        job = conn.execute("SELECT kind, task_id FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        terminal_event = TERMINAL_EVENTS.get(kind or job["kind"] or "", "finish")
+        # 字段与正常结束事件保持一致，前端无需区分
+        self._append_event_locked(conn, job_id, terminal_event, {
+            "success": False,
+            "task_id": job["task_id"],
+            "images": [],
+            "completed": 0,
+            "failed": 0,
+            "error": error,
+            "cancelled": status == JOB_CANCELLED,
+            "job_id": job_id,
+        })
+        return True
+
+    def cancel(self, job_id: str, reason: str = "任务已取消") -> Optional[str]:
+        """
+        取消任务：排队中的任务直接结束，执行中的任务记录取消请求（由工作进程取消执行）
+
+        排队中的任务在同一个事务中结束并写入结束事件，不会在取消的同时被工作线程领取。
+
+        Args:
+            job_id: 任务 ID
+            reason: 取消原因
+
+        Returns:
+            取消后的任务状态；任务不存在时返回 None（已结束的任务状态不变）
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cancelled_queued = self._finish_locked(conn, job_id, (JOB_QUEUED,), JOB_CANCELLED, reason)
+            if cancelled_queued:
+                status = JOB_CANCELLED
+            else:
+                row = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                status = row["status"] if row is not None else None
+                if status == JOB_RUNNING:
+                    conn.execute(
+                        "UPDATE jobs SET cancel_requested = 1, error = ? WHERE id = ? AND cancel_requested = 0",
+                        (reason, job_id)
+                    )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        if cancelled_queued:
+            logger.info(f"🛑 任务已取消（未开始执行）: job={job_id}, 原因: {reason}")
+            self._notify()
+        elif status == JOB_RUNNING:
+            logger.info(f"🛑 任务取消请求已记录: job={job_id}, 原因: {reason}")
+            self._notify()
+        return status
+
+    def cancel_task(self, task_id: str, reason: str = "任务已取消") -> List[str]:
+        """
+        取消图片任务所有排队中和执行中的后台任务
+
+        Returns:
+            被取消的任务 ID 列表
+        """
+        rows = self._conn().execute(
+            "SELECT id FROM jobs WHERE task_id = ? AND status IN (?, ?)",
+            (task_id, JOB_QUEUED, JOB_RUNNING)
+        ).fetchall()
+        return [row["id"] for row in rows if self.cancel(row["id"], reason) is not None]
+
+    def cancel_requests(self, job_ids: List[str]) -> Dict[str, str]:
+        """
+        获取执行中任务的取消请求
+
+        Args:
+            job_ids: 任务 ID 列表
+
+        Returns:
+            {job_id: 取消原因}，只包含已请求取消的任务
+        """
+        if not job_ids:
+            return {}
+        placeholders = ",".join("?" * len(job_ids))
+        rows = self._conn().execute(
+            f"SELECT id, error FROM jobs WHERE cancel_requested = 1 AND id IN ({placeholders})",
+            list(job_ids)
+        ).fetchall()
+        return {row["id"]: row["error"] or "任务已取消" for row in rows}
+
+    def attach(self, job_id: str):
+        """登记一个 SSE 订阅者"""
+        self._conn().execute(
+            "UPDATE jobs SET subscribers = subscribers + 1, detached_at = NULL WHERE id = ?", (job_id,)
+        )
+
+    def detach(self, job_id: str):
+        """SSE 订阅者断开；最后一个订阅者断开时记录时间，用于判断任务是否已被放弃"""
+        self._conn().execute(
+            "UPDATE jobs SET subscribers = MAX(subscribers - 1, 0), "
+            "detached_at = CASE WHEN subscribers <= 1 THEN ? ELSE detached_at END WHERE id = ?",
+            (time.time(), job_id)
+        )
+
+    def cancel_abandoned(self, grace_seconds: float) -> int:
+        """
+        取消已被放弃的任务：所有订阅者都已断开，且超过 grace_seconds 秒没有重新订阅
+
+        从未有过订阅者的任务（如启动时自动恢复的任务）不受影响。
+
+        Returns:
+            取消的任务数
+        """
+        rows = self._conn().execute(
+            "SELECT id FROM jobs WHERE status IN (?, ?) AND cancel_requested = 0 "
+            "AND subscribers <= 0 AND detached_at IS NOT NULL AND detached_at < ?",
+            (JOB_QUEUED, JOB_RUNNING, time.time() - grace_seconds)
+        ).fetchall()
+        for row in rows:
+            self.cancel(row["id"], f"客户端断开连接超过 {grace_seconds:g} 秒")
+        return len(rows)
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """获取任务（不含 payload）"""
+        row = self._conn().execute(
+            "SELECT id, kind, task_id, status, attempts, worker, error, created_at, started_at, finished_at, "
+            "cancel_requested, subscribers FROM jobs WHERE id = ?",
+            (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        job["last_event_id"] = self._conn().execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM job_events WHERE job_id = ?", (job_id,)
+        ).fetchone()[0]
+        return job
+
+    def has_active_job(self, task_id: str) -> bool:
+        """图片任务是否有排队中或执行中的后台任务"""
+        return self._has_active_job(self._conn(), task_id)
+
+    @staticmethod
+    def _has_active_job(conn: sqlite3.Connection, task_id: str) -> bool:
+        row = conn.execute(
+            "SELECT 1 FROM jobs WHERE task_id = ? AND status IN (?, ?) LIMIT 1",
+            (task_id, JOB_QUEUED, JOB_RUNNING)
+        ).fetchone()
+        return row is not None
+
+    def latest_job_for_task(self, task_id: str) -> Optional[str]:
+        """获取图片任务最近一次的后台任务 ID（生成或批量重试）"""
+        row = self._conn().execute(
+            "SELECT id FROM jobs WHERE task_id = ? ORDER BY created_at DESC LIMIT 1", (task_id,)
+        ).fetchone()
+        return row["id"] if row else None
+
+    def get_events(self, job_id: str, after_seq: int = 0) -> List[Dict[str, Any]]:
+        """
+        获取任务事件
+
+        Args:
+            job_id: 任务 ID
+            after_seq: 只返回序号大于该值的事件
+
+        Returns:
+            事件列表：[{"seq", "event", "data"}]
+        """
+        rows = self._conn().execute(
+            "SELECT seq, event, data FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+            (job_id, after_seq)
+        ).fetchall()
+        return [{"seq": row["seq"], "event": row["event"], "data": json.loads(row["data"])} for row in rows]
+
+    def subscribe(
+        self,
+        job_id: str,
+        after_seq: int = 0,
+        heartbeat: Optional[float] = None
+    ) -> Generator[Optional[Dict[str, Any]], None, None]:
+        """
+        订阅任务事件：先重放序号大于 after_seq 的已有事件，再持续产出新事件，任务结束后返回
+
+        订阅者断开（生成器被关闭）不影响任务执行。
+
+        Args:
+            job_id: 任务 ID
+            after_seq: 从该序号之后开始订阅（客户端的 Last-Event-ID）
+            heartbeat: 超过该秒数没有新事件时产出一个 None（用于发送保活注释）
+
+        Yields:
+            事件字典：{"seq", "event", "data"}；保活时为 None
+        """
+        last_seq = after_seq
+        if after_seq > 0:
+            oldest = self._conn().execute(
+                "SELECT MIN(seq) FROM job_events WHERE job_id = ?", (job_id,)
+            ).fetchone()[0]
+            if oldest is not None and oldest > after_seq + 1:
+                logger.warning(
+                    f"任务 [{job_id}] 的事件 {after_seq + 1}-{oldest - 1} 已超出重放缓冲，从 {oldest} 开始重放"
+                )
+
+        last_activity = time.monotonic()
+        while True:
+            events = self.get_events(job_id, last_seq)
+            for event in events:
+                last_seq = event["seq"]
+                yield event
+            if events:
+                last_activity = time.monotonic()
+                continue
+
+            job = self.get_job(job_id)
+            if job is None:
+                return
+            if job["status"] in TERMINAL_STATUSES:
+                # 结束前再读一次，避免漏掉与状态更新同时写入的事件
+                for event in self.get_events(job_id, last_seq):
+                    last_seq = event["seq"]
+                    yield event
+                return
+
+            if heartbeat and time.monotonic() - last_activity >= heartbeat:
+                last_activity = time.monotonic()
+                yield None
+
+            with self._changed:
+                self._changed.wait(self.poll_interval)
+
+    def purge(self, retention_seconds: float) -> int:
+        """
+        删除已结束且超过保留时间的任务及其事件
+
+        Returns:
+            删除的任务数
+        """
+        cutoff = time.time() - retention_seconds
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "DELETE FROM job_events WHERE job_id IN "
+                "(SELECT id FROM jobs WHERE status IN (?, ?, ?) AND finished_at < ?)",
+                (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED, cutoff)
+            )
+            deleted = conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?, ?) AND finished_at < ?",
+                (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED, cutoff)
+            ).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if deleted:
+            logger.info(f"清理 {deleted} 个已结束的任务")
+        return deleted
+
+    def get_load(self) -> Dict[str, int]:
+        """
+        获取队列负载（准入控制使用）
+
+        Returns:
+            queued_jobs: 排队中的任务数；running_jobs: 执行中的任务数；
+            queued_pages: 排队中任务的页面总数（继续中断任务时页面数未知，按 0 计）；
+            avg_job_seconds: 最近成功完成的任务的平均执行耗时（秒，尚无样本时为 None）
+        """
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT "
+            "COALESCE(SUM(CASE WHEN status = ? THEN 1 ELSE 0 END), 0) AS queued_jobs, "
+            "COALESCE(SUM(CASE WHEN status = ? THEN 1 ELSE 0 END), 0) AS running_jobs, "
+            "COALESCE(SUM(CASE WHEN status = ? THEN COALESCE(json_array_length(payload, '$.pages'), 0) "
+            "ELSE 0 END), 0) AS queued_pages "
+            "FROM jobs WHERE status IN (?, ?)",
+            (JOB_QUEUED, JOB_RUNNING, JOB_QUEUED, JOB_QUEUED, JOB_RUNNING)
+        ).fetchone()
+        load = dict(row)
+        load["avg_job_seconds"] = conn.execute(
+            "SELECT AVG(finished_at - started_at) FROM (SELECT started_at, finished_at FROM jobs "
+            "WHERE status = ? AND started_at IS NOT NULL ORDER BY finished_at DESC LIMIT ?)",
+            (JOB_SUCCEEDED, JOB_DURATION_SAMPLES)
+        ).fetchone()[0]
+        return load
+
+    def count_active_jobs(self, client_id: str) -> int:
+        """客户端排队中和执行中的任务数"""
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?) AND json_extract(payload, '$.client_id') = ?",
+            (JOB_QUEUED, JOB_RUNNING, client_id)
+        ).fetchone()[0]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取各状态的任务数"""
+        rows = self._conn().execute("SELECT status, COUNT(*) AS count FROM jobs GROUP BY status").fetchall()
+        counts = {status: 0 for status in (JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED)}
+        counts.update({row["status"]: row["count"] for row in rows})
+        return {"db_path": self.db_path, "jobs": counts}
+
+
+# ==================== 任务执行 ====================
+
+def _history_root() -> str:
+    """history 根目录（与图片服务一致）"""
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "history")
+
+
+def _job_deadline(payload: Dict[str, Any]) -> Deadline:
+    """按入队时记录的截止时刻恢复截止时间（截止时间从收到请求时开始计算）"""
+    if payload.get("resume"):
+        # 继续中断的任务时原请求早已结束，按配置重新计算截止时间
+        return Deadline(Config.GENERATION_DEADLINE_SECONDS)
+    deadline_at = payload.get("deadline_at")
+    if not deadline_at:
+        return Deadline.none()
+    # 已经过期时返回一个极短的截止时间（Deadline 的 0 表示不限制）
+    return Deadline(max(deadline_at - time.time(), 0.001))
+
+
+def _run_generate_job(payload: Dict[str, Any], deadline: Deadline) -> Generator[Dict[str, Any], None, None]:
+    """执行 /api/generate 任务"""
+    from backend.services.image import get_image_service
+
+    user_images = [base64.b64decode(img) for img in payload.get("user_images") or []]
+    return get_image_service().generate_images(
+        payload.get("pages"),
+        payload["task_id"],
+        payload.get("full_outline", ""),
+        user_images=user_images or None,
+        user_topic=payload.get("user_topic", ""),
+        deadline=deadline,
+        resume=bool(payload.get("resume")),
+        client_id=payload.get("client_id", "")
+    )
+
+
+def _run_retry_failed_job(payload: Dict[str, Any], deadline: Deadline) -> Generator[Dict[str, Any], None, None]:
+    """执行 /api/retry-failed 任务"""
+    from backend.services.image import get_image_service
+
+    return get_image_service().retry_failed_images(
+        payload["task_id"],
+        payload["pages"],
+        deadline=deadline,
+        client_id=payload.get("client_id", "")
+    )
+
+
+# 处理函数接收任务参数和截止时间（截止时间同时是任务的取消令牌）
+_JOB_HANDLERS: Dict[str, Callable[[Dict[str, Any], Deadline], Generator[Dict[str, Any], None, None]]] = {
+    "generate": _run_generate_job,
+    "retry_failed": _run_retry_failed_job,
+}
+
+
+class JobWorkerPool:
+    """
+    任务工作线程
+
+    每个工作线程循环领取任务并执行，执行过程中产生的事件写入队列；
+    后台续约线程定期为正在执行的任务续约，并检查取消请求和被放弃的任务。
+
+    任务线程只负责把页面提交给共享执行器并等待结果，服务商调用的并发由执行器
+    控制，因此工作线程数决定的是同时推进的任务数，应与准入控制允许的任务数相当，
+    不能小到让执行器空闲而任务在队列中等待。
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        workers: int = 16,
+        retention_hours: float = 24.0,
+        abandon_seconds: float = 0.0
+    ):
+        """
+        初始化工作线程
+
+        Args:
+            queue: 任务队列
+            workers: 同时执行的任务数
+            retention_hours: 已结束任务的保留时长（小时）
+            abandon_seconds: SSE 订阅者全部断开多久后取消任务（秒，0 表示不取消）
+        """
+        self.queue = queue
+        self.workers = max(1, workers)
+        self.retention_seconds = retention_hours * 3600
+        self.abandon_seconds = abandon_seconds
+        self.worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._active: Dict[str, str] = {}  # job_id -> worker_id
+        self._tokens: Dict[str, Deadline] = {}  # job_id -> 截止时间（取消令牌）
+        self._active_lock = threading.Lock()
+
+    def start(self):
+        """启动工作线程和续约线程"""
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._run, args=(f"{self.worker_prefix}-{i}",),
+                name=f"job-worker-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        heartbeat = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+        heartbeat.start()
+        self._threads.append(heartbeat)
+        logger.info(f"🧵 任务工作线程已启动: workers={self.workers}, queue={self.queue.db_path}")
+
+    def stop(self):
+        """停止领取新任务（正在执行的任务由租约机制兜底）"""
+        self._stop.set()
+        self.queue._notify()
+
+    def cancel_local(self, job_id: str, reason: str) -> bool:
+        """
+        立即取消当前进程正在执行的任务
+
+        Returns:
+            任务是否由当前进程执行
+        """
+        with self._active_lock:
+            token = self._tokens.get(job_id)
+        if token is None:
+            return False
+        token.cancel(reason)
+        return True
+
+    def _heartbeat(self):
+        last_purge = 0.0
+        last_renew = 0.0
+        while not self._stop.wait(CANCEL_POLL_SECONDS):
+            with self._active_lock:
+                held = dict(self._active)
+            try:
+                # 其他进程（API 进程或其他节点）记录的取消请求
+                for job_id, reason in self.queue.cancel_requests(list(held)).items():
+                    self.cancel_local(job_id, reason)
+                if self.abandon_seconds > 0:
+                    self.queue.cancel_abandoned(self.abandon_seconds)
+                if time.time() - last_renew >= self.queue.lease_seconds / 3:
+                    last_renew = time.time()
+                    for worker_id in set(held.values()):
+                        self.queue.renew([job for job, w in held.items() if w == worker_id], worker_id)
+                if time.time() - last_purge > 3600:
+                    last_purge = time.time()
+                    self.queue.purge(self.retention_seconds)
+            except Exception as e:
+                logger.error(f"任务续约失败: {e}")
+
+    def _run(self, worker_id: str):
+        while not self._stop.is_set():
+            try:
+                job = self.queue.claim(worker_id)
+            except Exception as e:
+                logger.error(f"领取任务失败: {e}")
+                job = None
+
+            if job is None:
+                with self.queue._changed:
+                    self.queue._changed.wait(self.queue.poll_interval * 2)
+                continue
+
+            with self._active_lock:
+                self._active[job["id"]] = worker_id
+            try:
+                self.execute(job)
+            finally:
+                with self._active_lock:
+                    self._active.pop(job["id"], None)
+                    self._tokens.pop(job["id"], None)
+
+    def execute(self, job: Dict[str, Any]):
+        """
+        执行一个任务，把产生的事件写入队列
+
+        Args:
+            job: claim() 返回的任务字典
+        """
+        job_id = job["id"]
+        handler = _JOB_HANDLERS.get(job["kind"])
+        if handler is None:
+            self.queue.fail(job_id, f"未知的任务类型: {job['kind']}", kind=job["kind"])
+            return
+
+        payload = job["payload"]
+        if job["attempts"] > 1:
+            # 工作进程异常退出后重新执行：根据任务日志继续，只生成尚未成功的页面
+            payload = dict(payload, resume=True)
+
+        deadline = _job_deadline(payload)
+        with self._active_lock:
+            self._tokens[job_id] = deadline
+        if job.get("cancel_requested"):
+            deadline.cancel(job.get("error") or "任务已取消")
+
+        logger.info(f"▶️  开始执行任务: job={job_id}, kind={job['kind']}, task={job['task_id']}, 第 {job['attempts']} 次")
+        try:
+            for event in handler(payload, deadline):
+                self.queue.append_event(job_id, event["event"], event["data"])
+            self.queue.complete(job_id)
+            logger.info(f"⏹️  任务执行完成: job={job_id}")
+        except Exception as e:
+            logger.error(f"❌ 任务执行异常: job={job_id}, {e}\n{traceback.format_exc()}")
+            self.queue.fail(job_id, f"任务执行异常: {str(e)}", kind=job["kind"])
+
+
+# 全局任务队列和工作线程
+_queue_instance: Optional[JobQueue] = None
+_workers_instance: Optional[JobWorkerPool] = None
+_instance_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """获取全局任务队列（数据库路径由 JOB_QUEUE_PATH 配置，默认 history/jobs.db）"""
+    global _queue_instance
+    with _instance_lock:
+        if _queue_instance is None:
+            db_path = Config.JOB_QUEUE_PATH or os.path.join(_history_root(), "jobs.db")
+            _queue_instance = JobQueue(
+                db_path,
+                lease_seconds=Config.JOB_LEASE_SECONDS,
+                max_events_per_job=Config.JOB_EVENT_BUFFER_SIZE
+            )
+        return _queue_instance
+
+
+def recover_interrupted_tasks(queue: JobQueue) -> int:
+    """
+    启动时恢复被进程退出中断的生成任务
+
+    扫描最近的任务日志，对没有正常结束、也没有排队中或执行中后台任务的生成任务：
+    TASK_AUTO_RESUME 开启时重新入队（检查和入队是原子的，不会重复入队），只生成尚未成功的页面；否则把缺失的页面标记为失败，
+    前端可以直接重试这些页面（任务上下文从日志还原，无需重新提交）。
+
+    Args:
+        queue: 任务队列
+
+    Returns:
+        处理的任务数
+    """
+    recovered = 0
+    for item in find_unfinished_tasks(_history_root(), Config.TASK_RECOVERY_MAX_AGE_HOURS):
+        task_id = item["task_id"]
+        if queue.has_active_job(task_id):
+            continue
+
+        try:
+            if Config.TASK_AUTO_RESUME:
+                # 多个进程（gunicorn 工作进程、多个实例）同时启动时只有一个能入队成功
+                if queue.enqueue_if_idle("generate", {"task_id": task_id, "resume": True}, task_id) is None:
+                    continue
+                logger.info(f"♻️  任务 [{task_id}] 生成中断，已重新入队继续生成")
+            else:
+                task = GenerationTask.restore(task_id, item["task_dir"])
+                missing = task.missing_pages()
+                for page in missing:
+                    task.mark_failed(page["index"], INTERRUPTED_ERROR)
+                task.mark_finished()
+                logger.info(f"任务 [{task_id}] 生成中断，{len(missing)} 页已标记为可重试")
+            recovered += 1
+        except Exception as e:
+            logger.error(f"恢复任务 [{task_id}] 失败: {e}")
+    return recovered
+
+
+def start_job_workers(workers: Optional[int] = None) -> Optional[JobWorkerPool]:
+    """
+    启动当前进程的任务工作线程（重复调用只启动一次）
+
+    Args:
+        workers: 工作线程数，默认使用 JOB_WORKERS 配置；为 0 时不启动
+            （任务由独立的 `python -m backend.worker` 进程执行）
+
+    Returns:
+        工作线程池；未启动时返回 None
+    """
+    global _workers_instance
+    workers = Config.JOB_WORKERS if workers is None else workers
+    if workers <= 0:
+        logger.info("JOB_WORKERS=0，当前进程不执行生成任务，请单独启动 python -m backend.worker")
+        return None
+
+    queue = get_job_queue()
+    with _instance_lock:
+        if _workers_instance is None:
+            _workers_instance = JobWorkerPool(
+                queue, workers, Config.JOB_RETENTION_HOURS, Config.JOB_ABANDON_SECONDS
+            )
+            _workers_instance.start()
+            recover_interrupted_tasks(queue)
+        return _workers_instance
+
+
+def get_job_worker_capacity() -> Optional[int]:
+    """
+    可同时执行的任务数（准入控制按此估算任务的排队时间）
+
+    Returns:
+        当前进程的任务工作线程数（未启动时按 JOB_WORKERS 配置）；任务由独立的工作进程
+        执行时（JOB_WORKERS=0）当前进程无法得知工作进程的数量，返回 None
+    """
+    if _workers_instance is not None:
+        return _workers_instance.workers
+    return Config.JOB_WORKERS if Config.JOB_WORKERS > 0 else None
+
+
+def cancel_task_jobs(task_id: str, reason: str = "用户取消") -> List[str]:
+    """
+    取消图片任务的后台任务（当前进程执行的任务立即取消，其他进程在下一次检查时取消）
+
+    Args:
+        task_id: 图片任务 ID
+        reason: 取消原因
+
+    Returns:
+        被取消的后台任务 ID 列表
+    """
+    job_ids = get_job_queue().cancel_task(task_id, reason)
+    if _workers_instance is not None:
+        for job_id in job_ids:
+            _workers_instance.cancel_local(job_id, reason)
+    return job_ids
+
+
+def stop_job_workers():
+    """停止当前进程的任务工作线程"""
+    with _instance_lock:
+        if _workers_instance is not None:
+            _workers_instance.stop()
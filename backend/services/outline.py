@@ -6,6 +6,10 @@ import yaml
 from pathlib import Path
 from typing import Dict, List, Any, Optional
 from backend.utils.text_client import get_text_chat_client
+from backend.utils.image_compressor import compress_image
+from backend.utils.reference import ReferenceImage
+from backend.utils.deadline import Deadline, DeadlineExceededError
+from backend.utils.circuit_breaker import CircuitOpenError
 
 logger = logging.getLogger(__name__)
 
@@ -84,7 +88,7 @@ class OutlineService:
             )
 
         logger.info(f"使用文本服务商: {active_provider} (type={provider_config.get('type')})")
-        return get_text_chat_client(provider_config)
+        return get_text_chat_client(dict(provider_config, name=active_provider))
 
     def _load_prompt_template(self) -> str:
         prompt_path = os.path.join(
@@ -132,7 +136,8 @@ class OutlineService:
     def generate_outline(
         self,
         topic: str,
-        images: Optional[List[bytes]] = None
+        images: Optional[List[bytes]] = None,
+        deadline: Optional[Deadline] = None
     ) -> Dict[str, Any]:
         try:
             logger.info(f"开始生成大纲: topic={topic[:50]}..., images={len(images) if images else 0}")
@@ -151,13 +156,17 @@ class OutlineService:
             temperature = provider_config.get('temperature', 1.0)
             max_output_tokens = provider_config.get('max_output_tokens', 8000)
 
+            # 参考图只压缩、编码一次，429 重试时直接复用
+            references = [ReferenceImage(compress_image(img, max_size_kb=200)) for img in images] if images else None
+
             logger.info(f"调用文本生成 API: model={model}, temperature={temperature}")
             outline_text = self.client.generate_text(
                 prompt=prompt,
                 model=model,
                 temperature=temperature,
                 max_output_tokens=max_output_tokens,
-                images=images
+                images=references,
+                deadline=deadline
             )
 
             logger.debug(f"API 返回文本长度: {len(outline_text)} 字符")
@@ -194,6 +203,21 @@ class OutlineService:
                     "2. 没有访问该模型的权限\n"
                     "解决方案：在系统设置页面检查模型名称配置"
                 )
+            elif isinstance(e, CircuitOpenError):
+                detailed_error = (
+                    f"文本服务商暂时不可用。\n"
+                    f"错误详情: {error_msg}\n"
+                    "解决方案：稍后重试，或在系统设置中切换文本生成服务商"
+                )
+            elif isinstance(e, DeadlineExceededError):
+                detailed_error = (
+                    f"大纲生成超时 (deadline exceeded)。\n"
+                    f"错误详情: {error_msg}\n"
+                    "可能原因：\n"
+                    "1. 模型响应过慢\n"
+                    "2. 请求截止时间设置过短（TEXT_DEADLINE_SECONDS）\n"
+                    "解决方案：稍后重试，或换用响应更快的模型"
+                )
             elif "timeout" in error_msg.lower() or "连接" in error_msg:
                 detailed_error = (
                     f"网络连接失败。\n"
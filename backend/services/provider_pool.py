@@ -0,0 +1,200 @@
+"""图片服务商池（按权重分配页面，失败时切换到其他服务商）"""
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from backend.config import Config
+from backend.generators.base import ImageGeneratorBase
+from backend.generators.factory import ImageGeneratorFactory
+from backend.services.executor import GenerationExecutor
+from backend.utils.circuit_breaker import CircuitBreaker
+from backend.utils.flow_control import AdaptiveLimiter, get_adaptive_limiter, get_provider_cooldown
+from backend.utils.hedging import RequestHedger, get_request_hedger
+from backend.utils.retry import ErrorKind, classify_error
+
+logger = logging.getLogger(__name__)
+
+# 可以切换到其他服务商重试的错误类型；内容拦截和截止时间换服务商也无济于事
+FAILOVER_KINDS = {
+    ErrorKind.RATE_LIMIT,
+    ErrorKind.CIRCUIT_OPEN,
+    ErrorKind.SERVER,
+    ErrorKind.TIMEOUT,
+    ErrorKind.NETWORK,
+    ErrorKind.CLIENT,
+    ErrorKind.UNKNOWN,
+}
+
+
+def should_failover(error: Exception) -> bool:
+    """该错误是否应切换到其他服务商"""
+    return classify_error(error) in FAILOVER_KINDS
+
+
+class ImageProvider:
+    """服务商池中的单个服务商（生成器及其共享的并发、冷却、熔断、对冲控制）"""
+
+    def __init__(
+        self,
+        name: str,
+        config: Dict[str, Any],
+        executor: GenerationExecutor,
+        in_rotation: bool = True
+    ):
+        """
+        初始化服务商
+
+        Args:
+            name: 服务商名称
+            config: 服务商配置
+            executor: 共享执行器（登记该服务商的并发上限）
+            in_rotation: 是否参与按权重分配（只被 page_routing 引用的服务商不参与）
+        """
+        self.name = name
+        self.config = config
+        self.type = config.get('type', name)
+        self.weight = max(0.0, float(config.get('weight', 1) or 0))
+        self.in_rotation = in_rotation
+
+        logger.debug(f"创建生成器: name={name}, type={self.type}")
+        self.generator: ImageGeneratorBase = ImageGeneratorFactory.create(self.type, config)
+        self.breaker: CircuitBreaker = self.generator.circuit_breaker
+
+        # 服务商的自适应并发限制器（根据限流反馈自动调整），登记到共享执行器
+        self.limiter: AdaptiveLimiter = get_adaptive_limiter(name, config)
+        executor.configure_provider(name, self.limiter)
+        self.cooldown = get_provider_cooldown(name)
+
+        # 对冲请求（可选，用少量额外配额换取更短的长尾延迟），只使用该服务商通道的空闲名额
+        self.hedger: RequestHedger = get_request_hedger(name, config)
+        self.hedger.slots = executor.provider_slots(name)
+
+    def is_available(self) -> bool:
+        """服务商当前是否适合接收新页面（未熔断且不在限流冷却中）"""
+        return self.breaker.allow_request() and self.cooldown.remaining() <= 0
+
+
+class ProviderPool:
+    """
+    图片服务商池
+
+    按平滑加权轮询把页面分配给可用的服务商，从而叠加多个服务商（多个密钥、
+    多家厂商）的吞吐；每个服务商仍然有自己的并发上限。某个服务商限流或故障时，
+    页面按顺序切换到池中的其他服务商。
+    """
+
+    def __init__(
+        self,
+        provider_names: List[str],
+        executor: GenerationExecutor,
+        routed_names: Optional[List[str]] = None
+    ):
+        """
+        初始化服务商池
+
+        Args:
+            provider_names: 参与按权重分配的服务商名称列表（第一个为主服务商）
+            executor: 共享执行器
+            routed_names: 只按页面类型路由使用的服务商（不参与按权重分配，也不作为后备）
+        """
+        self.providers: List[ImageProvider] = []
+        for name in provider_names:
+            self.providers.append(ImageProvider(name, Config.get_image_provider_config(name), executor))
+        for name in routed_names or []:
+            if name not in provider_names:
+                self.providers.append(
+                    ImageProvider(name, Config.get_image_provider_config(name), executor, in_rotation=False)
+                )
+
+        if not self.providers:
+            raise ValueError(
+                "服务商池为空。\n"
+                "解决方案：在 image_providers.yaml 的 provider_pool 中至少填写一个服务商"
+            )
+
+        self._lock = threading.Lock()
+        self._current_weights = {provider.name: 0.0 for provider in self.providers}
+        self.assigned: Dict[str, int] = {provider.name: 0 for provider in self.providers}
+        self.failovers = 0
+
+    @property
+    def primary(self) -> ImageProvider:
+        """主服务商（列表中的第一个）"""
+        return self.providers[0]
+
+    @property
+    def size(self) -> int:
+        """池中服务商数量"""
+        return len(self.providers)
+
+    def get(self, name: str) -> Optional[ImageProvider]:
+        """按名称获取服务商"""
+        for provider in self.providers:
+            if provider.name == name:
+                return provider
+        return None
+
+    def _pick_locked(self, candidates: List[ImageProvider]) -> ImageProvider:
+        """平滑加权轮询（nginx 算法）：权重越大被选中越频繁，且分布均匀"""
+        total = sum(provider.weight for provider in candidates)
+        best = None
+        for provider in candidates:
+            self._current_weights[provider.name] += provider.weight
+            if best is None or self._current_weights[provider.name] > self._current_weights[best.name]:
+                best = provider
+        self._current_weights[best.name] -= total
+        return best
+
+    def plan(self, preferred: Optional[str] = None) -> List[ImageProvider]:
+        """
+        为一个页面规划服务商顺序
+
+        Args:
+            preferred: 页面路由规则指定的服务商（可用时优先使用）
+
+        Returns:
+            服务商列表：第一个为指定的服务商，或按权重从可用服务商中选出；
+            其余按可用性和权重排列，作为失败时依次切换的后备
+        """
+        rotation = [p for p in self.providers if p.in_rotation]
+        first = self.get(preferred) if preferred else None
+
+        with self._lock:
+            if first is None or not first.is_available():
+                available = [p for p in rotation if p.weight > 0 and p.is_available()]
+                if not available and first is None:
+                    # 全部不可用时仍按权重选择，由熔断器/冷却闸门决定快速失败还是等待
+                    available = [p for p in rotation if p.weight > 0] or rotation
+                if available:
+                    first = self._pick_locked(available)
+            self.assigned[first.name] += 1
+
+        fallbacks = sorted(
+            (p for p in rotation if p is not first),
+            key=lambda p: (not p.is_available(), -p.weight)
+        )
+        return [first] + fallbacks
+
+    def record_failover(self, from_name: str, to_name: str, error: str):
+        """记录一次服务商切换"""
+        with self._lock:
+            self.failovers += 1
+        logger.warning(f"🔀 服务商 [{from_name}] 生成失败，切换到 [{to_name}]: {error[:100]}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取服务商池状态"""
+        with self._lock:
+            return {
+                "providers": [
+                    {
+                        "name": provider.name,
+                        "type": provider.type,
+                        "weight": provider.weight,
+                        "in_rotation": provider.in_rotation,
+                        "available": provider.is_available(),
+                        "assigned": self.assigned[provider.name],
+                    }
+                    for provider in self.providers
+                ],
+                "failovers": self.failovers,
+            }
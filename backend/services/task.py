@@ -0,0 +1,255 @@
+"""图片生成任务上下文"""
+import os
+import threading
+from typing import Dict, List, Optional
+from backend.services.task_journal import RECORD_FAILED, RECORD_FINISHED, RECORD_GENERATED, TaskJournal
+from backend.utils.deadline import Deadline
+from backend.utils.reference import ReferenceBundle, ReferenceImage
+
+
+class GenerationTask:
+    """
+    单个图片生成任务的执行上下文
+
+    每个任务持有自己的输出目录、封面图、用户参考图和进度计数，
+    在工作线程之间显式传递，避免多个并发任务共享服务实例上的状态。
+    每次页面状态变化同时写入任务日志（history/<task_id>/journal.jsonl），
+    进程重启后可以通过 restore() 还原。封面图和用户参考图以引用方式保存在任务日志的
+    存储中（本地 refs/ 目录或 Redis），可以从内存中释放（spill），下次访问时自动重新加载。
+    参考图的请求编码（base64、SDK Part）每个任务只生成一次，见 reference_bundle()。
+    """
+
+    def __init__(
+        self,
+        task_id: str,
+        task_dir: str,
+        pages: Optional[List[Dict]] = None,
+        full_outline: str = "",
+        user_images: Optional[List[bytes]] = None,
+        user_topic: str = "",
+        deadline: Optional[Deadline] = None,
+        journal: Optional[TaskJournal] = None,
+        client_id: str = ""
+    ):
+        """
+        初始化任务上下文
+
+        Args:
+            task_id: 任务ID
+            task_dir: 任务输出目录
+            pages: 页面列表
+            full_outline: 完整的大纲文本
+            user_images: 用户上传的参考图片列表（已压缩）
+            user_topic: 用户原始输入
+            deadline: 任务截止时间（默认不限制）
+            journal: 任务日志（默认写入任务目录下的 journal.jsonl）
+            client_id: 发起任务的客户端标识（调度时按客户端公平分配服务商并发）
+        """
+        self.task_id = task_id
+        self.task_dir = task_dir
+        self.pages = pages or []
+        self.full_outline = full_outline
+        self.user_topic = user_topic
+        self._user_images = user_images
+        self._user_images_count = len(user_images) if user_images else 0
+        self._user_images_spilled = False
+        self._cover_image: Optional[bytes] = None
+        self._cover_reference: Optional[ReferenceImage] = None
+        self._user_references: Optional[List[ReferenceImage]] = None
+        self.deadline = deadline or Deadline.none()
+        self.journal = journal or TaskJournal(task_dir)
+        self.client_id = client_id
+
+        # 页面结果：index -> filename / index -> error
+        self.generated: Dict[int, str] = {}
+        self.failed: Dict[int, str] = {}
+        self.finished = False
+
+        self._lock = threading.Lock()
+
+    @classmethod
+    def restore(
+        cls,
+        task_id: str,
+        task_dir: str,
+        journal: Optional[TaskJournal] = None
+    ) -> Optional["GenerationTask"]:
+        """
+        根据任务日志还原任务上下文（图片数据在访问时按需加载）
+
+        Args:
+            task_id: 任务ID
+            task_dir: 任务输出目录
+            journal: 任务日志（默认读取任务目录下的 journal.jsonl）
+
+        Returns:
+            任务上下文；没有任务日志时返回 None
+        """
+        journal = journal or TaskJournal(task_dir)
+        state = journal.replay()
+        if state is None:
+            return None
+
+        task = cls(
+            task_id=task_id,
+            task_dir=task_dir,
+            pages=state["pages"],
+            full_outline=state["full_outline"],
+            user_topic=state["user_topic"],
+            journal=journal
+        )
+        task._user_images_count = state["user_images"]
+        task._user_images_spilled = state["user_images"] > 0
+        task.generated = state["generated"]
+        task.failed = state["failed"]
+        task.finished = state["finished"]
+        return task
+
+    @property
+    def cover_image(self) -> Optional[bytes]:
+        """压缩后的封面图（不在内存中时从任务日志的存储加载）"""
+        if self._cover_image is None:
+            self._cover_image = self.journal.load_blob("cover")
+        return self._cover_image
+
+    @cover_image.setter
+    def cover_image(self, value: Optional[bytes]):
+        # 封面图同时保存到任务日志的存储，从内存释放或换到其他进程后仍可加载
+        self._cover_image = value
+        self._cover_reference = None
+        if value is None:
+            self.journal.delete_blob("cover")
+        else:
+            self.journal.save_blob("cover", value)
+
+    @property
+    def user_images(self) -> Optional[List[bytes]]:
+        """压缩后的用户参考图（已从内存释放时重新加载）"""
+        if self._user_images is None and self._user_images_spilled:
+            self._user_images = self.journal.load_user_images(self._user_images_count)
+            self._user_images_spilled = False
+        return self._user_images
+
+    @user_images.setter
+    def user_images(self, value: Optional[List[bytes]]):
+        self._user_images = value
+        self._user_images_count = len(value) if value else 0
+        self._user_images_spilled = False
+        self._user_references = None
+
+    def reference_bundle(self, use_reference: bool = True) -> ReferenceBundle:
+        """
+        本任务的参考图（用户参考图 + 封面图），编码结果在各页面之间共享
+
+        Args:
+            use_reference: 是否包含封面图
+
+        Returns:
+            参考图集合
+        """
+        with self._lock:
+            if self._user_references is None:
+                self._user_references = [ReferenceImage(image) for image in self.user_images or []]
+            user_references = self._user_references
+            cover = None
+            if use_reference:
+                if self._cover_reference is None and self.cover_image is not None:
+                    self._cover_reference = ReferenceImage(self.cover_image)
+                cover = self._cover_reference
+        return ReferenceBundle(user_references, cover)
+
+    def blob_bytes(self) -> int:
+        """当前保存在内存中的图片数据字节数（含参考图的编码结果）"""
+        total = len(self._cover_image) if self._cover_image else 0
+        if self._user_images:
+            total += sum(len(image) for image in self._user_images)
+        if self._cover_reference is not None:
+            total += self._cover_reference.encoded_bytes()
+        if self._user_references:
+            total += sum(reference.encoded_bytes() for reference in self._user_references)
+        return total
+
+    def spill(self) -> int:
+        """
+        把封面图和用户参考图从内存释放（已保存在任务日志的存储中），访问时按需重新加载
+
+        Returns:
+            释放的字节数
+        """
+        released = 0
+
+        # 编码结果随时可以重新生成，直接丢弃
+        for reference in [self._cover_reference] + (self._user_references or []):
+            if reference is not None:
+                released += reference.encoded_bytes()
+        self._cover_reference = None
+        self._user_references = None
+
+        cover = self._cover_image
+        if cover is not None:
+            self._cover_image = None
+            released += len(cover)
+
+        user_images = self._user_images
+        if user_images:
+            if self.journal.load_user_images(len(user_images)) is None:
+                for i, image in enumerate(user_images):
+                    self.journal.save_blob(f"user_{i}", image)
+            self._user_images = None
+            self._user_images_spilled = True
+            released += sum(len(image) for image in user_images)
+
+        return released
+
+    @property
+    def total(self) -> int:
+        """页面总数"""
+        return len(self.pages)
+
+    @property
+    def completed_count(self) -> int:
+        """已成功生成的页面数"""
+        with self._lock:
+            return len(self.generated)
+
+    @property
+    def failed_count(self) -> int:
+        """生成失败的页面数"""
+        with self._lock:
+            return len(self.failed)
+
+    def ensure_dir(self):
+        """确保任务目录存在"""
+        os.makedirs(self.task_dir, exist_ok=True)
+
+    def mark_generated(self, index: int, filename: str):
+        """记录页面生成成功（同时清除该页的失败记录）"""
+        with self._lock:
+            self.generated[index] = filename
+            self.failed.pop(index, None)
+        self.journal.append(RECORD_GENERATED, index=index, filename=filename)
+
+    def mark_failed(self, index: int, error: str):
+        """记录页面生成失败"""
+        with self._lock:
+            self.failed[index] = error
+        self.journal.append(RECORD_FAILED, index=index, error=error)
+
+    def mark_finished(self):
+        """记录本轮生成结束（进程重启后不再自动恢复）"""
+        self.finished = True
+        self.journal.append(RECORD_FINISHED, completed=self.completed_count, failed=self.failed_count)
+
+    def missing_pages(self) -> List[Dict]:
+        """尚未成功生成的页面"""
+        with self._lock:
+            return [page for page in self.pages if page["index"] not in self.generated]
+
+    @property
+    def tenant(self) -> str:
+        """调度租户：客户端标识，没有时按任务区分"""
+        return self.client_id or self.task_id
+
+    def image_url(self, filename: str) -> str:
+        """获取图片访问地址"""
+        return f"/api/images/{self.task_id}/{filename}"
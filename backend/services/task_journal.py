@@ -0,0 +1,288 @@
+"""任务日志（追加写入的任务状态变更记录，进程重启后据此恢复任务）"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 记录类型
+RECORD_CREATED = "created"
+RECORD_GENERATED = "generated"
+RECORD_FAILED = "failed"
+RECORD_FINISHED = "finished"
+
+# 进程中断导致未完成的页面的错误信息
+INTERRUPTED_ERROR = "服务重启导致生成中断，请重试该页"
+
+
+class TaskJournal:
+    """
+    单个任务的追加写入日志：history/<task_id>/journal.jsonl
+
+    每次状态变更（创建任务、页面成功、页面失败、任务结束）追加一行 JSON 并 fsync，
+    进程崩溃或重启后按顺序重放即可还原页面列表、大纲、用户参考图和每页结果。
+    写到一半的最后一行在重放时忽略。图片数据（压缩后的封面图和用户参考图）
+    以引用方式保存在 refs/ 子目录，任务上下文只在需要时加载。
+    """
+
+    FILENAME = "journal.jsonl"
+    REFS_DIR = "refs"
+    # 日志和图片数据是否可被其他进程/节点读取（本地文件只对当前节点可见）
+    shared = False
+
+    def __init__(self, task_dir: str):
+        """
+        初始化任务日志
+
+        Args:
+            task_dir: 任务目录
+        """
+        self.task_dir = task_dir
+        self.path = os.path.join(task_dir, self.FILENAME)
+        self._lock = threading.Lock()
+
+    def exists(self) -> bool:
+        """日志文件是否存在"""
+        return os.path.exists(self.path)
+
+    def append(self, record_type: str, **fields):
+        """
+        追加一条记录（写入后 fsync，保证崩溃后不丢失已确认的状态）
+
+        Args:
+            record_type: 记录类型
+            **fields: 记录内容（需可 JSON 序列化）
+        """
+        self._write_line(json.dumps(dict(fields, type=record_type, ts=time.time()), ensure_ascii=False) + "\n")
+
+    def _write_line(self, line: str):
+        """追加一行到日志文件"""
+        with self._lock:
+            os.makedirs(self.task_dir, exist_ok=True)
+            with open(self.path, "ab+") as f:
+                size = f.seek(0, os.SEEK_END)
+                if size:
+                    f.seek(size - 1)
+                    if f.read(1) != b"\n":
+                        # 上次写入被中断留下了不完整的行，另起一行避免与新记录粘连
+                        line = "\n" + line
+                f.write(line.encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def record_created(
+        self,
+        pages: List[Dict],
+        full_outline: str = "",
+        user_topic: str = "",
+        user_images: Optional[List[bytes]] = None
+    ):
+        """
+        记录任务创建（同时保存用户参考图）
+
+        Args:
+            pages: 页面列表
+            full_outline: 完整的大纲文本
+            user_topic: 用户原始输入
+            user_images: 用户上传的参考图片列表（已压缩）
+        """
+        user_images = user_images or []
+        for i, image in enumerate(user_images):
+            self.save_blob(f"user_{i}", image)
+
+        self.append(
+            RECORD_CREATED,
+            pages=pages,
+            full_outline=full_outline,
+            user_topic=user_topic,
+            user_images=len(user_images)
+        )
+
+    def _blob_path(self, name: str) -> str:
+        return os.path.join(self.task_dir, self.REFS_DIR, f"{name}.bin")
+
+    def save_blob(self, name: str, data: bytes):
+        """
+        保存任务的图片数据
+
+        Args:
+            name: 数据名称（cover、user_0 ...）
+            data: 二进制数据
+        """
+        path = self._blob_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def load_blob(self, name: str) -> Optional[bytes]:
+        """读取任务的图片数据，不存在时返回 None"""
+        path = self._blob_path(name)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def delete_blob(self, name: str):
+        """删除任务的图片数据"""
+        path = self._blob_path(name)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def load_user_images(self, count: int) -> Optional[List[bytes]]:
+        """读取保存的用户参考图"""
+        images = [self.load_blob(f"user_{i}") for i in range(count)]
+        return [image for image in images if image is not None] or None
+
+    def _read_lines(self) -> List[str]:
+        """读取日志的所有行"""
+        with open(self.path, "r", encoding="utf-8") as f:
+            return f.readlines()
+
+    def replay(self) -> Optional[Dict[str, Any]]:
+        """
+        重放日志，还原任务状态
+
+        每条 created 记录开始一轮新的生成（同一 task_id 重新生成时覆盖之前的状态）。
+
+        Returns:
+            任务状态字典：pages、full_outline、user_topic、user_images（数量）、
+            generated、failed、created（是否有创建记录）、finished、updated_at；
+            日志不存在时返回 None
+        """
+        if not self.exists():
+            return None
+        return self._replay_lines(self._read_lines())
+
+    def _replay_lines(self, lines: List[str]) -> Dict[str, Any]:
+        """按顺序重放日志记录"""
+        state: Dict[str, Any] = {
+            "pages": [],
+            "full_outline": "",
+            "user_topic": "",
+            "user_images": 0,
+            "generated": {},
+            "failed": {},
+            "created": False,
+            "finished": False,
+            "updated_at": 0.0,
+        }
+        for line_no, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 进程在写入过程中退出，最后一行可能不完整
+                logger.warning(f"任务日志第 {line_no} 行不完整，已忽略: {self.path}")
+                continue
+
+            record_type = record.get("type")
+            state["updated_at"] = record.get("ts", state["updated_at"])
+            if record_type == RECORD_CREATED:
+                state.update(
+                    pages=record.get("pages") or [],
+                    full_outline=record.get("full_outline", ""),
+                    user_topic=record.get("user_topic", ""),
+                    user_images=record.get("user_images", 0),
+                    generated={},
+                    failed={},
+                    created=True,
+                    finished=False,
+                )
+            elif record_type == RECORD_GENERATED:
+                state["generated"][record["index"]] = record["filename"]
+                state["failed"].pop(record["index"], None)
+            elif record_type == RECORD_FAILED:
+                state["failed"][record["index"]] = record.get("error", "")
+            elif record_type == RECORD_FINISHED:
+                state["finished"] = True
+        return state
+
+
+class RedisTaskJournal(TaskJournal):
+    """
+    保存在 Redis 中的任务日志（多个进程/节点共享任务状态）
+
+    日志记录追加到 Redis 列表，图片数据以独立的键保存，任务状态中只记录引用；
+    任何工作进程都可以据此还原任务、处理 /api/retry 和 /api/regenerate。
+    同时写入本地日志文件，当前节点的启动恢复（find_unfinished_tasks）仍然可用。
+    """
+
+    shared = True
+
+    def __init__(self, task_dir: str, task_id: str, storage, ttl_seconds: int = 72 * 3600):
+        """
+        初始化 Redis 任务日志
+
+        Args:
+            task_dir: 任务目录（本地日志文件）
+            task_id: 任务ID
+            storage: RedisStorage 实例
+            ttl_seconds: 任务键的过期时间（秒，每次写入时刷新）
+        """
+        super().__init__(task_dir)
+        self.task_id = task_id
+        self.storage = storage
+        self.ttl_seconds = ttl_seconds
+        self._key = f"tasks/{task_id}/journal"
+
+    def _blob_key(self, name: str) -> str:
+        return f"tasks/{self.task_id}/refs/{name}"
+
+    def _write_line(self, line: str):
+        super()._write_line(line)
+        self.storage.append(self._key, line)
+        self.storage.expire(self._key, self.ttl_seconds)
+
+    def exists(self) -> bool:
+        return self.storage.exists(self._key)
+
+    def _read_lines(self) -> List[str]:
+        return self.storage.load_lines(self._key)
+
+    def save_blob(self, name: str, data: bytes):
+        key = self._blob_key(name)
+        self.storage.save(key, data)
+        self.storage.expire(key, self.ttl_seconds)
+
+    def load_blob(self, name: str) -> Optional[bytes]:
+        return self.storage.load(self._blob_key(name))
+
+    def delete_blob(self, name: str):
+        self.storage.delete(self._blob_key(name))
+
+
+def find_unfinished_tasks(history_root: str, max_age_hours: float = 24.0) -> List[Dict[str, Any]]:
+    """
+    扫描 history 目录，找出未正常结束的生成任务（进程在生成过程中退出）
+
+    Args:
+        history_root: history 根目录
+        max_age_hours: 只处理最近多少小时内有更新的任务
+
+    Returns:
+        [{"task_id", "task_dir", "state"}]，state 为 TaskJournal.replay() 的结果
+    """
+    if not os.path.isdir(history_root):
+        return []
+
+    cutoff = time.time() - max_age_hours * 3600
+    unfinished = []
+    for task_id in os.listdir(history_root):
+        task_dir = os.path.join(history_root, task_id)
+        journal = TaskJournal(task_dir)
+        if not journal.exists() or os.path.getmtime(journal.path) < cutoff:
+            continue
+        try:
+            state = journal.replay()
+        except Exception as e:
+            logger.error(f"读取任务日志失败 [{task_id}]: {e}")
+            continue
+        if state and state["created"] and not state["finished"]:
+            unfinished.append({"task_id": task_id, "task_dir": task_dir, "state": state})
+    return unfinished
@@ -0,0 +1,320 @@
+"""任务上下文存储（按字节预算管理内存中的任务，过期/淘汰/溢出到磁盘；可选 Redis 共享状态）"""
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from backend.config import Config
+from backend.services.task import GenerationTask
+from backend.services.task_journal import RedisTaskJournal, TaskJournal
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    """存储中的一个任务"""
+
+    __slots__ = ("task", "last_access", "pins")
+
+    def __init__(self, task: GenerationTask):
+        self.task = task
+        self.last_access = time.monotonic()
+        self.pins = 0
+
+
+class TaskStateBackend(ABC):
+    """
+    任务状态后端
+
+    决定任务日志（状态变更记录和图片数据）保存在哪里，以及进程内缓存哪些任务上下文。
+    ImageService 只通过这个接口创建、还原和缓存任务。
+    """
+
+    @abstractmethod
+    def create_journal(self, task_id: str, task_dir: str) -> TaskJournal:
+        """创建任务日志"""
+        pass
+
+    @abstractmethod
+    def get(self, task_id: str) -> Optional[GenerationTask]:
+        """获取缓存的任务；返回 None 时调用方根据任务日志还原"""
+        pass
+
+    @abstractmethod
+    def put(self, task: GenerationTask, replace: bool = True) -> GenerationTask:
+        """缓存任务"""
+        pass
+
+    @abstractmethod
+    def pop(self, task_id: str) -> Optional[GenerationTask]:
+        """移出任务"""
+        pass
+
+    @abstractmethod
+    def pin(self, task_id: str):
+        """标记任务正在使用"""
+        pass
+
+    @abstractmethod
+    def unpin(self, task_id: str):
+        """取消 pin 标记"""
+        pass
+
+    @abstractmethod
+    def get_stats(self) -> Dict[str, Any]:
+        """获取状态"""
+        pass
+
+
+class TaskStateStore(TaskStateBackend):
+    """
+    进程内的任务上下文存储（默认后端，任务日志写入本地 history 目录）
+
+    按任务中图片数据（压缩后的封面图和用户参考图）的实际字节数计量内存：
+    - 超过 TTL 未访问的任务被移出内存
+    - 超出字节预算时，先把最久未访问任务的图片数据溢出到任务目录（refs/），
+      下次访问（如 /api/retry）时再按需加载；仍然超出时淘汰最久未访问的任务
+    - 正在生成的任务（pin）不会被移出，只会溢出图片数据
+
+    被移出的任务可以随时根据任务日志还原，因此淘汰不会丢失状态。
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: float = 3600.0):
+        """
+        初始化任务存储
+
+        Args:
+            max_bytes: 内存中图片数据的字节预算
+            ttl_seconds: 任务多久未访问后移出内存（秒，0 表示不过期）
+        """
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self.spilled = 0
+        self.spilled_bytes = 0
+
+    def create_journal(self, task_id: str, task_dir: str) -> TaskJournal:
+        return TaskJournal(task_dir)
+
+    def get(self, task_id: str) -> Optional[GenerationTask]:
+        """获取任务（同时刷新访问时间）；不在内存中时返回 None"""
+        with self._lock:
+            self._expire_locked()
+            entry = self._entries.get(task_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry.last_access = time.monotonic()
+            self._entries.move_to_end(task_id)
+            task = entry.task
+
+        # 访问可能重新加载了溢出的图片数据
+        self.enforce_budget()
+        return task
+
+    def put(self, task: GenerationTask, replace: bool = True) -> GenerationTask:
+        """
+        存入任务
+
+        Args:
+            task: 任务上下文
+            replace: 已存在同 ID 的任务时是否替换；为 False 时保留已有任务
+
+        Returns:
+            存储中的任务（replace=False 且已存在时为已有任务）
+        """
+        with self._lock:
+            entry = self._entries.get(task.task_id)
+            if entry is not None and not replace:
+                entry.last_access = time.monotonic()
+                self._entries.move_to_end(task.task_id)
+                return entry.task
+            new_entry = _Entry(task)
+            if entry is not None:
+                new_entry.pins = entry.pins
+            self._entries[task.task_id] = new_entry
+            self._entries.move_to_end(task.task_id)
+
+        self.enforce_budget()
+        return task
+
+    def pop(self, task_id: str) -> Optional[GenerationTask]:
+        """移出任务"""
+        with self._lock:
+            entry = self._entries.pop(task_id, None)
+        return entry.task if entry else None
+
+    def pin(self, task_id: str):
+        """标记任务正在使用（生成过程中不会被移出内存）"""
+        with self._lock:
+            entry = self._entries.get(task_id)
+            if entry is not None:
+                entry.pins += 1
+
+    def unpin(self, task_id: str):
+        """取消 pin 标记"""
+        with self._lock:
+            entry = self._entries.get(task_id)
+            if entry is not None and entry.pins > 0:
+                entry.pins -= 1
+                entry.last_access = time.monotonic()
+
+    def _expire_locked(self):
+        if not self.ttl_seconds:
+            return
+        cutoff = time.monotonic() - self.ttl_seconds
+        for task_id in [tid for tid, e in self._entries.items() if e.pins == 0 and e.last_access < cutoff]:
+            self._entries.pop(task_id)
+            self.expired += 1
+            logger.debug(f"任务 [{task_id}] 超过 {self.ttl_seconds:.0f} 秒未访问，移出内存")
+
+    def _total_bytes_locked(self) -> int:
+        return sum(entry.task.blob_bytes() for entry in self._entries.values())
+
+    def enforce_budget(self):
+        """清理过期任务；超出字节预算时按最久未访问的顺序溢出图片数据、淘汰任务"""
+        with self._lock:
+            self._expire_locked()
+            total = self._total_bytes_locked()
+            if total <= self.max_bytes:
+                return
+
+            # 第一步：溢出图片数据（从最久未访问的任务开始，不影响任务继续使用）
+            for task_id, entry in list(self._entries.items()):
+                if total <= self.max_bytes:
+                    return
+                if entry.task.blob_bytes() == 0:
+                    continue
+                try:
+                    released = entry.task.spill()
+                except OSError as e:
+                    logger.warning(f"任务 [{task_id}] 图片数据溢出到磁盘失败: {e}")
+                    continue
+                total -= released
+                self.spilled += 1
+                self.spilled_bytes += released
+                logger.debug(f"任务 [{task_id}] 图片数据溢出到磁盘: {released / 1024:.0f}KB")
+
+            # 第二步：仍然超出（溢出失败）时淘汰未在使用的任务
+            for task_id, entry in list(self._entries.items()):
+                if total <= self.max_bytes:
+                    return
+                if entry.pins:
+                    continue
+                total -= entry.task.blob_bytes()
+                self._entries.pop(task_id)
+                self.evicted += 1
+                logger.debug(f"任务 [{task_id}] 超出内存预算，移出内存")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取存储状态"""
+        with self._lock:
+            self._expire_locked()
+            return {
+                "backend": "memory",
+                "entries": len(self._entries),
+                "pinned": sum(1 for entry in self._entries.values() if entry.pins),
+                "bytes": self._total_bytes_locked(),
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "evicted": self.evicted,
+                "spilled": self.spilled,
+                "spilled_bytes": self.spilled_bytes,
+            }
+
+
+class RedisTaskStateStore(TaskStateStore):
+    """
+    Redis 共享的任务状态（多个工作进程/节点处理同一个任务）
+
+    任务日志和图片数据保存在 Redis（RedisTaskJournal），进程内只缓存正在生成的任务；
+    其他请求每次都从 Redis 还原，保证看到其他进程写入的最新状态。后台任务队列和
+    SSE 任务事件不在此共享（见 JobQueue），仍限于单个节点。
+    """
+
+    def __init__(
+        self,
+        storage,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl_seconds: float = 3600.0,
+        redis_ttl_seconds: int = 72 * 3600
+    ):
+        """
+        初始化 Redis 任务状态
+
+        Args:
+            storage: RedisStorage 实例
+            max_bytes: 内存中图片数据的字节预算
+            ttl_seconds: 任务多久未访问后移出内存（秒，0 表示不过期）
+            redis_ttl_seconds: Redis 中任务键的过期时间（秒）
+        """
+        super().__init__(max_bytes=max_bytes, ttl_seconds=ttl_seconds)
+        self.storage = storage
+        self.redis_ttl_seconds = redis_ttl_seconds
+
+    def create_journal(self, task_id: str, task_dir: str) -> TaskJournal:
+        return RedisTaskJournal(task_dir, task_id, self.storage, ttl_seconds=self.redis_ttl_seconds)
+
+    def get(self, task_id: str) -> Optional[GenerationTask]:
+        """只返回本进程正在使用的任务，其余任务从 Redis 重新还原"""
+        with self._lock:
+            entry = self._entries.get(task_id)
+            if entry is not None and not entry.pins:
+                # 其他进程可能已经更新了任务状态，本地副本作废
+                self._entries.pop(task_id)
+                entry = None
+        if entry is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        return super().get(task_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = super().get_stats()
+        stats.update(backend="redis", redis_ttl_seconds=self.redis_ttl_seconds)
+        return stats
+
+
+# 全局任务存储（进程级，不随配置更新重建）
+_store_instance: Optional[TaskStateBackend] = None
+_store_lock = threading.Lock()
+
+
+def get_task_store() -> TaskStateBackend:
+    """获取全局任务存储（TASK_STATE_BACKEND: memory | redis）"""
+    global _store_instance
+    with _store_lock:
+        if _store_instance is None:
+            max_bytes = int(Config.TASK_STATE_MAX_MB * 1024 * 1024)
+            if Config.TASK_STATE_BACKEND == 'redis':
+                from backend.utils.storage import RedisStorage
+
+                url = Config.TASK_STATE_REDIS_URL or os.getenv("REDIS_URL") or os.getenv("KV_URL")
+                if not url:
+                    raise ValueError("TASK_STATE_BACKEND=redis 时需要配置 TASK_STATE_REDIS_URL 或 REDIS_URL")
+                _store_instance = RedisTaskStateStore(
+                    RedisStorage(url),
+                    max_bytes=max_bytes,
+                    ttl_seconds=Config.TASK_STATE_TTL_SECONDS,
+                    redis_ttl_seconds=int(Config.TASK_STATE_REDIS_TTL_HOURS * 3600)
+                )
+                logger.info("任务状态后端: Redis（后台任务队列和任务事件仍保存在本节点的 SQLite 中）")
+            else:
+                _store_instance = TaskStateStore(
+                    max_bytes=max_bytes,
+                    ttl_seconds=Config.TASK_STATE_TTL_SECONDS
+                )
+        return _store_instance
@@ -0,0 +1,46 @@
+"""协程版生成器共享的 HTTP 客户端（每个事件循环一个连接池）"""
+import asyncio
+import threading
+import weakref
+from typing import Optional
+
+import httpx
+
+# 事件循环 -> 该循环上的客户端（httpx.AsyncClient 只能在创建它的事件循环中使用）
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    获取当前事件循环共享的 HTTP 客户端
+
+    同一事件循环上的所有页面请求复用一个连接池，上千个在途请求不再各自建立连接。
+    必须在事件循环中调用。
+
+    Returns:
+        httpx.AsyncClient
+    """
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        client = _clients.get(loop)
+        if client is None or client.is_closed:
+            from backend.config import Config
+            max_connections = max(1, Config.ASYNC_MAX_INFLIGHT_PAGES)
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=min(max_connections, 100)
+                ),
+                follow_redirects=True
+            )
+            _clients[loop] = client
+        return client
+
+
+async def aclose_async_http_client():
+    """关闭当前事件循环的 HTTP 客户端（事件循环停止前调用）"""
+    with _clients_lock:
+        client: Optional[httpx.AsyncClient] = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,257 @@
+"""服务商熔断器"""
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """服务商熔断中，请求被直接拒绝（不会发往服务商）"""
+
+    def __init__(self, message: str, provider_name: str, retry_after: float):
+        super().__init__(message)
+        self.provider_name = provider_name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    服务商熔断器（closed -> open -> half_open -> closed）
+
+    - closed：正常放行，记录最近调用结果；连续失败达到阈值，或最近窗口内的
+      失败率超过阈值时熔断（open）
+    - open：直接拒绝调用（抛出 CircuitOpenError），不再占用工作线程和重试链
+    - half_open：熔断时间结束后放行少量探测请求，探测成功则恢复（closed），
+      失败则重新熔断
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        error_rate_threshold: float = 0.5,
+        window: int = 20,
+        min_requests: int = 10,
+        open_seconds: float = 30.0,
+        half_open_probes: int = 1
+    ):
+        """
+        初始化熔断器
+
+        Args:
+            name: 服务商名称
+            failure_threshold: 连续失败多少次后熔断
+            error_rate_threshold: 最近窗口内失败率超过该值时熔断
+            window: 计算失败率的最近调用次数
+            min_requests: 窗口内至少有多少次调用才按失败率判断
+            open_seconds: 熔断持续时间（秒），之后进入半开状态
+            half_open_probes: 半开状态下允许同时进行的探测请求数
+        """
+        self.name = name
+        self._lock = threading.Lock()
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.min_requests = min_requests
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self._results = deque(maxlen=window)
+
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+
+        self.rejected = 0
+        self.opens = 0
+
+    def configure(
+        self,
+        failure_threshold: int = 5,
+        error_rate_threshold: float = 0.5,
+        window: int = 20,
+        min_requests: int = 10,
+        open_seconds: float = 30.0,
+        half_open_probes: int = 1
+    ):
+        """更新熔断参数（不改变当前状态）"""
+        with self._lock:
+            self.failure_threshold = max(1, int(failure_threshold))
+            self.error_rate_threshold = min(max(float(error_rate_threshold), 0.05), 1.0)
+            self.min_requests = max(1, int(min_requests))
+            self.open_seconds = max(1.0, float(open_seconds))
+            self.half_open_probes = max(1, int(half_open_probes))
+            if self._results.maxlen != max(1, int(window)):
+                self._results = deque(self._results, maxlen=max(1, int(window)))
+
+    @property
+    def state(self) -> str:
+        """当前状态（熔断时间结束后视为半开）"""
+        with self._lock:
+            return self._current_state_locked()
+
+    def _current_state_locked(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = self.HALF_OPEN
+            self._probes_in_flight = 0
+            logger.info(f"服务商 [{self.name}] 熔断结束，进入半开状态，开始探测")
+        return self._state
+
+    def retry_after(self) -> float:
+        """熔断剩余时间（秒）"""
+        with self._lock:
+            if self._current_state_locked() != self.OPEN:
+                return 0.0
+            return max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+    def allow_request(self) -> bool:
+        """当前是否可以向该服务商发送请求（不占用探测名额，用于路由判断）"""
+        with self._lock:
+            state = self._current_state_locked()
+            if state == self.OPEN:
+                return False
+            if state == self.HALF_OPEN:
+                return self._probes_in_flight < self.half_open_probes
+            return True
+
+    def before_call(self):
+        """
+        调用服务商前检查
+
+        Raises:
+            CircuitOpenError: 熔断中，或半开状态下探测名额已满
+        """
+        with self._lock:
+            state = self._current_state_locked()
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and self._probes_in_flight < self.half_open_probes:
+                self._probes_in_flight += 1
+                return
+            self.rejected += 1
+            retry_after = max(0.0, self.open_seconds - (time.monotonic() - self._opened_at)) \
+                if state == self.OPEN else 1.0
+
+        raise CircuitOpenError(
+            f"服务商 [{self.name}] 暂时不可用（熔断中，circuit open），约 {retry_after:.0f} 秒后自动恢复。\n"
+            "原因：该服务商近期连续失败或失败率过高\n"
+            "建议：稍后重试，或在系统设置中切换服务商",
+            provider_name=self.name,
+            retry_after=retry_after
+        )
+
+    def _open_locked(self, reason: str):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._probes_in_flight = 0
+        self.opens += 1
+        logger.warning(f"⚡ 服务商 [{self.name}] 熔断 {self.open_seconds:.0f} 秒: {reason}")
+
+    def on_success(self):
+        """记录一次成功调用"""
+        with self._lock:
+            self._results.append(True)
+            self._consecutive_failures = 0
+            if self._state == self.HALF_OPEN:
+                self._state = self.CLOSED
+                self._probes_in_flight = 0
+                self._results.clear()
+                logger.info(f"✅ 服务商 [{self.name}] 探测成功，熔断恢复")
+
+    def on_failure(self):
+        """记录一次服务商故障（5xx、超时、网络错误等）"""
+        with self._lock:
+            self._results.append(False)
+            self._consecutive_failures += 1
+            if self._state == self.HALF_OPEN:
+                self._open_locked("半开探测失败")
+                return
+            if self._state != self.CLOSED:
+                return
+            if self._consecutive_failures >= self.failure_threshold:
+                self._open_locked(f"连续失败 {self._consecutive_failures} 次")
+                return
+            if len(self._results) >= self.min_requests:
+                error_rate = self._results.count(False) / len(self._results)
+                if error_rate >= self.error_rate_threshold:
+                    self._open_locked(f"最近 {len(self._results)} 次调用失败率 {error_rate:.0%}")
+
+    def on_ignored(self):
+        """调用以与服务商健康无关的原因结束（如内容拦截、参数错误），只释放探测名额"""
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._probes_in_flight > 0:
+                self._probes_in_flight -= 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """获取熔断器当前状态"""
+        with self._lock:
+            state = self._current_state_locked()
+            failures = self._results.count(False)
+            return {
+                "state": state,
+                "retry_after": round(max(0.0, self.open_seconds - (time.monotonic() - self._opened_at)), 1)
+                if state == self.OPEN else 0,
+                "consecutive_failures": self._consecutive_failures,
+                "recent_requests": len(self._results),
+                "recent_error_rate": round(failures / len(self._results), 2) if self._results else 0,
+                "opens": self.opens,
+                "rejected": self.rejected,
+            }
+
+
+# 熔断器注册表：(类别, 服务商名称) -> 熔断器，类别为 image 或 text
+_breakers: Dict[tuple, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(provider_name: str, category: str = "image", provider_config: Optional[Dict] = None) -> CircuitBreaker:
+    """
+    获取服务商的熔断器
+
+    Args:
+        provider_name: 服务商名称
+        category: 服务商类别（image 或 text）
+        provider_config: 服务商配置；传入时按配置（重新）设置熔断参数：
+            - breaker_failure_threshold: 连续失败多少次后熔断（默认 5）
+            - breaker_error_rate: 失败率阈值（默认 0.5）
+            - breaker_window: 计算失败率的最近调用次数（默认 20）
+            - breaker_min_requests: 按失败率判断所需的最少调用次数（默认 10）
+            - breaker_open_seconds: 熔断持续时间（默认 30 秒）
+            - breaker_half_open_probes: 半开状态的探测请求数（默认 1）
+
+    Returns:
+        熔断器实例
+    """
+    key = (category, provider_name)
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(provider_name)
+            _breakers[key] = breaker
+
+    if provider_config is not None:
+        breaker.configure(
+            failure_threshold=provider_config.get('breaker_failure_threshold') or 5,
+            error_rate_threshold=provider_config.get('breaker_error_rate') or 0.5,
+            window=provider_config.get('breaker_window') or 20,
+            min_requests=provider_config.get('breaker_min_requests') or 10,
+            open_seconds=provider_config.get('breaker_open_seconds') or 30,
+            half_open_probes=provider_config.get('breaker_half_open_probes') or 1,
+        )
+    return breaker
+
+
+def get_breaker_stats() -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """获取所有熔断器的状态，按类别分组"""
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    stats: Dict[str, Dict[str, Dict[str, Any]]] = {"image": {}, "text": {}}
+    for (category, name), breaker in breakers.items():
+        stats.setdefault(category, {})[name] = breaker.snapshot()
+    return stats
@@ -0,0 +1,250 @@
+"""任务截止时间与取消（从 HTTP 请求一直传递到服务商调用）"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Awaitable, Callable, List, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 所有截止时间错误信息中都包含该标记，便于在只有错误文本的地方（如 SSE 事件）识别
+DEADLINE_EXCEEDED_MARKER = "deadline exceeded"
+# 取消错误信息中的标记
+CANCELLED_MARKER = "cancelled"
+
+
+class DeadlineExceededError(Exception):
+    """任务已超过截止时间，剩余时间不足以完成本次调用"""
+
+
+class TaskCancelledError(Exception):
+    """任务已被取消（调用了取消接口，或客户端离开后不再需要结果）"""
+
+
+def is_deadline_exceeded(error_message: Optional[str]) -> bool:
+    """判断错误信息是否由截止时间引起"""
+    return bool(error_message) and DEADLINE_EXCEEDED_MARKER in error_message
+
+
+def is_cancelled(error_message: Optional[str]) -> bool:
+    """判断错误信息是否由任务取消引起"""
+    return bool(error_message) and f"({CANCELLED_MARKER})" in error_message
+
+
+class Deadline:
+    """
+    任务或请求的截止时间
+
+    在请求入口创建，随任务上下文传递到每一次 generate_image / generate_text 调用。
+    超时时间和重试等待都按剩余时间收缩，剩余时间不足时直接失败，
+    而不是在客户端（或 Vercel 的 maxDuration）早已断开之后继续占用服务商配额。
+
+    截止时间同时是任务的取消令牌：cancel() 之后，排队中的页面立即丢弃，
+    执行中的页面在下一个检查点（发起调用前、重试等待中、保存图片前）中止。
+    """
+
+    # 剩余时间少于该值时，不再发起新的服务商调用
+    MIN_CALL_SECONDS = 1.0
+
+    def __init__(self, seconds: Optional[float] = None):
+        """
+        初始化截止时间
+
+        Args:
+            seconds: 从现在起允许的总时长（秒）；None 或 <= 0 表示不限制
+        """
+        self.seconds = seconds if seconds and seconds > 0 else None
+        self.expires_at = time.monotonic() + self.seconds if self.seconds else None
+        self.cancel_reason = ""
+        self._cancelled = threading.Event()
+        self._cancel_callbacks: List[Callable[[], None]] = []
+        self._cancel_lock = threading.Lock()
+
+    @classmethod
+    def none(cls) -> "Deadline":
+        """不限制时间的截止时间"""
+        return cls(None)
+
+    @property
+    def bounded(self) -> bool:
+        """是否设置了截止时间"""
+        return self.expires_at is not None
+
+    def remaining(self) -> Optional[float]:
+        """剩余秒数；不限制时返回 None"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        """剩余时间是否已不足以发起一次调用"""
+        remaining = self.remaining()
+        return remaining is not None and remaining < self.MIN_CALL_SECONDS
+
+    def check(self, what: str = "请求"):
+        """
+        任务已取消时抛出 TaskCancelledError，剩余时间不足时抛出 DeadlineExceededError
+
+        Args:
+            what: 被中止的操作（用于错误信息）
+        """
+        self.check_cancelled(what)
+        if self.expired():
+            raise self.error(what)
+
+    @property
+    def cancelled(self) -> bool:
+        """任务是否已被取消"""
+        return self._cancelled.is_set()
+
+    def cancel(self, reason: str = "任务已取消"):
+        """
+        取消任务（重复调用无效）
+
+        Args:
+            reason: 取消原因（用于错误信息）
+        """
+        with self._cancel_lock:
+            if self._cancelled.is_set():
+                return
+            self.cancel_reason = reason
+            self._cancelled.set()
+            callbacks = list(self._cancel_callbacks)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"取消回调执行失败: {e}")
+
+    def add_cancel_callback(self, callback: Callable[[], None]):
+        """登记取消时执行的回调（已取消时立即执行）"""
+        with self._cancel_lock:
+            if not self._cancelled.is_set():
+                self._cancel_callbacks.append(callback)
+                return
+        callback()
+
+    def remove_cancel_callback(self, callback: Callable[[], None]):
+        """移除取消回调"""
+        with self._cancel_lock:
+            if callback in self._cancel_callbacks:
+                self._cancel_callbacks.remove(callback)
+
+    def cancelled_error(self, what: str = "请求") -> TaskCancelledError:
+        """构造取消错误"""
+        return TaskCancelledError(f"{what}已取消 ({CANCELLED_MARKER})：{self.cancel_reason}")
+
+    def check_cancelled(self, what: str = "请求"):
+        """任务已取消时抛出 TaskCancelledError"""
+        if self._cancelled.is_set():
+            raise self.cancelled_error(what)
+
+    def sleep(self, seconds: float, what: str = "重试等待"):
+        """
+        等待 seconds 秒，期间任务被取消时立即抛出 TaskCancelledError
+
+        Args:
+            seconds: 等待时长（秒）
+            what: 被中止的操作（用于错误信息）
+        """
+        if self._cancelled.wait(max(0.0, seconds)):
+            raise self.cancelled_error(what)
+
+    async def async_sleep(self, seconds: float, what: str = "重试等待"):
+        """
+        等待 seconds 秒（协程版本，不占用线程），期间任务被取消时立即抛出 TaskCancelledError
+
+        Args:
+            seconds: 等待时长（秒）
+            what: 被中止的操作（用于错误信息）
+        """
+        loop = asyncio.get_running_loop()
+        woken = loop.create_future()
+
+        def wake():
+            # 取消可能发生在任意线程
+            loop.call_soon_threadsafe(lambda: woken.done() or woken.set_result(None))
+
+        self.add_cancel_callback(wake)
+        try:
+            await asyncio.wait_for(woken, timeout=max(0.0, seconds))
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.remove_cancel_callback(wake)
+        self.check_cancelled(what)
+
+    async def guard(self, awaitable: Awaitable[T], what: str = "请求") -> T:
+        """
+        在截止时间和取消令牌的约束下等待协程
+
+        协程版本的调用可以随时中止：任务被取消时立即取消协程（包括正在等待服务商
+        响应的请求）并抛出 TaskCancelledError，超过截止时间时抛出 DeadlineExceededError，
+        不必等到下一个检查点。
+
+        Args:
+            awaitable: 要等待的协程
+            what: 被中止的操作（用于错误信息）
+
+        Returns:
+            协程的返回值
+        """
+        loop = asyncio.get_running_loop()
+        task = asyncio.ensure_future(awaitable)
+
+        def abort():
+            loop.call_soon_threadsafe(task.cancel)
+
+        self.add_cancel_callback(abort)
+        try:
+            return await asyncio.wait_for(task, timeout=self.remaining())
+        except asyncio.TimeoutError as e:
+            if task.cancelled():
+                raise self.error(what) from e
+            raise
+        except asyncio.CancelledError:
+            if self.cancelled and task.cancelled():
+                raise self.cancelled_error(what) from None
+            raise
+        finally:
+            self.remove_cancel_callback(abort)
+
+    def error(self, what: str = "请求") -> DeadlineExceededError:
+        """构造截止时间错误"""
+        total = f"，总时长 {self.seconds:g} 秒" if self.seconds else ""
+        return DeadlineExceededError(
+            f"{what}已超过截止时间 ({DEADLINE_EXCEEDED_MARKER}{total})。\n"
+            "建议：减少页数后重试，或单独重试失败的页面"
+        )
+
+    def timeout(self, default: float, what: str = "请求") -> float:
+        """
+        计算本次调用可用的超时时间
+
+        Args:
+            default: 未设置截止时间时使用的超时时间（秒）
+            what: 被中止的操作（用于错误信息）
+
+        Returns:
+            min(default, 剩余时间)
+
+        Raises:
+            DeadlineExceededError: 剩余时间不足
+        """
+        self.check(what)
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        return min(default, remaining)
+
+    def allows_wait(self, seconds: float) -> bool:
+        """等待 seconds 秒之后是否还有时间发起调用"""
+        remaining = self.remaining()
+        return remaining is None or remaining - seconds >= self.MIN_CALL_SECONDS
+
+
+def resolve_deadline(deadline: Optional[Deadline]) -> Deadline:
+    """未传入截止时间时返回不限制的截止时间"""
+    return deadline if deadline is not None else Deadline.none()
@@ -0,0 +1,395 @@
+"""服务商流量控制（自适应并发、限流冷却）"""
+import asyncio
+import logging
+import math
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveLimiter:
+    """
+    基于 AIMD（加性增、乘性减）的自适应并发限制器
+
+    连续成功若干次后并发上限 +1；服务商返回 429 / RESOURCE_EXHAUSTED 时
+    并发上限按比例下调。同一轮并发中多个请求同时被限流只会下调一次：
+    在上一次下调之前发出的请求，其限流反馈会被忽略。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial: int = 1,
+        min_limit: int = 1,
+        max_limit: int = 15,
+        increase_after: int = 5,
+        decrease_factor: float = 0.5
+    ):
+        """
+        初始化限制器
+
+        Args:
+            name: 服务商名称
+            initial: 初始并发上限
+            min_limit: 并发上限的下界
+            max_limit: 并发上限的上界
+            increase_after: 连续成功多少次后并发上限 +1
+            decrease_factor: 遇到限流时并发上限乘以该系数
+        """
+        self.name = name
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[], None]] = []
+
+        self.min_limit = 1
+        self.max_limit = 1
+        self.increase_after = 1
+        self.decrease_factor = 0.5
+        self._limit = 1.0
+        self._successes = 0
+        self._last_decrease_at = 0.0
+
+        self.total_successes = 0
+        self.total_rate_limited = 0
+        self.increases = 0
+        self.decreases = 0
+
+        self.configure(initial, min_limit, max_limit, increase_after, decrease_factor)
+
+    def configure(
+        self,
+        initial: int,
+        min_limit: int = 1,
+        max_limit: int = 15,
+        increase_after: int = 5,
+        decrease_factor: float = 0.5
+    ):
+        """更新限制器参数（配置变更时调用，当前上限会被重置为 initial）"""
+        with self._lock:
+            self.min_limit = max(1, int(min_limit))
+            self.max_limit = max(self.min_limit, int(max_limit))
+            self.increase_after = max(1, int(increase_after))
+            self.decrease_factor = min(max(float(decrease_factor), 0.1), 0.9)
+            self._limit = float(min(max(int(initial), self.min_limit), self.max_limit))
+            self._successes = 0
+        self._notify()
+
+    @property
+    def limit(self) -> int:
+        """当前允许的并发上限"""
+        return int(self._limit)
+
+    def add_listener(self, callback: Callable[[], None]):
+        """注册并发上限变化时的回调（回调在限制器锁外执行）"""
+        with self._lock:
+            if callback not in self._listeners:
+                self._listeners.append(callback)
+
+    def _notify(self):
+        for callback in list(self._listeners):
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"并发上限变更回调执行失败: {e}")
+
+    def on_success(self):
+        """记录一次成功调用，连续成功足够次数后加性增加并发上限"""
+        changed = False
+        with self._lock:
+            self.total_successes += 1
+            self._successes += 1
+            if self._successes >= self.increase_after and self._limit < self.max_limit:
+                self._limit = min(self._limit + 1, float(self.max_limit))
+                self._successes = 0
+                self.increases += 1
+                changed = True
+        if changed:
+            logger.info(f"服务商 [{self.name}] 并发上限提升至 {self.limit}")
+            self._notify()
+
+    def on_rate_limited(self, started_at: Optional[float] = None):
+        """
+        记录一次限流，乘性降低并发上限
+
+        Args:
+            started_at: 被限流请求的发出时间（time.monotonic()）。
+                早于上一次下调的请求不再重复下调。
+        """
+        changed = False
+        with self._lock:
+            self.total_rate_limited += 1
+            self._successes = 0
+            if started_at is not None and started_at < self._last_decrease_at:
+                return
+            new_limit = max(float(self.min_limit), math.floor(self._limit * self.decrease_factor))
+            self._last_decrease_at = time.monotonic()
+            if new_limit < self._limit:
+                self._limit = new_limit
+                self.decreases += 1
+                changed = True
+        if changed:
+            logger.warning(f"服务商 [{self.name}] 触发限流，并发上限降低至 {self.limit}")
+            self._notify()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """获取限制器当前状态"""
+        with self._lock:
+            return {
+                "limit": int(self._limit),
+                "min_limit": self.min_limit,
+                "max_limit": self.max_limit,
+                "total_successes": self.total_successes,
+                "total_rate_limited": self.total_rate_limited,
+                "increases": self.increases,
+                "decreases": self.decreases,
+            }
+
+
+class ProviderCooldown:
+    """
+    服务商级共享的限流冷却闸门
+
+    任意线程遇到限流时触发冷却窗口，窗口内所有线程对该服务商的调用都在闸门处等待，
+    而不是各自计算退避时间继续发送注定失败的请求。窗口结束后等待者按固定间隔
+    依次放行，避免同一时刻再次涌向服务商。
+    """
+
+    def __init__(self, name: str, stagger: float = 0.5):
+        """
+        初始化冷却闸门
+
+        Args:
+            name: 服务商名称
+            stagger: 窗口结束后相邻两个等待者的放行间隔（秒）
+        """
+        self.name = name
+        self.stagger = stagger
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[], None]] = []
+        self._until = 0.0
+        self._next_slot = 0.0
+
+        self.triggers = 0
+        self.waits = 0
+
+    def add_listener(self, callback: Callable[[], None]):
+        """注册冷却窗口变化时的回调（回调在闸门锁外执行）"""
+        with self._lock:
+            if callback not in self._listeners:
+                self._listeners.append(callback)
+
+    def trigger(self, seconds: float):
+        """
+        开启（或延长）冷却窗口
+
+        Args:
+            seconds: 从现在起需要暂停调用的秒数
+        """
+        with self._lock:
+            until = time.monotonic() + max(0.0, seconds)
+            if until <= self._until:
+                return
+            self._until = until
+            self._next_slot = until
+            self.triggers += 1
+        logger.warning(f"服务商 [{self.name}] 进入限流冷却，{seconds:.1f}秒内暂停调用")
+        for callback in list(self._listeners):
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"冷却窗口变更回调执行失败: {e}")
+
+    def remaining(self) -> float:
+        """冷却窗口剩余秒数（包括窗口结束后的错峰放行阶段）"""
+        with self._lock:
+            return max(0.0, max(self._until, self._next_slot) - time.monotonic())
+
+    def wait(self) -> float:
+        """
+        在闸门处等待冷却窗口结束，并按错峰顺序放行
+
+        Returns:
+            实际等待的秒数
+        """
+        waited = 0.0
+        slot = None
+        while True:
+            slot, delay = self._next_wait(slot)
+            if delay is None:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+    async def async_wait(self) -> float:
+        """在闸门处等待（协程版本，等待期间不占用线程）"""
+        waited = 0.0
+        slot = None
+        while True:
+            slot, delay = self._next_wait(slot)
+            if delay is None:
+                return waited
+            await asyncio.sleep(delay)
+            waited += delay
+
+    def _next_wait(self, slot: Optional[float]):
+        """
+        计算下一段等待
+
+        Args:
+            slot: 已领取的放行时刻（首次到达时为 None）
+
+        Returns:
+            (放行时刻, 需要等待的秒数)；可以放行时等待秒数为 None
+        """
+        with self._lock:
+            now = time.monotonic()
+            if slot is not None and slot >= self._until and now >= slot:
+                return slot, None
+            if slot is None or slot < self._until:
+                # 首次到达或等待期间窗口被延长：重新排队领取放行时刻
+                if slot is None and now >= self._until and now >= self._next_slot:
+                    return slot, None
+                slot = max(self._until, self._next_slot, now)
+                self._next_slot = slot + self.stagger
+                self.waits += 1
+            return slot, slot - now
+
+    def snapshot(self) -> Dict[str, Any]:
+        """获取闸门当前状态"""
+        remaining = self.remaining()
+        return {
+            "cooling_down": remaining > 0,
+            "remaining": round(remaining, 2),
+            "triggers": self.triggers,
+            "waits": self.waits,
+        }
+
+
+def parse_retry_after(value: Any) -> Optional[float]:
+    """
+    解析 Retry-After 头（秒数或 HTTP 日期）
+
+    Returns:
+        需要等待的秒数，无法解析时返回 None
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+# Google 配额错误中的 RetryInfo，例如 'retryDelay': '32s'
+_RETRY_DELAY_PATTERN = re.compile(r"retryDelay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s")
+
+
+def extract_retry_after(error: Exception) -> Optional[float]:
+    """
+    从服务商错误中提取建议的重试等待时间
+
+    依次尝试：错误对象上的 retry_after 属性、响应中的 Retry-After 头、
+    Google 配额错误的 RetryInfo.retryDelay。
+
+    Returns:
+        建议等待的秒数，没有提供时返回 None
+    """
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after is not None:
+        return retry_after
+
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if headers is not None:
+        retry_after = parse_retry_after(headers.get('Retry-After'))
+        if retry_after is not None:
+            return retry_after
+
+    match = _RETRY_DELAY_PATTERN.search(str(getattr(error, 'details', '') or error))
+    if match:
+        return float(match.group(1))
+    return None
+
+
+# 每个服务商一个限制器（进程级共享）
+_limiters: Dict[str, AdaptiveLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_adaptive_limiter(provider_name: str, provider_config: Optional[Dict] = None) -> AdaptiveLimiter:
+    """
+    获取服务商的自适应并发限制器
+
+    Args:
+        provider_name: 服务商名称
+        provider_config: 服务商配置；传入时按配置（重新）设置限制器参数：
+            - max_concurrent: 并发上限的上界（默认 15）
+            - min_concurrent: 并发上限的下界（默认 1）
+            - initial_concurrent: 初始并发上限（默认 high_concurrency 为 true 时取上界，否则取下界）
+            - concurrency_increase_after: 连续成功多少次后 +1（默认 5）
+            - concurrency_decrease_factor: 限流时的下调系数（默认 0.5）
+
+    Returns:
+        限制器实例
+    """
+    params = None
+    if provider_config is not None:
+        max_limit = int(provider_config.get('max_concurrent') or 15)
+        min_limit = int(provider_config.get('min_concurrent') or 1)
+        default_initial = max_limit if provider_config.get('high_concurrency', False) else min_limit
+        params = dict(
+            initial=int(provider_config.get('initial_concurrent') or default_initial),
+            min_limit=min_limit,
+            max_limit=max_limit,
+            increase_after=int(provider_config.get('concurrency_increase_after') or 5),
+            decrease_factor=float(provider_config.get('concurrency_decrease_factor') or 0.5),
+        )
+
+    with _limiters_lock:
+        limiter = _limiters.get(provider_name)
+        if limiter is None:
+            limiter = AdaptiveLimiter(provider_name, **(params or {}))
+            _limiters[provider_name] = limiter
+            return limiter
+
+    if params is not None:
+        limiter.configure(**params)
+    return limiter
+
+
+def get_limiter_stats() -> Dict[str, Dict[str, Any]]:
+    """获取所有服务商限制器的状态"""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {name: limiter.snapshot() for name, limiter in limiters.items()}
+
+
+# 每个服务商一个冷却闸门（进程级共享）
+_cooldowns: Dict[str, ProviderCooldown] = {}
+_cooldowns_lock = threading.Lock()
+
+
+def get_provider_cooldown(provider_name: str) -> ProviderCooldown:
+    """获取服务商的限流冷却闸门"""
+    with _cooldowns_lock:
+        cooldown = _cooldowns.get(provider_name)
+        if cooldown is None:
+            cooldown = ProviderCooldown(provider_name)
+            _cooldowns[provider_name] = cooldown
+        return cooldown
+
+
+def get_cooldown_stats() -> Dict[str, Dict[str, Any]]:
+    """获取所有服务商冷却闸门的状态"""
+    with _cooldowns_lock:
+        cooldowns = dict(_cooldowns)
+    return {name: cooldown.snapshot() for name, cooldown in cooldowns.items()}
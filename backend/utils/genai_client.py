@@ -4,6 +4,10 @@ import random
 from functools import wraps
 from google import genai
 from google.genai import types
+from .deadline import Deadline, DeadlineExceededError, resolve_deadline
+from .circuit_breaker import CircuitBreaker
+from .retry import with_circuit_breaker
+from .reference import ReferenceImage
 
 
 def retry_on_429(max_retries=3, base_delay=2):
@@ -11,6 +15,8 @@ def retry_on_429(max_retries=3, base_delay=2):
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
+            # 调用参数中的 deadline 同时约束重试等待
+            deadline = resolve_deadline(kwargs.get('deadline'))
             for attempt in range(max_retries):
                 try:
                     return func(*args, **kwargs)
@@ -20,6 +26,10 @@ def retry_on_429(max_retries=3, base_delay=2):
                         if attempt < max_retries - 1:
                             # 指数退避 + 随机抖动
                             wait_time = (base_delay ** attempt) + random.uniform(0, 1)
+                            if not deadline.allows_wait(wait_time):
+                                raise DeadlineExceededError(
+                                    f"GenAI API 剩余时间不足以重试 (deadline exceeded)。\n最后错误: {e}"
+                                ) from e
                             print(f"[重试] 遇到资源限制，{wait_time:.1f}秒后重试 (尝试 {attempt + 2}/{max_retries})")
                             time.sleep(wait_time)
                             continue
@@ -40,8 +50,10 @@ def retry_on_429(max_retries=3, base_delay=2):
 class GenAIClient:
     """GenAI 客户端封装类（已弃用，请使用 GoogleGenAIGenerator）"""
 
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, circuit_breaker: CircuitBreaker = None):
         self.api_key = api_key
+        # 服务商熔断器（服务商故障时快速失败）
+        self.circuit_breaker = circuit_breaker
         if not self.api_key:
             raise ValueError(
                 "Google Cloud API Key 未配置。\n"
@@ -62,6 +74,7 @@ class GenAIClient:
         ]
 
     @retry_on_429(max_retries=3, base_delay=2)
+    @with_circuit_breaker
     def generate_text(
         self,
         prompt: str,
@@ -72,6 +85,7 @@ class GenAIClient:
         use_thinking: bool = False,
         images: list = None,
         system_prompt: str = None,
+        deadline: Deadline = None,
         **kwargs
     ) -> str:
         """
@@ -84,8 +98,9 @@ class GenAIClient:
             max_output_tokens: 最大输出 token
             use_search: 是否使用搜索
             use_thinking: 是否启用思考模式
-            images: 图片列表（暂不支持）
+            images: 图片列表（bytes 或预先编码的 ReferenceImage）
             system_prompt: 系统提示词（暂不支持）
+            deadline: 请求截止时间（请求超时按剩余时间收缩）
 
         Returns:
             生成的文本
@@ -94,7 +109,9 @@ class GenAIClient:
 
         if images:
             for img_data in images:
-                if isinstance(img_data, bytes):
+                if isinstance(img_data, ReferenceImage):
+                    parts.append(img_data.genai_part)
+                elif isinstance(img_data, bytes):
                     parts.append(types.Part(
                         inline_data=types.Blob(
                             mime_type="image/png",
@@ -114,6 +131,10 @@ class GenAIClient:
             "top_p": 0.95,
             "max_output_tokens": max_output_tokens,
             "safety_settings": self.default_safety_settings,
+            # 请求超时（毫秒），按剩余时间收缩
+            "http_options": types.HttpOptions(
+                timeout=int(resolve_deadline(deadline).timeout(300, "GenAI 文本请求") * 1000)
+            ),
         }
 
         # 添加搜索工具
@@ -0,0 +1,322 @@
+"""对冲请求（降低图片生成的长尾延迟）"""
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Any, Callable, Dict, List, Optional
+
+from .retry import RetryBudget, get_retry_policy
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyTracker:
+    """记录服务商最近若干次成功调用的耗时"""
+
+    def __init__(self, window: int = 200):
+        """
+        初始化耗时记录
+
+        Args:
+            window: 保留最近多少次调用的耗时
+        """
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        """记录一次成功调用的耗时"""
+        with self._lock:
+            self._samples.append(seconds)
+
+    def count(self) -> int:
+        """已记录的样本数"""
+        with self._lock:
+            return len(self._samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        计算耗时分位数
+
+        Args:
+            p: 分位（0-100）
+
+        Returns:
+            分位数对应的耗时（秒），没有样本时返回 None
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        rank = min(len(samples), max(1, math.ceil(p / 100.0 * len(samples))))
+        return samples[rank - 1]
+
+
+class RequestHedger:
+    """
+    服务商级的对冲请求控制
+
+    由服务商重试策略在每一次尝试上调用（退避和冷却等待不计入耗时，也不会被对冲）。
+    启用后，如果一次尝试超过该服务商最近耗时的指定分位数仍未返回，就再发出一个
+    相同的请求，取先成功的结果，另一个请求的结果直接丢弃（线程无法中途取消）。
+    对冲请求占用的配额由令牌桶限制在总请求数的一小部分以内；并发上只使用共享执行器中
+    该服务商通道的空闲名额（slots），通道已满或有页面排队时不对冲。
+    """
+
+    def __init__(
+        self,
+        provider_name: str,
+        enabled: bool = False,
+        percentile: float = 95.0,
+        max_ratio: float = 0.05,
+        min_samples: int = 20
+    ):
+        """
+        初始化对冲控制
+
+        Args:
+            provider_name: 服务商名称
+            enabled: 是否启用对冲请求
+            percentile: 超过最近耗时的哪个分位数后发出对冲请求
+            max_ratio: 对冲请求占总请求数的最大比例
+            min_samples: 至少积累多少次成功调用的耗时后才开始对冲
+        """
+        self.provider_name = provider_name
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.latency = LatencyTracker()
+        self.budget = RetryBudget(ratio=max_ratio, capacity=3.0, min_per_second=0.0)
+        # 服务商通道的额外调用名额（由服务商池设置为共享执行器的 ProviderSlots，未设置时不对冲）
+        self.slots = None
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.skipped = 0
+        self.no_slot = 0
+
+    def _release_when_done(self, futures: List[Future], is_async: bool = False):
+        """两个请求都结束后归还对冲占用的名额（输掉的请求仍占用服务商的连接）"""
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def on_done(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            self.slots.release(is_async)
+
+        for future in futures:
+            future.add_done_callback(on_done)
+
+    def _reserve_hedge(self, is_async: bool = False) -> bool:
+        """为对冲请求占用通道的空闲名额并取出对冲预算，任一不满足时不对冲"""
+        if not self.slots.try_reserve(is_async):
+            with self._lock:
+                self.no_slot += 1
+            return False
+        if not self.budget.try_acquire():
+            self.slots.release(is_async)
+            with self._lock:
+                self.skipped += 1
+            return False
+        with self._lock:
+            self.hedged += 1
+        return True
+
+    def _timed(self, func: Callable, *args, **kwargs) -> Any:
+        """执行调用并记录成功调用的耗时"""
+        started_at = time.monotonic()
+        result = func(*args, **kwargs)
+        self.latency.record(time.monotonic() - started_at)
+        return result
+
+    def hedge_delay(self) -> Optional[float]:
+        """发出对冲请求前的等待时间；样本不足时返回 None（不对冲）"""
+        if self.latency.count() < self.min_samples:
+            return None
+        return self.latency.percentile(self.percentile)
+
+    def call(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        调用服务商，必要时发出对冲请求
+
+        首个请求在执行器的辅助线程中执行，调用方线程只负责等待，仍只占用调用方自身的
+        执行器名额（辅助线程已满时直接执行，不对冲）；对冲请求占用服务商通道的一个空闲名额
+        在共享线程池中执行，两个请求都结束后归还。
+
+        Args:
+            func: 单次服务商调用
+            *args, **kwargs: 调用参数
+
+        Returns:
+            先成功返回的结果
+
+        Raises:
+            两个请求都失败时，抛出首个请求的错误
+        """
+        self.budget.record_request()
+        with self._lock:
+            self.requests += 1
+
+        delay = self.hedge_delay() if self.enabled and self.slots is not None else None
+        if delay is None:
+            return self._timed(func, *args, **kwargs)
+
+        primary = self.slots.run_primary(self._timed, func, *args, **kwargs)
+        if primary is None:
+            with self._lock:
+                self.no_slot += 1
+            return self._timed(func, *args, **kwargs)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._reserve_hedge():
+            return primary.result()
+
+        logger.info(f"服务商 [{self.provider_name}] 请求超过 p{self.percentile:g} 耗时 ({delay:.1f}秒)，发出对冲请求")
+        try:
+            hedge = self.slots.submit(self._timed, func, *args, **kwargs)
+        except RuntimeError:
+            # 执行器已关闭
+            self.slots.release()
+            return primary.result()
+        self._release_when_done([primary, hedge])
+
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return future.result()
+
+        # 两个请求都失败：以首个请求的错误为准
+        return primary.result()
+
+    async def _atimed(self, func: Callable, *args, **kwargs) -> Any:
+        """_timed 的协程版本"""
+        started_at = time.monotonic()
+        result = await func(*args, **kwargs)
+        self.latency.record(time.monotonic() - started_at)
+        return result
+
+    async def acall(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        调用服务商，必要时发出对冲请求（协程版本：func 为协程函数）
+
+        与 call() 不同，先成功的请求返回后，另一个请求会被立即取消，不再占用连接；
+        对冲请求占用的通道名额在它结束（或被取消）时归还。
+
+        Args:
+            func: 服务商调用
+            *args, **kwargs: 调用参数
+
+        Returns:
+            先成功返回的结果
+
+        Raises:
+            两个请求都失败时，抛出首个请求的错误
+        """
+        self.budget.record_request()
+        with self._lock:
+            self.requests += 1
+
+        delay = self.hedge_delay() if self.enabled and self.slots is not None else None
+        if delay is None:
+            return await self._atimed(func, *args, **kwargs)
+
+        primary = asyncio.ensure_future(self._atimed(func, *args, **kwargs))
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return primary.result()
+
+            if not self._reserve_hedge(is_async=True):
+                return await primary
+
+            logger.info(f"服务商 [{self.provider_name}] 请求超过 p{self.percentile:g} 耗时 ({delay:.1f}秒)，发出对冲请求")
+            hedge = asyncio.ensure_future(self._atimed(func, *args, **kwargs))
+            hedge.add_done_callback(lambda _: self.slots.release(is_async=True))
+            pending.add(hedge)
+
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        if future is hedge:
+                            with self._lock:
+                                self.hedge_wins += 1
+                        return future.result()
+
+            # 两个请求都失败：以首个请求的错误为准
+            return primary.result()
+        finally:
+            # 取消另一个仍在进行的请求（或调用方被取消时的全部请求）
+            for future in pending:
+                future.cancel()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """获取对冲请求状态"""
+        delay = self.hedge_delay()
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "percentile": self.percentile,
+                "hedge_delay": round(delay, 2) if delay is not None else None,
+                "samples": self.latency.count(),
+                "requests": self.requests,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "skipped": self.skipped,
+                "no_slot": self.no_slot,
+                "budget": self.budget.snapshot(),
+            }
+
+
+# 每个服务商一个对冲控制（进程级共享）
+_hedgers: Dict[str, RequestHedger] = {}
+_hedgers_lock = threading.Lock()
+
+
+def get_request_hedger(provider_name: str, provider_config: Optional[Dict] = None) -> RequestHedger:
+    """
+    获取服务商的对冲请求控制（同时交给该服务商的重试策略，在每次尝试上使用）
+
+    Args:
+        provider_name: 服务商名称
+        provider_config: 服务商配置；传入时按配置（重新）设置参数：
+            - hedge_requests: 是否启用对冲请求（默认 false）
+            - hedge_percentile: 超过最近耗时的哪个分位数后对冲（默认 95）
+            - hedge_max_ratio: 对冲请求占总请求数的最大比例（默认 0.05）
+            - hedge_min_samples: 开始对冲前至少需要的耗时样本数（默认 20）
+
+    Returns:
+        对冲控制实例
+    """
+    with _hedgers_lock:
+        hedger = _hedgers.get(provider_name)
+        if hedger is None:
+            hedger = RequestHedger(provider_name)
+            _hedgers[provider_name] = hedger
+
+        if provider_config is not None:
+            hedger.enabled = bool(provider_config.get('hedge_requests', False))
+            hedger.percentile = min(99.9, max(50.0, float(provider_config.get('hedge_percentile') or 95)))
+            hedger.budget.ratio = float(provider_config.get('hedge_max_ratio') or 0.05)
+            hedger.min_samples = max(1, int(provider_config.get('hedge_min_samples') or 20))
+    get_retry_policy(provider_name).hedger = hedger
+    return hedger
+
+
+def get_hedge_stats() -> Dict[str, Dict[str, Any]]:
+    """获取所有服务商对冲请求的状态"""
+    with _hedgers_lock:
+        hedgers = dict(_hedgers)
+    return {name: hedger.snapshot() for name, hedger in hedgers.items()}
@@ -1,7 +1,106 @@
 """图片压缩工具"""
+import hashlib
 import io
+import threading
+from collections import OrderedDict
 from PIL import Image
-from typing import Optional
+from typing import Any, Dict, Optional, Tuple
+
+
+class CompressionCache:
+    """
+    按内容哈希缓存压缩结果（LRU，按字节数限制大小）
+
+    同一个任务会反复压缩同样的图片：生成任务压缩用户参考图和封面图，各生成器
+    每生成一页又压缩一次参考图。相同输入（内容哈希 + 压缩参数）的压缩结果直接复用，
+    不再重复解码、编码（PIL 编解码期间持有 GIL，会拖慢其他生成线程）。
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, max_entries: int = 256):
+        """
+        初始化压缩缓存
+
+        Args:
+            max_bytes: 缓存的压缩结果总字节数上限
+            max_entries: 最多缓存的结果数
+        """
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.hit_input_bytes = 0
+        self.evicted = 0
+
+    @staticmethod
+    def make_key(image_data: bytes, *params: Any) -> Tuple:
+        """缓存键：图片内容哈希 + 压缩参数"""
+        return (hashlib.blake2b(image_data, digest_size=16).digest(), *params)
+
+    def get(self, key: Tuple, input_size: int) -> Optional[bytes]:
+        """读取缓存的压缩结果，不存在时返回 None"""
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.hit_input_bytes += input_size
+            return data
+
+    def put(self, key: Tuple, data: bytes):
+        """缓存压缩结果（超出限制时淘汰最久未使用的结果）"""
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._entries[key] = data
+            self._bytes += len(data)
+            while self._entries and (self._bytes > self.max_bytes or len(self._entries) > self.max_entries):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evicted += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存状态"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else None,
+                "hit_input_bytes": self.hit_input_bytes,
+                "evicted": self.evicted,
+            }
+
+
+# 全局压缩缓存
+_cache_instance: Optional[CompressionCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_compression_cache() -> CompressionCache:
+    """获取全局压缩缓存"""
+    global _cache_instance
+    with _cache_lock:
+        if _cache_instance is None:
+            from backend.config import Config
+            _cache_instance = CompressionCache(max_bytes=int(Config.IMAGE_COMPRESS_CACHE_MB * 1024 * 1024))
+        return _cache_instance
+
+
+def get_compression_cache_stats() -> Dict[str, Any]:
+    """获取压缩缓存状态"""
+    return get_compression_cache().get_stats()
 
 
 def compress_image(
@@ -9,10 +108,11 @@ def compress_image(
     max_size_kb: int = 200,  # 默认200KB
     quality_start: int = 85,
     quality_min: int = 20,
-    max_dimension: int = 2048
+    max_dimension: int = 2048,
+    cache: bool = True
 ) -> bytes:
     """
-    压缩图片到指定大小以内
+    压缩图片到指定大小以内（相同输入的压缩结果从缓存返回）
 
     Args:
         image_data: 原始图片数据
@@ -20,16 +120,37 @@ def compress_image(
         quality_start: 起始压缩质量（1-100）
         quality_min: 最低压缩质量（1-100）
         max_dimension: 最大边长（像素）
+        cache: 是否使用压缩缓存（只压缩一次的图片，如生成结果的缩略图，不必占用缓存）
 
     Returns:
         压缩后的图片数据
     """
-    max_size_bytes = max_size_kb * 1024
-
     # 如果原图已经小于目标大小，直接返回
-    if len(image_data) <= max_size_bytes:
+    if len(image_data) <= max_size_kb * 1024:
         return image_data
 
+    compression_cache = get_compression_cache()
+    if not cache or not compression_cache.max_bytes:
+        return _compress(image_data, max_size_kb, quality_start, quality_min, max_dimension)
+
+    key = compression_cache.make_key(image_data, max_size_kb, quality_start, quality_min, max_dimension)
+    compressed_data = compression_cache.get(key, len(image_data))
+    if compressed_data is None:
+        compressed_data = _compress(image_data, max_size_kb, quality_start, quality_min, max_dimension)
+        compression_cache.put(key, compressed_data)
+    return compressed_data
+
+
+def _compress(
+    image_data: bytes,
+    max_size_kb: int,
+    quality_start: int,
+    quality_min: int,
+    max_dimension: int
+) -> bytes:
+    """实际执行压缩（参数同 compress_image）"""
+    max_size_bytes = max_size_kb * 1024
+
     try:
         # 打开图片
         img = Image.open(io.BytesIO(image_data))
@@ -0,0 +1,216 @@
+"""流式解析图片接口的 b64_json 响应（边读取边解码，不在内存中保留完整的 base64 字符串）"""
+import base64
+import binascii
+import io
+import json
+import re
+from typing import Any, Optional, Tuple
+
+from .deadline import Deadline, resolve_deadline
+
+# 响应中 b64_json 字段值的起始位置
+_B64_FIELD = re.compile(rb'"b64_json"\s*:\s*"')
+# 字段名可能被拆到两个数据块中，查找时回看的字节数
+_FIELD_LOOKBEHIND = 32
+# Data URI 前缀（data:image/png;base64,）的最大长度
+_MAX_PREFIX = 256
+# 除图片数据外保留的响应内容上限（用于解析其他字段和错误信息）
+_MAX_SKELETON = 1024 * 1024
+
+
+class B64JsonImageDecoder:
+    """
+    增量解码 JSON 响应中第一个 b64_json 字段
+
+    按数据块喂入响应体：b64_json 字段的值（去掉可能的 Data URI 前缀）按 4 字符对齐
+    逐块解码到内存缓冲区，其余内容原样保留为“骨架”（字段值替换为空字符串），
+    仍然是合法的 JSON，可以据此读取 url 等其他字段。峰值内存约为最终图片大小，
+    而不是响应文本、解析后的 dict、切分后的字符串和解码结果同时存在。
+    """
+
+    _SEARCH, _PREFIX, _DATA, _TAIL = range(4)
+
+    def __init__(self):
+        self._state = self._SEARCH
+        self._skeleton = bytearray()
+        self._skeleton_truncated = False
+        self._pending = b""
+        self._image = io.BytesIO()
+
+    @property
+    def found(self) -> bool:
+        """是否已找到 b64_json 字段"""
+        return self._state != self._SEARCH
+
+    @property
+    def complete(self) -> bool:
+        """b64_json 字段是否已完整读取"""
+        return self._state == self._TAIL
+
+    def feed(self, chunk: bytes):
+        """
+        喂入一块响应数据
+
+        Args:
+            chunk: 响应体的下一段字节
+        """
+        while chunk:
+            if self._state == self._SEARCH:
+                chunk = self._feed_search(chunk)
+            elif self._state == self._PREFIX:
+                chunk = self._feed_prefix(chunk)
+            elif self._state == self._DATA:
+                chunk = self._feed_data(chunk)
+            else:
+                self._append_skeleton(chunk)
+                chunk = b""
+
+    def _append_skeleton(self, data: bytes):
+        if len(self._skeleton) + len(data) <= _MAX_SKELETON:
+            self._skeleton += data
+        else:
+            self._skeleton_truncated = True
+            if self._state == self._SEARCH:
+                # 只保留查找字段名需要的尾部
+                self._skeleton = (self._skeleton + data)[-_FIELD_LOOKBEHIND:]
+
+    def _feed_search(self, chunk: bytes) -> bytes:
+        # 先在骨架尾部 + 新数据块中查找（字段名可能被拆到两个数据块中），再追加到骨架：
+        # 骨架超出上限被截断时，数据块中的字段名不会在查找前被丢弃
+        tail = bytes(self._skeleton[-_FIELD_LOOKBEHIND:])
+        match = _B64_FIELD.search(tail + chunk)
+        if match is None:
+            self._append_skeleton(chunk)
+            return b""
+        # 骨架中只保留到开始引号，字段值之后的内容交给后续状态处理
+        consumed = match.end() - len(tail)
+        self._append_skeleton(chunk[:consumed])
+        self._state = self._PREFIX
+        return chunk[consumed:]
+
+    def _feed_prefix(self, chunk: bytes) -> bytes:
+        self._pending += chunk
+        if self._pending[:5] != b"data:"[:len(self._pending)]:
+            # 没有 Data URI 前缀
+            rest, self._pending = self._pending, b""
+            self._state = self._DATA
+            return rest
+        comma = self._pending.find(b",")
+        if comma == -1:
+            if len(self._pending) > _MAX_PREFIX or b'"' in self._pending:
+                raise ValueError("b64_json 字段的 Data URI 前缀格式错误")
+            return b""
+        rest, self._pending = self._pending[comma + 1:], b""
+        self._state = self._DATA
+        return rest
+
+    def _feed_data(self, chunk: bytes) -> bytes:
+        end = chunk.find(b'"')
+        data, rest = (chunk, b"") if end == -1 else (chunk[:end], chunk[end:])
+        data = self._pending + data
+        self._pending = b""
+
+        if end == -1 and data.endswith(b"\\"):
+            # 转义序列被拆到下一个数据块
+            self._pending, data = data[-1:], data[:-1]
+        if b"\\" in data:
+            # JSON 转义：\/ 还原为 /，\n、\r 为 base64 中的换行
+            data = data.replace(b"\\n", b"").replace(b"\\r", b"").replace(b"\\", b"")
+        data = data.replace(b"\n", b"").replace(b"\r", b"")
+
+        if end != -1 and len(data) % 4:
+            # 部分服务商省略了末尾的 = 填充
+            data += b"=" * (-len(data) % 4)
+        usable = len(data) - len(data) % 4
+        if usable:
+            try:
+                self._image.write(base64.b64decode(data[:usable]))
+            except binascii.Error as e:
+                raise ValueError(f"b64_json 字段不是有效的 base64 数据: {e}")
+        self._pending = data[usable:] + self._pending
+
+        if end != -1:
+            self._state = self._TAIL
+            self._skeleton += rest[:1]
+            return rest[1:]
+        return b""
+
+    def image(self) -> Optional[bytes]:
+        """解码得到的图片数据（未找到或未读取完整时为 None）"""
+        if not self.complete:
+            return None
+        # BytesIO.getvalue() 在缓冲区未被引用时直接返回内部的 bytes 对象，不再复制一份
+        return self._image.getvalue()
+
+    def skeleton(self) -> Optional[Any]:
+        """除图片数据外的响应 JSON（b64_json 为空字符串）；内容过大或不是合法 JSON 时为 None"""
+        if self._skeleton_truncated:
+            return None
+        try:
+            return json.loads(self._skeleton)
+        except ValueError:
+            return None
+
+    def preview(self, limit: int = 500) -> str:
+        """响应内容片段（用于错误信息）"""
+        return bytes(self._skeleton[:limit]).decode("utf-8", errors="replace")
+
+
+def read_b64_json_image(
+    response,
+    deadline: Optional[Deadline] = None,
+    what: str = "读取图片响应",
+    chunk_size: int = 256 * 1024
+) -> Tuple[Optional[bytes], Optional[Any], str]:
+    """
+    流式读取 requests 响应（需以 stream=True 发起），解码其中第一个 b64_json 字段
+
+    Args:
+        response: requests.Response
+        deadline: 截止时间（每读取一块检查一次，取消或超时时中止读取）
+        what: 操作名称（用于超时/取消的错误信息）
+        chunk_size: 每次读取的字节数
+
+    Returns:
+        (图片数据, 其余内容的 JSON, 响应片段)；没有 b64_json 字段时图片数据为 None
+    """
+    deadline = resolve_deadline(deadline)
+    decoder = B64JsonImageDecoder()
+    try:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            deadline.check(what)
+            if chunk:
+                decoder.feed(chunk)
+    finally:
+        response.close()
+    return decoder.image(), decoder.skeleton(), decoder.preview()
+
+
+async def aread_b64_json_image(
+    response,
+    deadline: Optional[Deadline] = None,
+    what: str = "读取图片响应",
+    chunk_size: int = 256 * 1024
+) -> Tuple[Optional[bytes], Optional[Any], str]:
+    """
+    read_b64_json_image 的协程版本（读取 httpx 的流式响应）
+
+    Args:
+        response: httpx.Response（需以 client.stream() 或 send(stream=True) 发起）
+        deadline: 截止时间（每读取一块检查一次，取消或超时时中止读取）
+        what: 操作名称（用于超时/取消的错误信息）
+        chunk_size: 每次读取的字节数
+
+    Returns:
+        (图片数据, 其余内容的 JSON, 响应片段)；没有 b64_json 字段时图片数据为 None
+    """
+    deadline = resolve_deadline(deadline)
+    decoder = B64JsonImageDecoder()
+    try:
+        async for chunk in response.aiter_bytes(chunk_size=chunk_size):
+            deadline.check(what)
+            if chunk:
+                decoder.feed(chunk)
+    finally:
+        await response.aclose()
+    return decoder.image(), decoder.skeleton(), decoder.preview()
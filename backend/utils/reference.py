@@ -0,0 +1,88 @@
+"""预编码的参考图（每个任务编码一次，各页面请求直接引用）"""
+import base64
+import threading
+from typing import Any, List, Optional
+
+
+class ReferenceImage:
+    """
+    一张已压缩的参考图及其请求编码
+
+    base64 Data URI 和 Google GenAI 的 Part 对象在第一次使用时生成并缓存，
+    同一任务的每一页、每次重试和对冲请求都引用同一份编码结果，不再重复分配
+    数 MB 的字符串。
+    """
+
+    __slots__ = ("data", "mime_type", "_data_uri", "_genai_part", "_lock")
+
+    def __init__(self, data: bytes, mime_type: str = "image/png"):
+        """
+        初始化参考图
+
+        Args:
+            data: 已压缩的图片数据
+            mime_type: 请求中声明的图片类型
+        """
+        self.data = data
+        self.mime_type = mime_type
+        self._data_uri: Optional[str] = None
+        self._genai_part: Any = None
+        self._lock = threading.Lock()
+
+    @property
+    def data_uri(self) -> str:
+        """base64 Data URI（Image API、OpenAI 兼容接口使用）"""
+        if self._data_uri is None:
+            with self._lock:
+                if self._data_uri is None:
+                    encoded = base64.b64encode(self.data).decode('utf-8')
+                    self._data_uri = f"data:{self.mime_type};base64,{encoded}"
+        return self._data_uri
+
+    @property
+    def genai_part(self) -> Any:
+        """Google GenAI 的 inline_data Part"""
+        if self._genai_part is None:
+            with self._lock:
+                if self._genai_part is None:
+                    from google.genai import types
+
+                    self._genai_part = types.Part(
+                        inline_data=types.Blob(mime_type=self.mime_type, data=self.data)
+                    )
+        return self._genai_part
+
+    def encoded_bytes(self) -> int:
+        """已缓存的编码结果占用的字节数（不含图片数据本身）"""
+        return len(self._data_uri) if self._data_uri is not None else 0
+
+
+class ReferenceBundle:
+    """
+    一个任务的参考图：用户上传的参考图和封面图
+
+    由任务上下文创建一次并在各页面之间共享，生成器从中取用已编码的请求片段。
+    """
+
+    __slots__ = ("user_images", "cover")
+
+    def __init__(self, user_images: Optional[List[ReferenceImage]] = None, cover: Optional[ReferenceImage] = None):
+        """
+        初始化参考图集合
+
+        Args:
+            user_images: 用户上传的参考图
+            cover: 封面图（不使用封面参考时为 None）
+        """
+        self.user_images = user_images or []
+        self.cover = cover
+
+    def all(self) -> List[ReferenceImage]:
+        """全部参考图：用户上传的参考图在前，封面图在后"""
+        return self.user_images + [self.cover] if self.cover is not None else list(self.user_images)
+
+    def __bool__(self) -> bool:
+        return bool(self.user_images) or self.cover is not None
+
+    def __len__(self) -> int:
+        return len(self.user_images) + (1 if self.cover is not None else 0)
@@ -0,0 +1,505 @@
+"""统一的服务商重试策略"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from functools import wraps
+from typing import Any, Callable, Dict, Optional
+
+import httpx
+import requests
+
+from .circuit_breaker import CircuitBreaker, CircuitOpenError, get_circuit_breaker
+from .deadline import Deadline, DeadlineExceededError, TaskCancelledError, resolve_deadline
+from .flow_control import ProviderCooldown, get_adaptive_limiter, get_provider_cooldown, extract_retry_after
+
+logger = logging.getLogger(__name__)
+
+
+class ErrorKind:
+    """服务商错误分类"""
+    RATE_LIMIT = "rate_limit"  # 429 / RESOURCE_EXHAUSTED
+    SERVER = "server"          # 5xx
+    TIMEOUT = "timeout"        # 请求超时
+    NETWORK = "network"        # 连接失败
+    SAFETY = "safety"          # 内容被安全策略拦截
+    CLIENT = "client"          # 其他 4xx（密钥、参数、模型错误等）
+    DEADLINE = "deadline"      # 任务剩余时间不足
+    CANCELLED = "cancelled"    # 任务已被取消
+    CIRCUIT_OPEN = "circuit_open"  # 服务商熔断中，请求未发出
+    UNKNOWN = "unknown"        # 无法识别的错误
+
+
+# 可以重试的错误类型；安全拦截和客户端错误重试也不会成功
+RETRYABLE_KINDS = {ErrorKind.RATE_LIMIT, ErrorKind.SERVER, ErrorKind.TIMEOUT, ErrorKind.NETWORK, ErrorKind.UNKNOWN}
+
+# 计入熔断器失败的错误类型（说明服务商本身不健康）；限流由冷却和自适应并发处理
+BREAKER_FAILURE_KINDS = {ErrorKind.SERVER, ErrorKind.TIMEOUT, ErrorKind.NETWORK, ErrorKind.UNKNOWN}
+
+_SAFETY_MARKERS = ("SAFETY", "PROHIBITED_CONTENT", "BLOCKLIST", "content_policy", "安全策略拦截")
+
+
+class ContentBlockedError(Exception):
+    """生成内容被服务商的安全策略拦截（重试无效）"""
+
+
+class RetryExhaustedError(Exception):
+    """重试次数或重试预算耗尽后仍失败"""
+
+    def __init__(self, message: str, last_error: Exception, kind: str):
+        super().__init__(message)
+        self.last_error = last_error
+        self.kind = kind
+
+
+def classify_error(error: Exception) -> str:
+    """
+    对服务商错误进行分类
+
+    Args:
+        error: 服务商调用抛出的异常
+
+    Returns:
+        ErrorKind 中的一种
+    """
+    if isinstance(error, RetryExhaustedError):
+        return error.kind
+    if isinstance(error, ContentBlockedError):
+        return ErrorKind.SAFETY
+    if isinstance(error, DeadlineExceededError):
+        return ErrorKind.DEADLINE
+    if isinstance(error, TaskCancelledError):
+        return ErrorKind.CANCELLED
+    if isinstance(error, CircuitOpenError):
+        return ErrorKind.CIRCUIT_OPEN
+    if isinstance(error, (requests.Timeout, httpx.TimeoutException, TimeoutError)):
+        return ErrorKind.TIMEOUT
+    if isinstance(error, (requests.ConnectionError, httpx.TransportError)):
+        return ErrorKind.NETWORK
+
+    error_str = str(error)
+    status = getattr(error, 'status_code', None) or getattr(error, 'code', None)
+    if not isinstance(status, int):
+        status = None
+
+    is_safety = any(marker in error_str for marker in _SAFETY_MARKERS)
+
+    if status is not None:
+        if status == 429:
+            return ErrorKind.RATE_LIMIT
+        if status == 408:
+            return ErrorKind.TIMEOUT
+        if status >= 500:
+            return ErrorKind.SERVER
+        if 400 <= status < 500:
+            return ErrorKind.SAFETY if is_safety else ErrorKind.CLIENT
+        if 200 <= status < 300:
+            # 请求成功但响应格式不符（接口不兼容或内容被过滤），服务商本身是健康的
+            return ErrorKind.SAFETY if is_safety else ErrorKind.CLIENT
+
+    lowered = error_str.lower()
+    if "RESOURCE_EXHAUSTED" in error_str or "429" in error_str or "rate limit" in lowered:
+        return ErrorKind.RATE_LIMIT
+    if is_safety:
+        return ErrorKind.SAFETY
+    if "timeout" in lowered or "timed out" in lowered:
+        return ErrorKind.TIMEOUT
+    return ErrorKind.UNKNOWN
+
+
+def is_provider_failure(error: Exception) -> bool:
+    """错误是否说明服务商本身不健康（计入熔断器失败）"""
+    return classify_error(error) in BREAKER_FAILURE_KINDS
+
+
+def call_with_breaker(breaker: CircuitBreaker, func: Callable, *args, **kwargs) -> Any:
+    """
+    经过熔断器进行一次服务商调用
+
+    服务商故障计入熔断器失败；内容拦截、参数错误、限流等与服务商健康无关的错误
+    不影响熔断状态。
+
+    Args:
+        breaker: 熔断器
+        func: 单次服务商调用
+        *args, **kwargs: 调用参数
+
+    Returns:
+        调用结果
+
+    Raises:
+        CircuitOpenError: 服务商熔断中
+    """
+    breaker.before_call()
+    try:
+        result = func(*args, **kwargs)
+    except Exception as e:
+        if is_provider_failure(e):
+            breaker.on_failure()
+        else:
+            breaker.on_ignored()
+        raise
+    breaker.on_success()
+    return result
+
+
+async def acall_with_breaker(breaker: CircuitBreaker, func: Callable, *args, **kwargs) -> Any:
+    """call_with_breaker 的协程版本（func 为协程函数）"""
+    breaker.before_call()
+    try:
+        result = await func(*args, **kwargs)
+    except asyncio.CancelledError:
+        # 任务取消时中止的调用与服务商健康无关
+        breaker.on_ignored()
+        raise
+    except Exception as e:
+        if is_provider_failure(e):
+            breaker.on_failure()
+        else:
+            breaker.on_ignored()
+        raise
+    breaker.on_success()
+    return result
+
+
+def with_circuit_breaker(func: Callable) -> Callable:
+    """使用实例上的 circuit_breaker 保护被装饰的方法（未配置熔断器时直接调用）"""
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        breaker = getattr(self, 'circuit_breaker', None)
+        if breaker is None:
+            return func(self, *args, **kwargs)
+        return call_with_breaker(breaker, func, self, *args, **kwargs)
+    return wrapper
+
+
+class RetryBudget:
+    """
+    令牌桶式重试预算（同一服务商的所有任务共享）
+
+    每个首次请求向桶中存入 ratio 个令牌，每次重试取出 1 个；另外按
+    min_per_second 缓慢补充，保证低流量时仍可重试。服务商整体故障时
+    重试会很快耗尽预算，避免形成重试风暴。
+    """
+
+    def __init__(self, ratio: float = 0.2, capacity: float = 10.0, min_per_second: float = 0.1):
+        """
+        初始化重试预算
+
+        Args:
+            ratio: 每个首次请求存入的令牌数（即允许的重试比例）
+            capacity: 桶容量
+            min_per_second: 每秒自动补充的令牌数
+        """
+        self.ratio = ratio
+        self.capacity = capacity
+        self.min_per_second = min_per_second
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+        self.granted = 0
+        self.rejected = 0
+
+    def _refill_locked(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.min_per_second)
+        self._updated_at = now
+
+    def record_request(self):
+        """记录一次首次请求"""
+        with self._lock:
+            self._refill_locked()
+            self._tokens = min(self.capacity, self._tokens + self.ratio)
+
+    def try_acquire(self) -> bool:
+        """尝试为一次重试取出令牌"""
+        with self._lock:
+            self._refill_locked()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.granted += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def snapshot(self) -> Dict[str, Any]:
+        """获取预算当前状态"""
+        with self._lock:
+            self._refill_locked()
+            return {
+                "tokens": round(self._tokens, 2),
+                "capacity": self.capacity,
+                "granted": self.granted,
+                "rejected": self.rejected,
+            }
+
+
+class RetryPolicy:
+    """
+    服务商重试策略
+
+    统一处理错误分类、退避、限流冷却、自适应并发反馈和重试预算，
+    替代各生成器各自的重试装饰器以及服务层的重试循环。
+    """
+
+    def __init__(
+        self,
+        provider_name: str,
+        max_attempts: int = 3,
+        base_delay: float = 2.0,
+        max_delay: float = 30.0,
+        budget: Optional[RetryBudget] = None
+    ):
+        """
+        初始化重试策略
+
+        Args:
+            provider_name: 服务商名称
+            max_attempts: 最大尝试次数（包括首次请求）
+            base_delay: 退避基础时间（秒）
+            max_delay: 单次退避的最长时间（秒）
+            budget: 重试预算
+        """
+        self.provider_name = provider_name
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget or RetryBudget()
+        # 服务商的对冲请求控制（由 get_request_hedger 设置），对每一次尝试生效
+        self.hedger = None
+
+    def _backoff(self, attempt: int, error: Exception, kind: str) -> float:
+        """计算第 attempt 次失败后的等待时间"""
+        if kind == ErrorKind.RATE_LIMIT:
+            retry_after = extract_retry_after(error)
+            if retry_after is not None:
+                return retry_after
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return delay + random.uniform(0, 1)
+
+    def call(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        按策略调用服务商
+
+        调用参数中的 deadline（如果有）同时约束冷却等待和重试退避：
+        剩余时间不足以再发起一次调用时直接失败。
+
+        Args:
+            func: 单次服务商调用
+            *args, **kwargs: 调用参数
+
+        Returns:
+            调用结果
+
+        Raises:
+            不可重试的原始错误、DeadlineExceededError、TaskCancelledError，或 RetryExhaustedError
+        """
+        limiter = get_adaptive_limiter(self.provider_name)
+        cooldown = get_provider_cooldown(self.provider_name)
+        breaker = get_circuit_breaker(self.provider_name, "image")
+        deadline = resolve_deadline(kwargs.get('deadline'))
+        self.budget.record_request()
+
+        for attempt in range(1, self.max_attempts + 1):
+            self._before_attempt(deadline, cooldown)
+            cooldown.wait()
+            deadline.check("图片生成")
+            started_at = time.monotonic()
+            try:
+                # 熔断中直接抛出 CircuitOpenError（不可重试），不再走完整的重试链
+                if self.hedger is not None:
+                    result = self.hedger.call(call_with_breaker, breaker, func, *args, **kwargs)
+                else:
+                    result = call_with_breaker(breaker, func, *args, **kwargs)
+                limiter.on_success()
+                return result
+            except Exception as e:
+                delay = self._on_failure(attempt, e, deadline, started_at)
+                if delay is not None:
+                    # 任务被取消时立即停止等待
+                    deadline.sleep(delay, "图片生成")
+
+    async def acall(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        按策略调用服务商（协程版本：func 为协程函数，冷却和退避等待不占用线程）
+
+        参数、返回值和异常同 call()。
+        """
+        limiter = get_adaptive_limiter(self.provider_name)
+        cooldown = get_provider_cooldown(self.provider_name)
+        breaker = get_circuit_breaker(self.provider_name, "image")
+        deadline = resolve_deadline(kwargs.get('deadline'))
+        self.budget.record_request()
+
+        for attempt in range(1, self.max_attempts + 1):
+            self._before_attempt(deadline, cooldown)
+            await cooldown.async_wait()
+            deadline.check("图片生成")
+            started_at = time.monotonic()
+            try:
+                if self.hedger is not None:
+                    result = await self.hedger.acall(acall_with_breaker, breaker, func, *args, **kwargs)
+                else:
+                    result = await acall_with_breaker(breaker, func, *args, **kwargs)
+                limiter.on_success()
+                return result
+            except Exception as e:
+                delay = self._on_failure(attempt, e, deadline, started_at)
+                if delay is not None:
+                    await deadline.async_sleep(delay, "图片生成")
+
+    def _before_attempt(self, deadline: Deadline, cooldown: ProviderCooldown):
+        """发起调用前检查取消，以及能否等到限流冷却结束"""
+        deadline.check_cancelled("图片生成")
+        # 服务商处于限流冷却时，在共享闸门处等待（等不到冷却结束就直接失败）
+        if not deadline.allows_wait(cooldown.remaining()):
+            raise DeadlineExceededError(
+                f"图片生成失败：服务商 [{self.provider_name}] 限流冷却中，"
+                "任务剩余时间不足 (deadline exceeded)"
+            )
+
+    def _on_failure(self, attempt: int, e: Exception, deadline: Deadline, started_at: float) -> Optional[float]:
+        """
+        处理一次失败的调用
+
+        Args:
+            attempt: 第几次尝试
+            e: 调用抛出的错误
+            deadline: 截止时间
+            started_at: 本次调用开始的时间
+
+        Returns:
+            重试前需要等待的秒数；遇到限流时返回 None（已开启服务商冷却，下一次尝试在闸门处等待）
+
+        Raises:
+            不可重试时抛出原始错误、DeadlineExceededError 或 RetryExhaustedError
+        """
+        limiter = get_adaptive_limiter(self.provider_name)
+        cooldown = get_provider_cooldown(self.provider_name)
+        kind = classify_error(e)
+        if kind == ErrorKind.TIMEOUT and deadline.expired():
+            # 超时时间是按剩余时间收缩的，此时超时即截止时间已到
+            raise DeadlineExceededError(
+                f"图片生成失败：等待服务商响应时超过任务截止时间 (deadline exceeded)。\n"
+                f"最后错误: {e}"
+            ) from e
+        if kind == ErrorKind.RATE_LIMIT:
+            # 通知自适应限制器降低该服务商的并发
+            limiter.on_rate_limited(started_at)
+
+        if kind not in RETRYABLE_KINDS:
+            logger.warning(f"服务商 [{self.provider_name}] 返回不可重试错误 ({kind}): {str(e)[:100]}")
+            raise e
+
+        if attempt >= self.max_attempts:
+            logger.error(f"服务商 [{self.provider_name}] 调用失败: 尝试 {self.max_attempts} 次后仍失败")
+            raise RetryExhaustedError(
+                f"图片生成失败：尝试 {self.max_attempts} 次后仍失败。\n"
+                f"最后错误: {e}\n"
+                "可能原因：\n"
+                "1. API配额已用尽或达到速率限制\n"
+                "2. 网络连接不稳定\n"
+                "3. API服务暂时不可用\n"
+                "建议：稍后再试，或检查API配额和网络状态",
+                last_error=e,
+                kind=kind
+            )
+
+        delay = self._backoff(attempt, e, kind)
+        if not deadline.allows_wait(delay):
+            if kind == ErrorKind.RATE_LIMIT:
+                # 本任务等不及，但其他任务仍应遵守服务商的冷却要求
+                cooldown.trigger(delay)
+            logger.warning(f"服务商 [{self.provider_name}] 重试需等待 {delay:.1f}秒，超过任务剩余时间，放弃重试")
+            raise DeadlineExceededError(
+                f"图片生成失败：剩余时间不足以重试 (deadline exceeded)。\n"
+                f"最后错误: {e}"
+            ) from e
+
+        if not self.budget.try_acquire():
+            logger.error(f"服务商 [{self.provider_name}] 重试预算已耗尽，放弃重试")
+            raise RetryExhaustedError(
+                f"图片生成失败：服务商 [{self.provider_name}] 当前失败过多，重试预算已耗尽。\n"
+                f"最后错误: {e}\n"
+                "建议：稍后再试，或检查服务商状态",
+                last_error=e,
+                kind=kind
+            )
+
+        if kind == ErrorKind.RATE_LIMIT:
+            # 开启服务商级冷却窗口，所有线程共同等待
+            logger.warning(f"遇到速率限制，服务商冷却 {delay:.1f}秒后重试 (尝试 {attempt + 1}/{self.max_attempts})")
+            cooldown.trigger(delay)
+            return None
+        logger.warning(f"请求失败 ({kind}): {str(e)[:100]}，{delay:.1f}秒后重试 (尝试 {attempt + 1}/{self.max_attempts})")
+        return delay
+
+    def snapshot(self) -> Dict[str, Any]:
+        """获取策略与预算状态"""
+        return {
+            "max_attempts": self.max_attempts,
+            "base_delay": self.base_delay,
+            "max_delay": self.max_delay,
+            "budget": self.budget.snapshot(),
+        }
+
+
+def retry_with_policy(func: Callable) -> Callable:
+    """使用生成器实例上的 retry_policy 调用被装饰的方法（deadline 关键字参数同时约束重试）"""
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        return self.retry_policy.call(func, self, *args, **kwargs)
+    return wrapper
+
+
+def aretry_with_policy(func: Callable) -> Callable:
+    """retry_with_policy 的协程版本（被装饰的方法为 async def）"""
+    @wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        return await self.retry_policy.acall(func, self, *args, **kwargs)
+    return wrapper
+
+
+# 每个服务商一个重试策略（进程级共享，预算在所有任务之间共享）
+_policies: Dict[str, RetryPolicy] = {}
+_policies_lock = threading.Lock()
+
+
+def get_retry_policy(provider_name: str, provider_config: Optional[Dict] = None) -> RetryPolicy:
+    """
+    获取服务商的重试策略
+
+    Args:
+        provider_name: 服务商名称
+        provider_config: 服务商配置；传入时按配置（重新）设置策略参数：
+            - max_retries: 最大尝试次数（默认 3）
+            - retry_base_delay: 退避基础时间（默认 2 秒）
+            - retry_max_delay: 单次退避最长时间（默认 30 秒）
+            - retry_budget_ratio: 每个请求允许的重试比例（默认 0.2）
+            - retry_budget_capacity: 重试预算桶容量（默认 10）
+
+    Returns:
+        重试策略实例
+    """
+    with _policies_lock:
+        policy = _policies.get(provider_name)
+        if policy is None:
+            policy = RetryPolicy(provider_name)
+            _policies[provider_name] = policy
+
+        if provider_config is not None:
+            policy.max_attempts = max(1, int(provider_config.get('max_retries') or 3))
+            policy.base_delay = float(provider_config.get('retry_base_delay') or 2.0)
+            policy.max_delay = float(provider_config.get('retry_max_delay') or 30.0)
+            policy.budget.ratio = float(provider_config.get('retry_budget_ratio') or 0.2)
+            policy.budget.capacity = float(provider_config.get('retry_budget_capacity') or 10.0)
+        return policy
+
+
+def get_retry_stats() -> Dict[str, Dict[str, Any]]:
+    """获取所有服务商重试策略的状态"""
+    with _policies_lock:
+        policies = dict(_policies)
+    return {name: policy.snapshot() for name, policy in policies.items()}
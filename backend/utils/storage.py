@@ -91,10 +91,13 @@ class LocalStorage(StorageProvider):
         return path
 
 class RedisStorage(StorageProvider):
-    def __init__(self, url: str):
-        if not redis:
-            raise ImportError("redis package is required for RedisStorage")
-        self.client = redis.Redis.from_url(url, decode_responses=False)
+    def __init__(self, url: Optional[str] = None, client=None):
+        """Connect by URL, or wrap an existing client (e.g. a fakeredis instance)."""
+        if client is None:
+            if not redis:
+                raise ImportError("redis package is required for RedisStorage")
+            client = redis.Redis.from_url(url, decode_responses=False)
+        self.client = client
         self.prefix = "redink:"
 
     def _get_key(self, path: str) -> str:
@@ -129,6 +132,18 @@ class RedisStorage(StorageProvider):
     def delete(self, path: str) -> bool:
         key = self._get_key(path)
         return bool(self.client.delete(key))
+
+    def append(self, path: str, line: str) -> int:
+        """Append a line to the list stored at path."""
+        return self.client.rpush(self._get_key(path), line.encode('utf-8'))
+
+    def load_lines(self, path: str) -> List[str]:
+        """Load all lines appended to path."""
+        return [item.decode('utf-8') for item in self.client.lrange(self._get_key(path), 0, -1)]
+
+    def expire(self, path: str, seconds: int) -> bool:
+        """Set a time-to-live on path."""
+        return bool(self.client.expire(self._get_key(path), int(seconds)))
         
     def get_url(self, path: str) -> str:
         # Redis doesn't expose public URLs directly.
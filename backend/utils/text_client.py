@@ -6,6 +6,12 @@ import requests
 from functools import wraps
 from typing import List, Optional, Union
 from .image_compressor import compress_image
+from .reference import ReferenceImage
+from .deadline import Deadline, DeadlineExceededError, resolve_deadline
+from .circuit_breaker import CircuitBreaker, get_circuit_breaker
+from .retry import with_circuit_breaker
+from .flow_control import parse_retry_after
+from ..generators.base import ProviderHTTPError
 
 
 def retry_on_429(max_retries=3, base_delay=2):
@@ -13,6 +19,8 @@ def retry_on_429(max_retries=3, base_delay=2):
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
+            # 调用参数中的 deadline 同时约束重试等待
+            deadline = resolve_deadline(kwargs.get('deadline'))
             for attempt in range(max_retries):
                 try:
                     return func(*args, **kwargs)
@@ -21,17 +29,22 @@ def retry_on_429(max_retries=3, base_delay=2):
                     if "429" in error_str or "rate" in error_str.lower():
                         if attempt < max_retries - 1:
                             wait_time = (base_delay ** attempt) + random.uniform(0, 1)
+                            if not deadline.allows_wait(wait_time):
+                                raise DeadlineExceededError(
+                                    f"Text API 剩余时间不足以重试 (deadline exceeded)。\n最后错误: {e}"
+                                ) from e
                             print(f"[重试] 遇到限流，{wait_time:.1f}秒后重试 (尝试 {attempt + 2}/{max_retries})")
                             time.sleep(wait_time)
                             continue
                     raise
-            raise Exception(
+            raise ProviderHTTPError(
                 f"Text API 重试 {max_retries} 次后仍失败。\n"
                 "可能原因：\n"
                 "1. API持续限流或配额不足\n"
                 "2. 网络连接持续不稳定\n"
                 "3. API服务暂时不可用\n"
-                "建议：稍后再试，或联系API服务提供商"
+                "建议：稍后再试，或联系API服务提供商",
+                status_code=429
             )
         return wrapper
     return decorator
@@ -40,7 +53,7 @@ def retry_on_429(max_retries=3, base_delay=2):
 class TextChatClient:
     """Text API 客户端封装类"""
 
-    def __init__(self, api_key: str = None, base_url: str = None):
+    def __init__(self, api_key: str = None, base_url: str = None, circuit_breaker: Optional[CircuitBreaker] = None):
         self.api_key = api_key
         if not self.api_key:
             raise ValueError(
@@ -50,6 +63,8 @@ class TextChatClient:
 
         self.base_url = base_url or "https://api.openai.com"
         self.chat_endpoint = f"{self.base_url}/v1/chat/completions"
+        # 服务商熔断器（服务商故障时快速失败）
+        self.circuit_breaker = circuit_breaker
 
     def _encode_image_to_base64(self, image_data: bytes) -> str:
         """将图片数据编码为 base64"""
@@ -65,7 +80,7 @@ class TextChatClient:
 
         Args:
             text: 文本内容
-            images: 图片列表，可以是 bytes（图片数据）或 str（URL）
+            images: 图片列表，可以是 bytes（图片数据）、ReferenceImage（已编码的参考图）或 str（URL）
 
         Returns:
             如果没有图片，返回纯文本；有图片则返回多模态内容列表
@@ -76,7 +91,10 @@ class TextChatClient:
         content = [{"type": "text", "text": text}]
 
         for img in images:
-            if isinstance(img, bytes):
+            if isinstance(img, ReferenceImage):
+                # 预先编码的参考图，重试时直接复用
+                image_url = img.data_uri
+            elif isinstance(img, bytes):
                 # 压缩图片到 200KB 以内
                 compressed_img = compress_image(img, max_size_kb=200)
                 # 图片数据，转为 base64 data URL
@@ -94,14 +112,16 @@ class TextChatClient:
         return content
 
     @retry_on_429(max_retries=3, base_delay=2)
+    @with_circuit_breaker
     def generate_text(
         self,
         prompt: str,
         model: str = "gemini-3-pro-preview",
         temperature: float = 1.0,
         max_output_tokens: int = 8000,
-        images: List[Union[bytes, str]] = None,
+        images: List[Union[bytes, ReferenceImage, str]] = None,
         system_prompt: str = None,
+        deadline: Optional[Deadline] = None,
         **kwargs
     ) -> str:
         """
@@ -114,6 +134,7 @@ class TextChatClient:
             max_output_tokens: 最大输出 token
             images: 图片列表（可选）
             system_prompt: 系统提示词（可选）
+            deadline: 请求截止时间（请求超时按剩余时间收缩）
 
         Returns:
             生成的文本
@@ -152,12 +173,13 @@ class TextChatClient:
             self.chat_endpoint,
             json=payload,
             headers=headers,
-            timeout=300  # 5分钟超时
+            timeout=resolve_deadline(deadline).timeout(300, "Text API 请求")  # 默认5分钟超时，按剩余时间收缩
         )
 
         if response.status_code != 200:
             error_detail = response.text[:500]
-            raise Exception(
+            # 携带状态码：4xx（密钥、模型名称等配置错误）不计入熔断器失败
+            raise ProviderHTTPError(
                 f"Text API 请求失败 (状态码: {response.status_code})\n"
                 f"错误详情: {error_detail}\n"
                 f"请求地址: {self.chat_endpoint}\n"
@@ -168,7 +190,9 @@ class TextChatClient:
                 "3. 请求超时或网络问题\n"
                 "4. API配额已用尽\n"
                 "5. Base URL配置错误\n"
-                "建议：检查 TEXT_API_KEY 和 TEXT_API_BASE_URL 配置"
+                "建议：检查 TEXT_API_KEY 和 TEXT_API_BASE_URL 配置",
+                status_code=response.status_code,
+                retry_after=parse_retry_after(response.headers.get('Retry-After'))
             )
 
         result = response.json()
@@ -177,14 +201,15 @@ class TextChatClient:
         if "choices" in result and len(result["choices"]) > 0:
             return result["choices"][0]["message"]["content"]
         else:
-            raise Exception(
+            raise ProviderHTTPError(
                 f"Text API 响应格式异常：未找到生成的文本。\n"
                 f"响应数据: {str(result)[:500]}\n"
                 "可能原因：\n"
                 "1. API返回格式与OpenAI标准不一致\n"
                 "2. 请求被拒绝或过滤\n"
                 "3. 模型输出为空\n"
-                "建议：检查API文档确认响应格式"
+                "建议：检查API文档确认响应格式",
+                status_code=response.status_code
             )
 
 
@@ -197,16 +222,20 @@ def get_text_chat_client(provider_config: dict):
             - type: 'google_gemini' 或 'openai_compatible'
             - api_key: API密钥
             - base_url: API基础URL（仅 openai_compatible 需要）
+            - name: 服务商名称（可选，用于按服务商熔断，默认使用 type）
 
     Returns:
         GenAIClient 或 TextChatClient
     """
     provider_type = provider_config.get('type', 'openai_compatible')
     api_key = provider_config.get('api_key')
+    circuit_breaker = get_circuit_breaker(
+        provider_config.get('name') or provider_type, "text", provider_config
+    )
 
     if provider_type == 'google_gemini':
         from .genai_client import GenAIClient
-        return GenAIClient(api_key=api_key)
+        return GenAIClient(api_key=api_key, circuit_breaker=circuit_breaker)
     else:
         base_url = provider_config.get('base_url')
-        return TextChatClient(api_key=api_key, base_url=base_url)
+        return TextChatClient(api_key=api_key, base_url=base_url, circuit_breaker=circuit_breaker)
@@ -0,0 +1,38 @@
+"""
+独立的图片生成工作进程
+
+API 进程设置 JOB_WORKERS=0 时只负责把任务写入队列，由一个或多个工作进程执行：
+
+    python -m backend.worker
+
+工作进程与 API 进程共享同一个队列数据库（JOB_QUEUE_PATH）和 history 目录。
+"""
+import logging
+import signal
+import threading
+
+from backend.app import setup_logging
+from backend.config import Config
+from backend.services.executor import get_generation_executor
+from backend.services.job_queue import start_job_workers
+
+
+def main():
+    logger = setup_logging()
+    logger.info("🚀 正在启动 红墨 图片生成工作进程...")
+
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    signal.signal(signal.SIGINT, lambda *_: stopped.set())
+
+    workers = start_job_workers(max(1, Config.JOB_WORKERS))
+    stopped.wait()
+
+    logger.info("正在停止工作进程（未完成的任务将在租约过期后由其他工作进程重新执行）")
+    workers.stop()
+    get_generation_executor().shutdown()
+    logging.shutdown()
+
+
+if __name__ == '__main__':
+    main()
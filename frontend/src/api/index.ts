@@ -2,6 +2,20 @@ import axios from 'axios'
 
 const API_BASE_URL = '/api'
 
+// 客户端标识：后端按客户端公平分配图片生成并发（每个浏览器一个，保存在 localStorage）
+const CLIENT_ID_KEY = 'redink-client-id'
+
+function getClientId(): string {
+  let clientId = localStorage.getItem(CLIENT_ID_KEY)
+  if (!clientId) {
+    clientId = `c_${Date.now().toString(36)}${Math.random().toString(36).slice(2, 10)}`
+    localStorage.setItem(CLIENT_ID_KEY, clientId)
+  }
+  return clientId
+}
+
+axios.defaults.headers.common['X-Client-Id'] = getClientId()
+
 export interface Page {
   index: number
   type: 'cover' | 'content' | 'summary'
@@ -103,6 +117,121 @@ export function generateImages(
   return eventSource
 }
 
+// 请求失败时的错误（服务繁忙返回 429/503 时使用后端给出的错误信息和重试时间）
+async function responseError(response: Response): Promise<Error> {
+  try {
+    const data = await response.json()
+    if (data?.error) return new Error(data.error)
+  } catch (e) {
+    // 响应体不是 JSON
+  }
+  return new Error(`HTTP error! status: ${response.status}`)
+}
+
+// ==================== SSE 断线续传 ====================
+
+// 连接中断后重新订阅的最大次数（收到新事件后重新计数）
+const SSE_MAX_RESUME_ATTEMPTS = 5
+
+// 读取一个 SSE 响应流，按顺序回调每个事件（id 为事件序号，没有时为 null）
+async function readEventStream(
+  response: Response,
+  onMessage: (eventType: string, data: any, id: number | null) => void
+) {
+  const reader = response.body?.getReader()
+  if (!reader) {
+    throw new Error('无法读取响应流')
+  }
+
+  const decoder = new TextDecoder()
+  let buffer = ''
+
+  while (true) {
+    const { done, value } = await reader.read()
+
+    if (done) break
+
+    buffer += decoder.decode(value, { stream: true })
+    const blocks = buffer.split('\n\n')
+    buffer = blocks.pop() || ''
+
+    for (const block of blocks) {
+      let eventType = ''
+      let eventData = ''
+      let eventId: number | null = null
+
+      for (const line of block.split('\n')) {
+        // 以冒号开头的是保活注释
+        if (line.startsWith('event: ')) eventType = line.slice(7).trim()
+        else if (line.startsWith('data: ')) eventData = line.slice(6).trim()
+        else if (line.startsWith('id: ')) eventId = Number(line.slice(4).trim())
+      }
+      if (!eventType || !eventData) continue
+
+      try {
+        onMessage(eventType, JSON.parse(eventData), eventId)
+      } catch (e) {
+        console.error('解析 SSE 数据失败:', e)
+      }
+    }
+  }
+}
+
+// 消费任务事件流：连接中断时凭 Last-Event-ID 重新订阅任务事件，
+// 从断点继续接收，而不是重新发起生成（已成功的页面不会重复消耗配额）
+async function consumeTaskStream(
+  response: Response,
+  terminalEvent: string,
+  onMessage: (eventType: string, data: any) => void,
+  onStart?: (taskId: string) => void
+) {
+  const jobId = response.headers.get('X-Job-Id')
+  const taskId = response.headers.get('X-Task-Id')
+  if (taskId && onStart) onStart(taskId)
+  let lastEventId = 0
+  let finished = false
+  let attempts = 0
+  let current = response
+
+  while (true) {
+    let streamError: Error | null = null
+    try {
+      await readEventStream(current, (eventType, data, id) => {
+        if (id !== null) {
+          // 重新订阅时服务端从 Last-Event-ID 之后重放，这里再按序号去重
+          if (id <= lastEventId) return
+          lastEventId = id
+        }
+        attempts = 0
+        if (eventType === terminalEvent) finished = true
+        onMessage(eventType, data)
+      })
+    } catch (e) {
+      streamError = e as Error
+    }
+
+    if (finished) return
+    if (!jobId || !taskId || attempts >= SSE_MAX_RESUME_ATTEMPTS) {
+      throw streamError || new Error('SSE 连接已断开')
+    }
+
+    attempts++
+    console.warn(`SSE 连接中断，第 ${attempts} 次重新订阅（Last-Event-ID: ${lastEventId}）`)
+    await new Promise(resolve => setTimeout(resolve, 1000 * attempts))
+
+    try {
+      current = await fetch(`${API_BASE_URL}/task/${taskId}/events?job_id=${jobId}`, {
+        headers: { 'Last-Event-ID': String(lastEventId), 'X-Client-Id': getClientId() }
+      })
+    } catch (e) {
+      continue
+    }
+    if (!current.ok) {
+      throw await responseError(current)
+    }
+  }
+}
+
 // 获取图片 URL（新格式：task_id/filename）
 // thumbnail 参数：true=缩略图（默认），false=原图
 export function getImageUrl(taskId: string, filename: string, thumbnail: boolean = true): string {
@@ -162,13 +291,15 @@ export async function retryFailedImages(
   onComplete: (event: ProgressEvent) => void,
   onError: (event: ProgressEvent) => void,
   onFinish: (event: { success: boolean; total: number; completed: number; failed: number }) => void,
-  onStreamError: (error: Error) => void
+  onStreamError: (error: Error) => void,
+  onStart?: (taskId: string) => void
 ) {
   try {
     const response = await fetch(`${API_BASE_URL}/retry-failed`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
+        'X-Client-Id': getClientId(),
       },
       body: JSON.stringify({
         task_id: taskId,
@@ -177,57 +308,25 @@ export async function retryFailedImages(
     })
 
     if (!response.ok) {
-      throw new Error(`HTTP error! status: ${response.status}`)
+      throw await responseError(response)
     }
 
-    const reader = response.body?.getReader()
-    if (!reader) {
-      throw new Error('无法读取响应流')
-    }
-
-    const decoder = new TextDecoder()
-    let buffer = ''
-
-    while (true) {
-      const { done, value } = await reader.read()
-
-      if (done) break
-
-      buffer += decoder.decode(value, { stream: true })
-      const lines = buffer.split('\n\n')
-      buffer = lines.pop() || ''
-
-      for (const line of lines) {
-        if (!line.trim()) continue
-
-        const [eventLine, dataLine] = line.split('\n')
-        if (!eventLine || !dataLine) continue
-
-        const eventType = eventLine.replace('event: ', '').trim()
-        const eventData = dataLine.replace('data: ', '').trim()
-
-        try {
-          const data = JSON.parse(eventData)
-
-          switch (eventType) {
-            case 'retry_start':
-              onProgress({ index: -1, status: 'generating', message: data.message })
-              break
-            case 'complete':
-              onComplete(data)
-              break
-            case 'error':
-              onError(data)
-              break
-            case 'retry_finish':
-              onFinish(data)
-              break
-          }
-        } catch (e) {
-          console.error('解析 SSE 数据失败:', e)
-        }
+    await consumeTaskStream(response, 'retry_finish', (eventType, data) => {
+      switch (eventType) {
+        case 'retry_start':
+          onProgress({ index: -1, status: 'generating', message: data.message })
+          break
+        case 'complete':
+          onComplete(data)
+          break
+        case 'error':
+          onError(data)
+          break
+        case 'retry_finish':
+          onFinish(data)
+          break
       }
-    }
+    }, onStart)
   } catch (error) {
     onStreamError(error as Error)
   }
@@ -362,7 +461,8 @@ export async function generateImagesPost(
   onFinish: (event: FinishEvent) => void,
   onStreamError: (error: Error) => void,
   userImages?: File[],
-  userTopic?: string
+  userTopic?: string,
+  onStart?: (taskId: string) => void
 ) {
   try {
     // 将用户图片转换为 base64
@@ -384,6 +484,7 @@ export async function generateImagesPost(
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
+        'X-Client-Id': getClientId(),
       },
       body: JSON.stringify({
         pages,
@@ -395,62 +496,40 @@ export async function generateImagesPost(
     })
 
     if (!response.ok) {
-      throw new Error(`HTTP error! status: ${response.status}`)
+      throw await responseError(response)
     }
 
-    const reader = response.body?.getReader()
-    if (!reader) {
-      throw new Error('无法读取响应流')
-    }
-
-    const decoder = new TextDecoder()
-    let buffer = ''
-
-    while (true) {
-      const { done, value } = await reader.read()
-
-      if (done) break
-
-      buffer += decoder.decode(value, { stream: true })
-      const lines = buffer.split('\n\n')
-      buffer = lines.pop() || ''
-
-      for (const line of lines) {
-        if (!line.trim()) continue
-
-        const [eventLine, dataLine] = line.split('\n')
-        if (!eventLine || !dataLine) continue
-
-        const eventType = eventLine.replace('event: ', '').trim()
-        const eventData = dataLine.replace('data: ', '').trim()
-
-        try {
-          const data = JSON.parse(eventData)
-
-          switch (eventType) {
-            case 'progress':
-              onProgress(data)
-              break
-            case 'complete':
-              onComplete(data)
-              break
-            case 'error':
-              onError(data)
-              break
-            case 'finish':
-              onFinish(data)
-              break
-          }
-        } catch (e) {
-          console.error('解析 SSE 数据失败:', e)
-        }
+    await consumeTaskStream(response, 'finish', (eventType, data) => {
+      switch (eventType) {
+        case 'progress':
+          onProgress(data)
+          break
+        case 'complete':
+          onComplete(data)
+          break
+        case 'error':
+          onError(data)
+          break
+        case 'finish':
+          onFinish(data)
+          break
       }
-    }
+    }, onStart)
   } catch (error) {
     onStreamError(error as Error)
   }
 }
 
+// 取消任务正在进行的生成（未完成的页面记为失败，之后可以重试）
+export async function cancelTask(taskId: string): Promise<{
+  success: boolean
+  job_ids?: string[]
+  error?: string
+}> {
+  const response = await axios.post(`${API_BASE_URL}/task/${taskId}/cancel`)
+  return response.data
+}
+
 // 扫描单个任务并同步图片列表
 export async function scanTask(taskId: string): Promise<{
   success: boolean
@@ -0,0 +1,115 @@
+"""准入控制测试"""
+import pytest
+from flask import Flask
+
+from backend.config import Config
+from backend.routes import api as api_module
+from backend.services import admission as admission_module
+from backend.services.admission import (
+    AUTO_INFLIGHT_PAGES_FACTOR,
+    DEFAULT_JOB_PAGES,
+    DEFAULT_PAGE_SECONDS,
+    AdmissionController,
+)
+from backend.services.executor import GenerationExecutor
+from backend.services.job_queue import JobQueue
+
+JOB_SLOTS = 2
+# 还没有执行样本时单个任务的估算耗时
+JOB_SECONDS = int(DEFAULT_JOB_PAGES * DEFAULT_PAGE_SECONDS)
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    executor = GenerationExecutor(max_workers=8)
+    monkeypatch.setattr(Config, "ADMISSION_ENABLED", True)
+    monkeypatch.setattr(admission_module, "get_job_queue", lambda: queue)
+    monkeypatch.setattr(admission_module, "get_generation_executor", lambda: executor)
+    monkeypatch.setattr(admission_module, "get_job_worker_capacity", lambda: JOB_SLOTS)
+    yield queue
+    executor.shutdown()
+
+
+def _fill(queue, running, queued, client_id="other"):
+    """占用 running 个任务工作线程，再排队 queued 个任务"""
+    for i in range(running + queued):
+        queue.enqueue("generate", {"pages": [{}], "client_id": client_id}, task_id=f"t{i}")
+    for i in range(running):
+        queue.claim(f"w{i}")
+
+
+def test_idle_instance_is_ready(queue):
+    admission = AdmissionController()
+    assert admission.check_generate("c1") is None
+    readiness = admission.readiness()
+    assert readiness["ready"]
+    assert readiness["retry_after"] is None
+
+
+def test_limits_follow_worker_and_executor_capacity(queue):
+    admission = AdmissionController()
+    limits = admission.limits(admission.get_load())
+    assert limits["max_queued_jobs"] == JOB_SLOTS
+    assert limits["max_inflight_pages"] == AUTO_INFLIGHT_PAGES_FACTOR * 8
+
+
+def test_wait_estimate_counts_jobs_waiting_for_a_worker(queue):
+    _fill(queue, running=JOB_SLOTS, queued=1)
+    load = AdmissionController().get_load()
+    # 所有工作线程都在执行任务，新任务前面还有 1 个排队任务：等待两轮中的一个空位
+    assert load["estimated_wait_seconds"] == pytest.approx(2 / JOB_SLOTS * JOB_SECONDS)
+
+
+def test_saturated_queue_rejects_with_retry_after(queue):
+    _fill(queue, running=JOB_SLOTS, queued=JOB_SLOTS)
+    admission = AdmissionController()
+
+    rejection = admission.check_generate("c1")
+    assert rejection["status"] == 503
+    # 空出一个工作线程、排队任务降到阈值以下所需的时间
+    assert rejection["retry_after"] == JOB_SECONDS // JOB_SLOTS
+    assert admission.check_outline()["status"] == 503
+    readiness = admission.readiness()
+    assert not readiness["ready"]
+    assert readiness["retry_after"] == rejection["retry_after"]
+
+
+def test_long_wait_rejects_with_retry_after(queue):
+    _fill(queue, running=JOB_SLOTS, queued=1)
+    admission = AdmissionController(max_queued_jobs=0, max_wait_seconds=30)
+
+    rejection = admission.check_generate("c1")
+    assert rejection["status"] == 503
+    # 估算等待 60 秒，超出上限 30 秒
+    assert rejection["retry_after"] == 30
+
+
+def test_client_with_too_many_jobs_gets_429(queue):
+    _fill(queue, running=0, queued=1, client_id="c1")
+    admission = AdmissionController(max_jobs_per_client=1)
+
+    rejection = admission.check_generate("c1")
+    assert rejection["status"] == 429
+    assert rejection["retry_after"] == JOB_SECONDS
+    assert admission.check_generate("c2") is None
+
+
+def test_http_rejection_carries_retry_after(queue, monkeypatch):
+    _fill(queue, running=JOB_SLOTS, queued=JOB_SLOTS)
+    admission = AdmissionController()
+    monkeypatch.setattr(api_module, "get_admission_controller", lambda: admission)
+    monkeypatch.setattr(api_module, "get_job_queue", lambda: queue)
+    app = Flask(__name__)
+    app.register_blueprint(api_module.api_bp)
+    client = app.test_client()
+
+    response = client.post("/api/generate", json={"pages": [{"index": 0}]}, headers={"X-Client-Id": "c1"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(JOB_SECONDS // JOB_SLOTS)
+    assert response.get_json()["retry_after"] == JOB_SECONDS // JOB_SLOTS
+    assert queue.get_stats()["jobs"]["queued"] == JOB_SLOTS
+
+    health = client.get("/api/health")
+    assert health.status_code == 503
+    assert health.headers["Retry-After"] == str(JOB_SECONDS // JOB_SLOTS)
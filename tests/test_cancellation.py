@@ -0,0 +1,149 @@
+"""任务取消测试"""
+import io
+import threading
+import time
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+from PIL import Image
+
+from backend.services import job_queue as job_queue_module
+from backend.services.image import ImageService
+from backend.services.job_queue import JobQueue, JobWorkerPool
+from backend.services.task import GenerationTask
+from backend.utils.deadline import Deadline, is_cancelled
+
+
+def _png() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), "red").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _image_service(results):
+    """只替换页面提交的图片服务：results 中有结果的页面立即完成，其余页面一直等待"""
+    service = object.__new__(ImageService)
+    service.pool = SimpleNamespace(size=1, primary=SimpleNamespace(limiter=SimpleNamespace(limit=4)))
+
+    def submit_page(task, page, use_reference=True, deadline=None, priority=0, tenant=None):
+        future = Future()
+        if page["index"] in results:
+            future.set_result(results[page["index"]])
+        return future
+
+    service._submit_page = submit_page
+    return service
+
+
+def test_cancel_fails_unfinished_pages(tmp_path):
+    (tmp_path / "0.png").write_bytes(_png())
+    pages = [{"index": i, "type": "cover" if i == 0 else "content", "content": f"第 {i} 页"} for i in range(4)]
+    task = GenerationTask("t1", str(tmp_path), pages=pages, deadline=Deadline.none())
+    service = _image_service({0: (0, True, "0.png", None), 1: (1, True, "1.png", None)})
+
+    canceller = threading.Timer(0.1, task.deadline.cancel, args=("用户取消",))
+    canceller.start()
+    started_at = time.monotonic()
+    events = list(service._generate_task_images(task))
+    canceller.join()
+
+    assert time.monotonic() - started_at < 2
+    errors = {event["data"]["index"]: event["data"]["message"] for event in events if event["event"] == "error"}
+    assert set(errors) == {2, 3}
+    assert all(is_cancelled(message) for message in errors.values())
+    assert set(task.generated) == {0, 1}
+    assert set(task.failed) == {2, 3}
+
+    finish = events[-1]
+    assert finish["event"] == "finish"
+    assert finish["data"]["cancelled"] is True
+    assert finish["data"]["completed"] == 2
+    assert sorted(finish["data"]["failed_indices"]) == [2, 3]
+
+
+def test_cancel_queued_job_finishes_with_terminal_event(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    job_id = queue.enqueue("generate", {}, task_id="t1")
+
+    assert queue.cancel(job_id, "用户取消") == "cancelled"
+    assert queue.get_job(job_id)["status"] == "cancelled"
+    finish = queue.get_events(job_id)[-1]
+    assert finish["event"] == "finish"
+    assert finish["data"]["cancelled"] is True
+    assert queue.claim("w1") is None
+
+
+def test_cancel_request_reaches_running_job(tmp_path, monkeypatch):
+    queue = JobQueue(str(tmp_path / "jobs.db"), poll_interval=0.05)
+
+    def handler(payload, deadline):
+        yield {"event": "progress", "data": {"status": "generating"}}
+        # 与页面生成一样，在取消令牌被触发前一直等待
+        while not deadline.cancelled:
+            time.sleep(0.01)
+        yield {"event": "finish", "data": {"cancelled": True, "reason": deadline.cancel_reason}}
+
+    monkeypatch.setitem(job_queue_module._JOB_HANDLERS, "generate", handler)
+    workers = JobWorkerPool(queue, workers=1)
+    workers.start()
+    try:
+        job_id = queue.enqueue("generate", {}, task_id="t1")
+        events = queue.subscribe(job_id)
+        assert next(events)["event"] == "progress"
+
+        # 取消请求可能来自其他进程：只写入队列，由执行任务的进程在下一次检查时取消
+        assert queue.cancel(job_id, "用户取消") == "running"
+        finish = next(events)
+        assert finish["event"] == "finish"
+        assert finish["data"]["reason"] == "用户取消"
+        assert list(events) == []
+        assert queue.get_job(job_id)["status"] == "cancelled"
+    finally:
+        workers.stop()
+
+
+def test_cancel_and_claim_do_not_both_win(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+
+    for i in range(20):
+        job_id = queue.enqueue("generate", {}, task_id=f"t{i}")
+        barrier = threading.Barrier(2)
+        results = {}
+
+        def cancel():
+            barrier.wait()
+            results["cancel"] = queue.cancel(job_id, "用户取消")
+
+        def claim():
+            barrier.wait()
+            results["claim"] = queue.claim("w1")
+
+        threads = [threading.Thread(target=cancel), threading.Thread(target=claim)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        finish_events = [event for event in queue.get_events(job_id) if event["event"] == "finish"]
+        if results["claim"] is None:
+            # 取消先结束了排队中的任务：不会再被领取
+            assert results["cancel"] == "cancelled"
+            assert len(finish_events) == 1
+        else:
+            # 领取在先：只记录取消请求，由执行任务的工作线程取消，结束事件此时尚未发出
+            assert results["cancel"] == "running"
+            assert finish_events == []
+            queue.complete(job_id)
+        assert queue.get_job(job_id)["status"] == "cancelled"
+
+
+def test_finished_job_is_not_overwritten(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    job_id = queue.enqueue("generate", {}, task_id="t1")
+    assert queue.cancel(job_id, "用户取消") == "cancelled"
+
+    queue.complete(job_id)
+    queue.fail(job_id, "任务执行异常")
+    assert queue.get_job(job_id)["status"] == "cancelled"
+    assert [event["event"] for event in queue.get_events(job_id)] == ["finish"]
+    assert queue.cancel(job_id) == "cancelled"
@@ -0,0 +1,60 @@
+"""共享图片生成执行器调度测试"""
+import threading
+
+import pytest
+
+from backend.services.executor import PRIORITY_CONTENT, PRIORITY_INTERACTIVE, GenerationExecutor
+
+
+@pytest.fixture
+def executor():
+    executor = GenerationExecutor(max_workers=4, aging_seconds=0)
+    yield executor
+    executor.shutdown()
+
+
+def _run_order(executor, submissions):
+    """
+    服务商通道被占用时依次提交，放行后按派发顺序返回各提交的标签
+
+    未登记限制器的服务商串行执行，派发顺序即执行顺序。
+    """
+    gate = threading.Event()
+    order = []
+    blocker = executor.submit("provider", gate.wait, 5)
+    futures = [
+        executor.submit("provider", order.append, label, priority=priority, tenant=tenant)
+        for label, tenant, priority in submissions
+    ]
+    gate.set()
+    blocker.result(timeout=5)
+    for future in futures:
+        future.result(timeout=5)
+    return order
+
+
+def test_tenants_interleave_at_same_priority(executor):
+    # 用户 a 先提交 6 页，用户 b 随后提交 3 页
+    submissions = [(f"a{i}", "a", PRIORITY_CONTENT) for i in range(6)]
+    submissions += [(f"b{i}", "b", PRIORITY_CONTENT) for i in range(3)]
+
+    assert _run_order(executor, submissions) == ["a0", "b0", "a1", "b1", "a2", "b2", "a3", "a4", "a5"]
+
+
+def test_tenant_weights_share_slots_proportionally():
+    executor = GenerationExecutor(max_workers=4, aging_seconds=0, tenant_weights={"vip": 2})
+    try:
+        submissions = [(f"vip{i}", "vip", PRIORITY_CONTENT) for i in range(4)]
+        submissions += [(f"guest{i}", "guest", PRIORITY_CONTENT) for i in range(4)]
+        order = _run_order(executor, submissions)
+    finally:
+        executor.shutdown()
+
+    assert order[:6] == ["vip0", "guest0", "vip1", "vip2", "guest1", "vip3"]
+
+
+def test_priority_comes_before_tenant_fairness(executor):
+    submissions = [(f"a{i}", "a", PRIORITY_CONTENT) for i in range(3)]
+    submissions += [("b-retry", "b", PRIORITY_INTERACTIVE)]
+
+    assert _run_order(executor, submissions)[0] == "b-retry"
@@ -0,0 +1,118 @@
+"""对冲请求测试"""
+import threading
+import time
+
+import pytest
+
+from backend.services.executor import GenerationExecutor
+from backend.utils.flow_control import AdaptiveLimiter
+from backend.utils.hedging import RequestHedger
+from backend.utils.retry import RetryPolicy
+
+
+@pytest.fixture
+def executor():
+    executor = GenerationExecutor(max_workers=4)
+    yield executor
+    executor.shutdown()
+
+
+def _hedger(executor, limit):
+    """登记并发上限为 limit 的服务商通道，返回已积累耗时样本（p50 约 0.05 秒）的对冲控制"""
+    executor.configure_provider("p", AdaptiveLimiter("p", initial=limit, max_limit=limit))
+    hedger = RequestHedger("p", enabled=True, percentile=50, max_ratio=1.0, min_samples=1)
+    hedger.latency.record(0.05)
+    hedger.slots = executor.provider_slots("p")
+    return hedger
+
+
+def test_hedge_skipped_without_free_lane_slot(executor):
+    hedger = _hedger(executor, limit=1)
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.3)
+        return "primary"
+
+    # 页面本身占用了通道唯一的名额
+    assert executor.submit("p", hedger.call, slow).result(timeout=5) == "primary"
+    assert len(calls) == 1
+    assert hedger.hedged == 0
+    assert hedger.no_slot == 1
+    assert executor.get_stats()["providers"]["p"]["extra"] == 0
+
+
+def test_hedge_takes_free_lane_slot_and_wins(executor):
+    hedger = _hedger(executor, limit=2)
+    release = threading.Event()
+    calls = []
+
+    def call():
+        calls.append(1)
+        if len(calls) == 1:
+            # 首个请求卡住，直到测试放行
+            release.wait(5)
+            return "primary"
+        return "hedge"
+
+    assert executor.submit("p", hedger.call, call).result(timeout=5) == "hedge"
+    assert hedger.hedged == 1
+    assert hedger.hedge_wins == 1
+    lane = executor.get_stats()["providers"]["p"]
+    assert lane["extra"] == 1
+    # 输掉的首个请求仍在执行器的辅助线程中进行，对冲占用的名额尚未归还
+    assert lane["active"] == 1
+    assert executor.get_stats()["active_helpers"] == 1
+
+    release.set()
+    deadline = time.monotonic() + 5
+    while executor.get_stats()["providers"]["p"]["active"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert executor.get_stats()["providers"]["p"]["active"] == 0
+    assert executor.get_stats()["active_helpers"] == 0
+
+
+def test_primary_runs_inline_when_helpers_are_busy():
+    executor = GenerationExecutor(max_workers=1)
+    try:
+        hedger = _hedger(executor, limit=2)
+        gate = threading.Event()
+        # 唯一的辅助线程被占用
+        busy = executor.try_run_helper(gate.wait, 5)
+        caller = threading.current_thread()
+        threads = []
+
+        def call():
+            threads.append(threading.current_thread())
+            time.sleep(0.2)
+            return "primary"
+
+        assert hedger.call(call) == "primary"
+        assert threads == [caller]
+        assert hedger.hedged == 0
+        assert hedger.no_slot == 1
+        gate.set()
+        busy.result(timeout=5)
+    finally:
+        executor.shutdown()
+
+
+def test_retry_policy_hedges_each_attempt(executor):
+    hedger = _hedger(executor, limit=2)
+    policy = RetryPolicy("p", max_attempts=3, base_delay=0.3)
+    policy.hedger = hedger
+    attempts = []
+
+    def call():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise ConnectionError("连接被重置")
+        return "ok"
+
+    assert policy.call(call) == "ok"
+    # 重试的退避等待不计入耗时样本，也不会触发对冲
+    assert len(attempts) == 2
+    assert hedger.requests == 2
+    assert hedger.hedged == 0
+    assert hedger.latency.count() == 2
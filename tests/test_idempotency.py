@@ -0,0 +1,105 @@
+"""重复提交去重测试"""
+import threading
+
+import pytest
+from flask import Flask, Response
+
+from backend.config import Config
+from backend.routes import api as api_module
+from backend.services.idempotency import IdempotencyRegistry
+from backend.services.job_queue import JobQueue
+
+PAGES = [{"index": 0, "type": "cover", "content": "封面"}, {"index": 1, "type": "content", "content": "内容"}]
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(api_module, "get_job_queue", lambda: queue)
+    monkeypatch.setattr(Config, "ADMISSION_ENABLED", False)
+    # 只返回订阅的任务 ID，不等待任务事件
+    monkeypatch.setattr(
+        api_module, "_job_event_stream",
+        lambda job_id, last_event_id=0: Response(status=200, headers={"X-Job-Id": job_id})
+    )
+    return queue
+
+
+@pytest.fixture
+def client(queue):
+    # 只注册 API 蓝图，不启动任务工作线程：任务停留在队列中
+    app = Flask(__name__)
+    app.register_blueprint(api_module.api_bp)
+    return app.test_client()
+
+
+def _submit(client, path, body, **headers):
+    """提交请求并返回订阅的任务 ID"""
+    response = client.post(f"/api{path}", json=body, headers=headers)
+    assert response.status_code == 200
+    return response.headers["X-Job-Id"]
+
+
+def test_duplicate_idempotency_key_attaches_to_same_job(client, queue):
+    body = {"pages": PAGES, "task_id": "t1"}
+    first = _submit(client, "/generate", body, **{"Idempotency-Key": "k1"})
+    second = _submit(client, "/generate", body, **{"Idempotency-Key": "k1"})
+    other = _submit(client, "/generate", body, **{"Idempotency-Key": "k2"})
+
+    assert second == first
+    assert other != first
+    assert queue.get_stats()["jobs"]["queued"] == 2
+
+
+def test_explicit_key_reuses_succeeded_job(client, queue):
+    body = {"pages": PAGES, "task_id": "t1"}
+    first = _submit(client, "/generate", body, **{"Idempotency-Key": "k1"})
+    queue.complete(first)
+
+    assert _submit(client, "/generate", body, **{"Idempotency-Key": "k1"}) == first
+
+
+def test_duplicate_content_from_same_client_attaches_to_same_job(client, queue):
+    body = {"pages": PAGES, "task_id": "t1"}
+    first = _submit(client, "/generate", body, **{"X-Client-Id": "c1"})
+
+    assert _submit(client, "/generate", body, **{"X-Client-Id": "c1"}) == first
+    # 没有显式的幂等键时，已结束的任务不复用
+    queue.complete(first)
+    assert _submit(client, "/generate", body, **{"X-Client-Id": "c1"}) != first
+
+
+def test_duplicate_retry_failed_attaches_to_same_job(client, queue):
+    body = {"task_id": "t1", "pages": PAGES[1:]}
+    first = _submit(client, "/retry-failed", body)
+
+    assert _submit(client, "/retry-failed", body) == first
+    assert _submit(client, "/retry-failed", {"task_id": "t1", "pages": PAGES}) != first
+
+
+def test_concurrent_duplicates_share_one_execution():
+    registry = IdempotencyRegistry()
+    release = threading.Event()
+    calls = []
+
+    def regenerate():
+        calls.append(1)
+        release.wait(5)
+        return {"success": True, "image_url": "1.png"}
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(registry.run("regenerate:k1", regenerate)))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    while registry.get_stats()["joined"] < 3:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert sorted(reused for _, reused in results) == [False, True, True, True]
+    assert all(result["image_url"] == "1.png" for result, _ in results)
@@ -0,0 +1,39 @@
+"""b64_json 图片响应流式解码测试"""
+import base64
+import json
+
+from backend.utils.image_response import B64JsonImageDecoder
+
+IMAGE = bytes(range(256)) * 64
+
+
+def _decode(body: bytes, chunk_size: int) -> B64JsonImageDecoder:
+    decoder = B64JsonImageDecoder()
+    for i in range(0, len(body), chunk_size):
+        decoder.feed(body[i:i + chunk_size])
+    return decoder
+
+
+def test_decodes_field_split_across_chunks():
+    body = json.dumps({
+        "created": 1,
+        "data": [{"b64_json": "data:image/png;base64," + base64.b64encode(IMAGE).decode()}],
+    }).encode()
+
+    decoder = _decode(body, chunk_size=7)
+    assert decoder.image() == IMAGE
+    assert decoder.skeleton() == {"created": 1, "data": [{"b64_json": ""}]}
+
+
+def test_finds_field_after_preamble_over_skeleton_limit():
+    # 图片字段之前的内容超过骨架上限（1MB）
+    body = json.dumps({
+        "pad": "x" * (1024 * 1024 + 1000),
+        "data": [{"b64_json": base64.b64encode(IMAGE).decode()}],
+    }).encode()
+
+    decoder = _decode(body, chunk_size=64 * 1024)
+    assert decoder.found
+    assert decoder.image() == IMAGE
+    # 骨架已被截断，不再作为 JSON 返回
+    assert decoder.skeleton() is None
@@ -0,0 +1,135 @@
+"""后台任务队列测试"""
+import threading
+import time
+
+import pytest
+
+from backend.config import Config
+from backend.services import job_queue as job_queue_module
+from backend.services.job_queue import JobQueue, recover_interrupted_tasks
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "jobs.db")
+
+
+@pytest.fixture
+def queue(db_path):
+    return JobQueue(db_path, lease_seconds=60)
+
+
+def test_enqueue_if_idle_skips_task_with_active_job(queue):
+    first = queue.enqueue_if_idle("generate", {"task_id": "t1", "resume": True}, "t1")
+    assert first is not None
+    assert queue.enqueue_if_idle("generate", {"task_id": "t1", "resume": True}, "t1") is None
+
+    queue.complete(first)
+    assert queue.enqueue_if_idle("generate", {"task_id": "t1", "resume": True}, "t1") is not None
+
+
+def test_recovery_from_concurrent_processes_enqueues_once(db_path, monkeypatch):
+    monkeypatch.setattr(Config, "TASK_AUTO_RESUME", True)
+    monkeypatch.setattr(
+        job_queue_module, "find_unfinished_tasks",
+        lambda root, max_age_hours: [{"task_id": "t1", "task_dir": ""}]
+    )
+    # 每个 JobQueue 实例有自己的连接，模拟同时启动的多个进程
+    queues = [JobQueue(db_path) for _ in range(8)]
+    start = threading.Barrier(len(queues))
+
+    def recover(q):
+        start.wait()
+        recover_interrupted_tasks(q)
+
+    threads = [threading.Thread(target=recover, args=(q,)) for q in queues]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert queues[0].get_stats()["jobs"]["queued"] == 1
+
+
+def test_claim_takes_oldest_queued_job(queue):
+    first = queue.enqueue("generate", {"pages": [1]}, task_id="t1")
+    second = queue.enqueue("generate", {"pages": [2]}, task_id="t2")
+
+    job = queue.claim("w1")
+    assert job["id"] == first
+    assert job["status"] == "running"
+    assert job["attempts"] == 1
+    assert job["payload"] == {"pages": [1]}
+    assert queue.claim("w2")["id"] == second
+    assert queue.claim("w3") is None
+
+
+def test_expired_lease_is_claimed_again(db_path):
+    queue = JobQueue(db_path, lease_seconds=0.05, max_attempts=2)
+    job_id = queue.enqueue("generate", {}, task_id="t1")
+    assert queue.claim("w1")["id"] == job_id
+    assert queue.claim("w2") is None
+
+    time.sleep(0.1)
+    job = queue.claim("w2")
+    assert job["id"] == job_id
+    assert job["worker"] == "w2"
+    assert job["attempts"] == 2
+
+
+def test_renewed_lease_is_not_claimed(db_path):
+    queue = JobQueue(db_path, lease_seconds=0.2)
+    job_id = queue.enqueue("generate", {}, task_id="t1")
+    queue.claim("w1")
+    time.sleep(0.1)
+    queue.renew([job_id], "w1")
+    time.sleep(0.15)
+    assert queue.claim("w2") is None
+
+
+def test_expired_lease_fails_job_after_max_attempts(db_path):
+    queue = JobQueue(db_path, lease_seconds=0.05, max_attempts=2)
+    job_id = queue.enqueue("generate", {}, task_id="t1")
+    queue.claim("w1")
+    time.sleep(0.1)
+    queue.claim("w2")
+    time.sleep(0.1)
+
+    assert queue.claim("w3") is None
+    job = queue.get_job(job_id)
+    assert job["status"] == "failed"
+    assert job["attempts"] == 2
+    # 订阅者仍能收到结束事件
+    assert queue.get_events(job_id)[-1]["event"] == "finish"
+
+
+def test_subscribe_replays_events_after_seq(queue):
+    job_id = queue.enqueue("generate", {}, task_id="t1")
+    queue.claim("w1")
+    for index in range(3):
+        queue.append_event(job_id, "complete", {"index": index})
+
+    def produce():
+        time.sleep(0.05)
+        queue.append_event(job_id, "finish", {"success": True})
+        queue.complete(job_id)
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    events = list(queue.subscribe(job_id, after_seq=1))
+    producer.join()
+
+    assert [event["seq"] for event in events] == [2, 3, 4]
+    assert [event["data"].get("index") for event in events[:2]] == [1, 2]
+    assert events[-1]["event"] == "finish"
+
+
+def test_replay_buffer_keeps_latest_events(db_path):
+    queue = JobQueue(db_path, max_events_per_job=3)
+    job_id = queue.enqueue("generate", {}, task_id="t1")
+    for index in range(5):
+        queue.append_event(job_id, "complete", {"index": index})
+    queue.complete(job_id)
+
+    assert [event["seq"] for event in queue.subscribe(job_id, after_seq=1)] == [3, 4, 5]
+    assert queue.get_events(job_id, after_seq=5) == []
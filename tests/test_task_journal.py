@@ -0,0 +1,70 @@
+"""任务日志与中断任务恢复测试"""
+import pytest
+
+from backend.config import Config
+from backend.services import job_queue as job_queue_module
+from backend.services.job_queue import JobQueue, recover_interrupted_tasks
+from backend.services.task import GenerationTask
+from backend.services.task_journal import INTERRUPTED_ERROR, TaskJournal
+
+PAGES = [{"index": i, "type": "cover" if i == 0 else "content", "content": f"第 {i} 页"} for i in range(3)]
+
+
+@pytest.fixture
+def history_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue_module, "_history_root", lambda: str(tmp_path))
+    return tmp_path
+
+
+def _interrupted_task(history_root, task_id="t1") -> str:
+    """模拟生成过程中进程退出：封面已成功，第 1 页失败，第 2 页尚未结束"""
+    task_dir = str(history_root / task_id)
+    task = GenerationTask(task_id, task_dir, pages=PAGES, full_outline="大纲", user_topic="主题")
+    task.ensure_dir()
+    task.journal.record_created(PAGES, "大纲", "主题", [b"user-image"])
+    task.mark_generated(0, "0.png")
+    task.mark_failed(1, "服务商错误")
+    return task_dir
+
+
+def test_restore_replays_journal(history_root):
+    task_dir = _interrupted_task(history_root)
+    # 进程在写入过程中退出，最后一行不完整
+    with open(TaskJournal(task_dir).path, "a", encoding="utf-8") as f:
+        f.write('{"type": "generated", "ind')
+
+    task = GenerationTask.restore("t1", task_dir)
+    assert task.pages == PAGES
+    assert task.full_outline == "大纲"
+    assert task.generated == {0: "0.png"}
+    assert task.failed == {1: "服务商错误"}
+    assert not task.finished
+    assert [page["index"] for page in task.missing_pages()] == [1, 2]
+    assert task.user_images == [b"user-image"]
+
+
+def test_recovery_marks_missing_pages_retryable(history_root, monkeypatch):
+    monkeypatch.setattr(Config, "TASK_AUTO_RESUME", False)
+    task_dir = _interrupted_task(history_root)
+    queue = JobQueue(str(history_root / "jobs.db"))
+
+    assert recover_interrupted_tasks(queue) == 1
+    task = GenerationTask.restore("t1", task_dir)
+    assert task.finished
+    assert task.failed == {1: INTERRUPTED_ERROR, 2: INTERRUPTED_ERROR}
+    assert queue.get_stats()["jobs"]["queued"] == 0
+    # 已结束的任务不会再次恢复
+    assert recover_interrupted_tasks(queue) == 0
+
+
+def test_recovery_resumes_task(history_root, monkeypatch):
+    monkeypatch.setattr(Config, "TASK_AUTO_RESUME", True)
+    _interrupted_task(history_root)
+    queue = JobQueue(str(history_root / "jobs.db"))
+
+    assert recover_interrupted_tasks(queue) == 1
+    job = queue.claim("w1")
+    assert job["kind"] == "generate"
+    assert job["payload"] == {"task_id": "t1", "resume": True}
+    # 任务仍在执行中，重复恢复不会再次入队
+    assert recover_interrupted_tasks(queue) == 0
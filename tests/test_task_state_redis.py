@@ -0,0 +1,94 @@
+"""Redis 共享任务状态测试（fakeredis 模拟多个进程/节点连接同一个 Redis）"""
+import json
+
+import pytest
+
+from backend.services.task import GenerationTask
+from backend.services.task_store import RedisTaskStateStore
+from backend.utils.storage import RedisStorage
+
+fakeredis = pytest.importorskip("fakeredis")
+
+PAGES = [{"index": i, "type": "cover" if i == 0 else "content", "content": f"第 {i} 页"} for i in range(3)]
+TTL = 3600
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+def _store(server) -> RedisTaskStateStore:
+    """一个进程的任务状态（各自的 Redis 连接，连接同一个服务器）"""
+    return RedisTaskStateStore(RedisStorage(client=fakeredis.FakeRedis(server=server)), redis_ttl_seconds=TTL)
+
+
+def _create_task(store, task_dir) -> GenerationTask:
+    """进程 A 创建任务：封面已生成，第 1 页失败"""
+    task = GenerationTask(
+        "t1", str(task_dir), pages=PAGES, full_outline="大纲", user_topic="主题",
+        user_images=[b"user-image"], journal=store.create_journal("t1", str(task_dir))
+    )
+    task.journal.record_created(PAGES, "大纲", "主题", [b"user-image"])
+    task.cover_image = b"cover-image"
+    task.mark_generated(0, "0.png")
+    task.mark_failed(1, "服务商错误")
+    return task
+
+
+def test_journal_restores_in_another_process(server, tmp_path):
+    _create_task(_store(server), tmp_path / "node-a")
+
+    # 另一个节点没有本地日志文件，只能从 Redis 还原
+    other = _store(server)
+    task_dir = str(tmp_path / "node-b")
+    task = GenerationTask.restore("t1", task_dir, journal=other.create_journal("t1", task_dir))
+    assert task.pages == PAGES
+    assert task.full_outline == "大纲"
+    assert task.generated == {0: "0.png"}
+    assert task.failed == {1: "服务商错误"}
+    assert not task.finished
+    assert task.user_images == [b"user-image"]
+    assert task.cover_image == b"cover-image"
+
+
+def test_other_process_sees_latest_state(server, tmp_path):
+    store_a = _store(server)
+    store_b = _store(server)
+    task_dir = str(tmp_path / "t1")
+    task_a = store_a.put(_create_task(store_a, task_dir))
+    task_b = store_b.put(GenerationTask.restore("t1", task_dir, journal=store_b.create_journal("t1", task_dir)))
+
+    # 进程 A 完成了第 1 页：进程 B 的本地副本已过期，不再返回
+    task_a.mark_generated(1, "1.png")
+    assert store_b.get("t1") is None
+    restored = GenerationTask.restore("t1", task_dir, journal=store_b.create_journal("t1", task_dir))
+    assert restored.generated == {0: "0.png", 1: "1.png"}
+    assert restored.failed == {}
+
+    # 正在本进程中生成的任务直接使用本地副本
+    store_b.put(task_b)
+    store_b.pin("t1")
+    assert store_b.get("t1") is task_b
+
+
+def test_images_are_stored_by_reference(server, tmp_path):
+    store = _store(server)
+    task = _create_task(store, tmp_path / "t1")
+    client = fakeredis.FakeRedis(server=server)
+
+    # 日志记录中只有图片数量，图片数据保存在独立的键中
+    lines = [json.loads(line) for line in client.lrange("redink:tasks/t1/journal", 0, -1)]
+    assert lines[0]["type"] == "created"
+    assert lines[0]["user_images"] == 1
+    journal = b"".join(client.lrange("redink:tasks/t1/journal", 0, -1))
+    assert b"user-image" not in journal and b"cover-image" not in journal
+    assert client.get("redink:tasks/t1/refs/user_0") == b"user-image"
+    assert client.get("redink:tasks/t1/refs/cover") == b"cover-image"
+    for key in ("journal", "refs/user_0", "refs/cover"):
+        assert 0 < client.ttl(f"redink:tasks/t1/{key}") <= TTL
+
+    # 从内存释放后按引用从 Redis 重新加载
+    assert task.spill() > 0
+    assert task.cover_image == b"cover-image"
+    assert task.user_images == [b"user-image"]
@@ -0,0 +1,47 @@
+"""文本服务商错误分类测试"""
+from types import SimpleNamespace
+
+import pytest
+
+from backend.generators.base import ProviderHTTPError
+from backend.utils import text_client as text_client_module
+from backend.utils.circuit_breaker import CircuitBreaker
+from backend.utils.retry import ErrorKind, classify_error
+from backend.utils.text_client import TextChatClient
+
+
+def _client(monkeypatch, status_code, body=None):
+    breaker = CircuitBreaker("text", failure_threshold=2)
+    response = SimpleNamespace(status_code=status_code, text="error", headers={}, json=lambda: body)
+    monkeypatch.setattr(text_client_module.requests, "post", lambda *args, **kwargs: response)
+    return TextChatClient(api_key="key", base_url="https://example.com", circuit_breaker=breaker), breaker
+
+
+@pytest.mark.parametrize("status_code", [400, 401, 404])
+def test_client_errors_do_not_open_breaker(monkeypatch, status_code):
+    client, breaker = _client(monkeypatch, status_code)
+
+    for _ in range(3):
+        with pytest.raises(ProviderHTTPError) as exc_info:
+            client.generate_text("你好")
+        assert classify_error(exc_info.value) == ErrorKind.CLIENT
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_server_errors_open_breaker(monkeypatch):
+    client, breaker = _client(monkeypatch, 500)
+
+    for _ in range(2):
+        with pytest.raises(ProviderHTTPError) as exc_info:
+            client.generate_text("你好")
+        assert classify_error(exc_info.value) == ErrorKind.SERVER
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_malformed_success_response_does_not_open_breaker(monkeypatch):
+    client, breaker = _client(monkeypatch, 200, body={"choices": []})
+
+    for _ in range(3):
+        with pytest.raises(ProviderHTTPError):
+            client.generate_text("你好")
+    assert breaker.state == CircuitBreaker.CLOSED